@@ -0,0 +1,99 @@
+import os
+
+import cartopy
+import pytest
+from cmip6_dash import plot_utils
+from cmip6_dash import storage_utils
+from cmip6_dash.case_utils import get_case_data
+from cmip6_dash.synthetic_data import write_synthetic_catalog
+from cmip6_dash.wrangling_utils import get_esm_datastore
+
+# Set CMIP6_BENCH_DATA to a directory to keep the synthetic stores between runs,
+# otherwise they are written to a temporary directory for each session
+BENCH_DATA_ENV = "CMIP6_BENCH_DATA"
+
+# Per request latency (s) and bandwidth (bytes/s) of the stand-in for the bucket used
+# by the benchmarks marked as remote
+BENCH_LATENCY_ENV = "CMIP6_BENCH_LATENCY"
+BENCH_BANDWIDTH_ENV = "CMIP6_BENCH_BANDWIDTH"
+
+
+@pytest.fixture(scope="session")
+def synthetic_catalog(tmp_path_factory):
+    """Path to the catalog JSON of the synthetic stores used by every benchmark"""
+    root_dir = os.environ.get(BENCH_DATA_ENV)
+    if root_dir is None:
+        root_dir = str(tmp_path_factory.mktemp("synthetic_cmip6"))
+    write_synthetic_catalog(root_dir)
+    write_synthetic_catalog(
+        root_dir,
+        mod_id_list=["CanESM5", "CESM2"],
+        var_id_list=["ta"],
+        exp_id_list=["historical", "piControl"],
+        members=1,
+    )
+    return os.path.join(root_dir, "synthetic-cmip6.json")
+
+
+@pytest.fixture(scope="session")
+def data_store(synthetic_catalog):
+    return get_esm_datastore(synthetic_catalog)
+
+
+@pytest.fixture
+def remote_storage(data_store):
+    """Serves the synthetic stores from memory with the latency and bandwidth of a
+    remote bucket, returning the filesystem so its request counts can be checked"""
+    storage_utils.configure_storage("memory")
+    for zstore in data_store.df["zstore"]:
+        storage_utils.mirror_store(zstore, zstore)
+    storage_utils.configure_storage(
+        "memory",
+        latency=float(os.environ.get(BENCH_LATENCY_ENV, 0.02)),
+        bandwidth=float(os.environ.get(BENCH_BANDWIDTH_ENV, 100e6)),
+    )
+    yield storage_utils.get_storage_fs(data_store.df["zstore"].iloc[0])[0]
+    storage_utils.configure_storage()
+    storage_utils._storage_fs_cache.clear()
+
+
+@pytest.fixture(scope="session")
+def bc_case_def():
+    """The bc_case_mult case definition with CESM2 in place of HadGEM3"""
+    return {
+        "case_name": "bc_bench_case",
+        "var_id_list": ["tas", "lai"],
+        "mod_id_list": ["CanESM5", "CESM2"],
+        "exp_id": "historical",
+        "members": 3,
+        "start_date": "1950-01",
+        "end_date": "1955-02",
+        "top_left": [60, -139.05],
+        "bottom_right": [49, -114.068333],
+    }
+
+
+@pytest.fixture(scope="session")
+def bc_case_data(data_store, bc_case_def):
+    """The case loaded into memory, as the dashboard sees it after reading the
+    case netcdf files"""
+    case_data = get_case_data(data_store, bc_case_def)
+    for mod in case_data:
+        for var in case_data[mod]:
+            case_data[mod][var] = case_data[mod][var].load()
+    return case_data
+
+
+@pytest.fixture(autouse=True)
+def offline_coastlines(monkeypatch):
+    """Skips drawing coastlines if cartopy's natural earth coastlines have not been
+    downloaded, since fetching them needs the network"""
+    shapefile = os.path.join(
+        cartopy.config["data_dir"],
+        "shapefiles",
+        "natural_earth",
+        "physical",
+        "ne_110m_coastline.shp",
+    )
+    if not os.path.isfile(shapefile):
+        monkeypatch.setattr(plot_utils, "get_outline", lambda fig: fig)
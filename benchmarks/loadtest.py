@@ -0,0 +1,368 @@
+"""Replays recorded dashboard callback traces against a local gunicorn instance
+
+The app is served from synthetic CMIP6 stores (see cmip6_dash.synthetic_data) through
+the local storage backend, together with a small multi-member case, so runs need no
+network and are comparable between machines. Each simulated user replays the trace
+in order, like one browser session. Throughput, latency percentiles (overall and per
+callback) and the memory of every gunicorn worker are reported.
+
+Traces are files of Dash callback requests, one JSON body per line, as written by the
+app when CMIP6_TRACE_FILE is set. Examples:
+
+    python benchmarks/loadtest.py --workers 4 --threads 2 --users 8
+    python benchmarks/loadtest.py --workers 2 --threads 4 --users 8 --json run.json
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import psutil
+from cmip6_dash.case_utils import get_case_data
+from cmip6_dash.case_utils import write_case_definition
+from cmip6_dash.synthetic_data import write_synthetic_catalog
+from cmip6_dash.wrangling_utils import get_esm_datastore
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DASH_DIR = os.path.join(REPO_DIR, "dashdir")
+DEFAULT_TRACE = os.path.join(os.path.dirname(__file__), "traces", "browse.jsonl")
+
+# The case the traces select as a scenario, built from the synthetic stores
+LOADTEST_CASE = {
+    "case_name": "loadtest_case",
+    "var_id_list": ["tas"],
+    "mod_id_list": ["CanESM5", "CESM2"],
+    "exp_id": "historical",
+    "members": 3,
+    "start_date": "1950-01",
+    "end_date": "1955-02",
+    "top_left": (60, -139.05),
+    "bottom_right": (49, -114.068333),
+    "baseline": ("1950-01", "1952-12"),
+}
+
+
+def prepare_workdir(data_dir):
+    """Writes the synthetic stores, a pangeo-style catalog for the local storage
+    backend and the load test case (each only once), returning the directory the
+    app should be run from"""
+    json_path = write_synthetic_catalog(
+        data_dir, mod_id_list=["CanESM5", "CESM2"], var_id_list=["tas"], members=3
+    )
+    # Where the local backend looks for the pangeo catalog
+    shutil.copy(json_path, os.path.join(data_dir, "pangeo-cmip6.json"))
+
+    work_dir = os.path.join(data_dir, "app")
+    cases_dir = os.path.join(work_dir, "cases")
+    os.makedirs(cases_dir, exist_ok=True)
+    case_path = os.path.join(cases_dir, LOADTEST_CASE["case_name"] + ".json")
+    if not os.path.isfile(case_path):
+        write_case_definition(**LOADTEST_CASE, write_path=case_path)
+        with open(case_path) as read_file:
+            case_definition = json.load(read_file)
+        get_case_data(
+            get_esm_datastore(json_path), case_definition, write_path=cases_dir
+        )
+    return work_dir
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(work_dir, data_dir, port, workers, threads, gunicorn_args=()):
+    """Starts gunicorn serving app:server the way docker-compose.yml does, with the
+    stores read from data_dir"""
+    python_path = [os.path.join(REPO_DIR, "src"), DASH_DIR]
+    if os.environ.get("PYTHONPATH"):
+        python_path.append(os.environ["PYTHONPATH"])
+    env = dict(
+        os.environ,
+        CMIP6_STORAGE="local",
+        CMIP6_STORAGE_ROOT=data_dir,
+        PYTHONPATH=os.pathsep.join(python_path),
+    )
+    # Traces replayed by the server must not be recorded again
+    env.pop("CMIP6_TRACE_FILE", None)
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        f"--workers={workers}",
+        f"--threads={threads}",
+        f"--bind=127.0.0.1:{port}",
+        f"--chdir={work_dir}",
+        "--timeout=300",
+        *gunicorn_args,
+        "app:server",
+    ]
+    return subprocess.Popen(command, env=env)
+
+
+def wait_for_server(url, server, timeout=300):
+    """Waits until every worker has imported the app and answers /metrics"""
+    start = time.time()
+    while time.time() - start < timeout:
+        if server.poll() is not None:
+            print("The server exited before it was ready")
+            raise AssertionError
+        try:
+            with urllib.request.urlopen(url + "/metrics", timeout=5):
+                return
+        except OSError:
+            time.sleep(1)
+    print(f"The server did not answer within {timeout} s")
+    raise AssertionError
+
+
+def read_trace(trace_path):
+    """Reads a trace of callback request bodies, one JSON object per line"""
+    with open(trace_path) as read_file:
+        return [json.loads(line) for line in read_file if line.strip()]
+
+
+def post_callback(url, payload, timeout=300):
+    """Sends one callback request, returning (status, seconds)"""
+    data = json.dumps(payload).encode()
+    req = urllib.request.Request(
+        url + "/_dash-update-component",
+        data=data,
+        headers={"Content-Type": "application/json"},
+    )
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    except OSError:
+        status = None
+    return status, time.perf_counter() - start
+
+
+class MemorySampler(threading.Thread):
+    """Samples the resident memory of the children (workers) of a process"""
+
+    def __init__(self, pid, interval=0.25):
+        super().__init__(daemon=True)
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.peak = {}
+        self.last = {}
+        self._stop_event = threading.Event()
+
+    def sample(self):
+        for child in self.process.children(recursive=True):
+            try:
+                rss = child.memory_info().rss
+            except psutil.NoSuchProcess:
+                continue
+            self.last[child.pid] = rss
+            self.peak[child.pid] = max(rss, self.peak.get(child.pid, 0))
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.sample()
+
+
+def replay(url, trace, users, repeat=1):
+    """Replays trace repeat times for each of users concurrent users
+
+    Returns
+    -------
+    results : list of dict
+        output, status and seconds of every request
+    wall_time : float
+        Seconds from the first request to the last response
+    """
+
+    def run_user(user_num):
+        user_results = []
+        for _ in range(repeat):
+            for payload in trace:
+                status, seconds = post_callback(url, payload)
+                user_results.append(
+                    {"output": payload["output"], "status": status, "seconds": seconds}
+                )
+        return user_results
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        results = [
+            result for user in pool.map(run_user, range(users)) for result in user
+        ]
+    return results, time.perf_counter() - start
+
+
+def summarize(results, wall_time, memory=None):
+    """Throughput, latency percentiles and worker memory of a replay
+
+    Dash answers 204 when a callback prevents its update, which counts as a success
+    """
+    ok = [result for result in results if result["status"] in (200, 204)]
+    seconds = np.array([result["seconds"] for result in ok])
+
+    def percentiles(values):
+        if len(values) == 0:
+            return {"p50": None, "p95": None, "p99": None}
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {"p50": p50, "p95": p95, "p99": p99}
+
+    per_callback = {}
+    for output in sorted({result["output"] for result in results}):
+        values = [result["seconds"] for result in ok if result["output"] == output]
+        per_callback[output] = dict(count=len(values), **percentiles(values))
+
+    error_statuses = {}
+    for result in results:
+        if result["status"] not in (200, 204):
+            status = str(result["status"])
+            error_statuses[status] = error_statuses.get(status, 0) + 1
+
+    summary = {
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "error_statuses": error_statuses,
+        "wall_time": wall_time,
+        "throughput": len(ok) / wall_time,
+        "latency": percentiles(seconds),
+        "per_callback": per_callback,
+    }
+    if memory is not None:
+        summary["worker_memory_mb"] = {
+            str(pid): {"peak": peak / 1e6, "final": memory.last[pid] / 1e6}
+            for pid, peak in memory.peak.items()
+        }
+    return summary
+
+
+def print_summary(summary, config):
+    print()
+    print(", ".join(f"{key}={value}" for key, value in config.items()))
+    print(
+        f"{summary['requests']} requests, {summary['errors']} errors in "
+        f"{summary['wall_time']:.1f} s: {summary['throughput']:.2f} requests/s"
+    )
+    if summary["errors"]:
+        # None is a request that got no response (refused or timed out)
+        print(f"error statuses: {summary['error_statuses']}")
+    latency = summary["latency"]
+    if latency["p50"] is not None:
+        print(
+            f"latency p50 {latency['p50']:.3f} s, p95 {latency['p95']:.3f} s, "
+            f"p99 {latency['p99']:.3f} s"
+        )
+    print(f"{'callback outputs':<60} {'n':>5} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for output, stats in summary["per_callback"].items():
+        if stats["count"] == 0:
+            print(f"{output[:60]:<60} {0:>5}")
+            continue
+        print(
+            f"{output[:60]:<60} {stats['count']:>5} {stats['p50']:>8.3f} "
+            f"{stats['p95']:>8.3f} {stats['p99']:>8.3f}"
+        )
+    for pid, memory in summary.get("worker_memory_mb", {}).items():
+        print(
+            f"worker {pid}: peak {memory['peak']:.0f} MB, "
+            f"final {memory['final']:.0f} MB"
+        )
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--trace", default=DEFAULT_TRACE, help="Trace to replay")
+    parser.add_argument("--users", type=int, default=4, help="Concurrent users")
+    parser.add_argument("--repeat", type=int, default=1, help="Replays per user")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=2, help="Threads per worker")
+    parser.add_argument(
+        "--gunicorn-args", default="", help="Extra gunicorn arguments, e.g. --preload"
+    )
+    parser.add_argument(
+        "--data-dir",
+        default=os.environ.get("CMIP6_BENCH_DATA"),
+        help="Keeps the synthetic stores and case here between runs",
+    )
+    parser.add_argument(
+        "--url", help="Replay against an already running app instead of starting one"
+    )
+    parser.add_argument(
+        "--no-warmup",
+        action="store_true",
+        help="Skip replaying the trace once, unmeasured, before the run",
+    )
+    parser.add_argument("--json", help="Also write the summary to this file")
+    args = parser.parse_args(args)
+
+    trace = read_trace(args.trace)
+    config = {
+        "trace": os.path.basename(args.trace),
+        "users": args.users,
+        "repeat": args.repeat,
+    }
+    server = None
+    memory = None
+    data_dir = args.data_dir
+    if args.url is None:
+        if data_dir is None:
+            data_dir = tempfile.mkdtemp(prefix="cmip6_loadtest_")
+        work_dir = prepare_workdir(os.path.abspath(data_dir))
+        port = get_free_port()
+        url = f"http://127.0.0.1:{port}"
+        server = start_server(
+            work_dir,
+            os.path.abspath(data_dir),
+            port,
+            args.workers,
+            args.threads,
+            args.gunicorn_args.split(),
+        )
+        config.update(workers=args.workers, threads=args.threads)
+    else:
+        url = args.url.rstrip("/")
+
+    try:
+        if server is not None:
+            wait_for_server(url, server)
+            memory = MemorySampler(server.pid)
+            memory.start()
+        if not args.no_warmup:
+            replay(url, trace, users=1)
+        results, wall_time = replay(url, trace, args.users, args.repeat)
+        if memory is not None:
+            memory.stop()
+        summary = summarize(results, wall_time, memory)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if args.data_dir is None and data_dir is not None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    print_summary(summary, config)
+    if args.json:
+        with open(args.json, "w") as write_file:
+            json.dump(dict(config=config, **summary), write_file, indent=4)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import os
+import shutil
+
+import netCDF4
+import numpy as np
+import pytest
+from cmip6_dash import case_utils
+from cmip6_dash.case_utils import get_case_data
+from cmip6_dash.case_utils import get_case_encoding_key
+from cmip6_dash.case_utils import get_case_file_path
+from cmip6_dash.case_utils import get_point_series
+from cmip6_dash.case_utils import load_case_hovmoller
+from cmip6_dash.case_utils import load_case_quantiles
+from cmip6_dash.case_utils import load_case_trend
+from cmip6_dash.case_utils import open_case_file
+from cmip6_dash.case_utils import write_case_file
+from cmip6_dash.case_utils import write_case_hovmoller
+from cmip6_dash.case_utils import write_case_quantiles
+from cmip6_dash.case_utils import write_case_series
+
+
+def test_get_case_data(benchmark, data_store, bc_case_def, tmp_path):
+    case_folder = os.path.join(tmp_path, bc_case_def["case_name"])
+
+    def setup():
+        # The case folder can not exist before writing
+        shutil.rmtree(case_folder, ignore_errors=True)
+        return (data_store, bc_case_def), {"write_path": str(tmp_path)}
+
+    benchmark.pedantic(get_case_data, setup=setup, rounds=3)
+    # A file, its zonal and meridional means, its seasonal and annual means and its
+    # quantiles for each of the two models and variables, and the manifest
+    assert len(os.listdir(case_folder)) == 25
+
+
+@pytest.mark.parametrize("encoding", list(get_case_encoding_key()))
+def test_read_case_file(benchmark, bc_case_data, tmp_path, encoding):
+    # Reads a case file the way the map (one month of every member) and the line
+    # plots (the regional mean of every month) do. The file size is saved with the
+    # results as extra_info.
+    if "zstd" in encoding and not getattr(netCDF4, "__has_zstandard_support__", False):
+        pytest.skip("netCDF4 was built without zstd")
+    case_data = bc_case_data["CESM2"]["tas"]
+    file_path = str(tmp_path / "CESM2_tas.nc")
+    write_case_file(case_data, "tas", file_path, encoding)
+    benchmark.extra_info["file_bytes"] = os.path.getsize(file_path)
+
+    def read_case_file():
+        with open_case_file(file_path, "tas") as dset:
+            month = dset["tas"].isel(time=6).load()
+            series = dset["tas"].mean(["lat", "lon"]).load()
+        return month, series
+
+    month, series = benchmark(read_case_file)
+    expected = case_data["tas"].mean(["lat", "lon"])
+    assert np.allclose(series, expected, atol=0.01)
+
+
+@pytest.mark.parametrize("layout", ["series", "map"])
+def test_point_series(benchmark, bc_case_data, tmp_path, layout):
+    # Reads every member's series at one grid cell, from the point time series copy
+    # or from the case file when the case was built without one
+    case_data = bc_case_data["CESM2"]["tas"]
+    write_case_file(case_data, "tas", get_case_file_path(tmp_path, "CESM2", "tas"))
+    if layout == "series":
+        write_case_series(tmp_path, "CESM2", "tas")
+    series = benchmark(get_point_series, tmp_path, "CESM2", "tas", 55, -125)
+    assert series["tas"].shape == (3, case_data.sizes["time"])
+
+
+@pytest.mark.parametrize("written", [True, False], ids=["written", "computed"])
+def test_load_case_hovmoller(benchmark, bc_case_data, tmp_path, written):
+    # Loads the zonal mean written with a case, or streams it from the case file for
+    # cases built without it. The in-memory cache is cleared before every round.
+    case_data = bc_case_data["CESM2"]["tas"]
+    write_case_file(case_data, "tas", get_case_file_path(tmp_path, "CESM2", "tas"))
+    if written:
+        write_case_hovmoller(tmp_path, "CESM2", "tas")
+
+    def setup():
+        case_utils._hovmoller_cache.clear()
+
+    zonal = benchmark.pedantic(
+        load_case_hovmoller,
+        args=(tmp_path, "CESM2", "tas", "lat"),
+        setup=setup,
+        rounds=20,
+    )
+    assert zonal["tas"].dims == ("member_num", "time", "lat")
+
+
+def test_load_case_trend(benchmark, bc_case_data, tmp_path):
+    # Fits the trend of every grid cell and member of a case in one pass over the
+    # case file. The in-memory cache is cleared before every round.
+    case_data = bc_case_data["CESM2"]["tas"]
+    write_case_file(case_data, "tas", get_case_file_path(tmp_path, "CESM2", "tas"))
+
+    def setup():
+        case_utils._trend_cache.clear()
+
+    trend = benchmark.pedantic(
+        load_case_trend, args=(tmp_path, "CESM2", "tas"), setup=setup, rounds=20
+    )
+    assert trend["tas"].dims == ("member_num", "lat", "lon")
+
+
+@pytest.mark.parametrize("written", [True, False], ids=["written", "computed"])
+def test_load_case_quantiles(benchmark, bc_case_data, tmp_path, written):
+    # Loads the quantiles written with a case, or computes them from the case file a
+    # block of latitude rows at a time. The in-memory cache is cleared before every
+    # round.
+    case_data = bc_case_data["CESM2"]["tas"]
+    write_case_file(case_data, "tas", get_case_file_path(tmp_path, "CESM2", "tas"))
+    if written:
+        write_case_quantiles(tmp_path, "CESM2", "tas", [0.05, 0.95])
+
+    def setup():
+        case_utils._quantile_cache.clear()
+
+    result = benchmark.pedantic(
+        load_case_quantiles,
+        args=(tmp_path, "CESM2", "tas", [0.95]),
+        setup=setup,
+        rounds=20,
+    )
+    assert result["tas"].dims == ("quantile", "lat", "lon")
@@ -0,0 +1,34 @@
+import pytest
+from cmip6_dash.plot_utils import plot_member_line_comp
+from cmip6_dash.plot_utils import plot_model_comparisons
+from cmip6_dash.plot_utils import plot_year_plotly
+from cmip6_dash.wrangling_utils import get_cmpi6_model_run
+from cmip6_dash.wrangling_utils import get_month_and_year
+
+
+def test_plot_year_plotly_case(benchmark, bc_case_data):
+    dset = bc_case_data["CanESM5"]["tas"]
+    benchmark(plot_year_plotly, dset, "tas", "CanESM5", "02", "1952", "historical")
+
+
+@pytest.mark.parametrize("mod_id", ["CanESM5", "CESM2"])
+def test_plot_year_plotly_global(benchmark, data_store, mod_id):
+    dset = get_cmpi6_model_run(data_store, "tas", mod_id, "historical")[0]
+    benchmark(plot_year_plotly, dset, "tas", mod_id, "02", "1952", "historical")
+
+
+def test_plot_model_comparisons(benchmark, data_store):
+    dsets = tuple(
+        get_month_and_year(
+            get_cmpi6_model_run(data_store, "tas", mod_id, "historical")[0],
+            "tas",
+            "02",
+            "1952",
+        ).load()
+        for mod_id in ("CanESM5", "CESM2")
+    )
+    benchmark(plot_model_comparisons, dsets, "tas", "CanESM5", "CESM2")
+
+
+def test_plot_member_line_comp(benchmark, bc_case_data):
+    benchmark(plot_member_line_comp, bc_case_data["CESM2"]["tas"], "tas")
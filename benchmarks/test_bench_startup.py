@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds importing each module may take in a fresh interpreter. Multiply them with
+# CMIP6_BENCH_IMPORT_SCALE on slow machines.
+IMPORT_BUDGETS = {
+    "cmip6_dash.case_registry": 1.2,
+    "cmip6_dash.plot_utils": 1.2,
+    "cmip6_dash.wrangling_utils": 1.2,
+    "app": 3.0,
+}
+IMPORT_SCALE_ENV = "CMIP6_BENCH_IMPORT_SCALE"
+
+# Loaded on first use, never while importing
+LAZY_MODULES = ["cartopy", "intake", "plotly.express", "pooch"]
+
+
+def import_module(module, work_dir):
+    """Imports module in a fresh interpreter, returning the seconds the import took and
+    which of LAZY_MODULES it loaded"""
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "seconds = time.perf_counter() - start\n"
+        f"lazy = [name for name in {LAZY_MODULES!r} if name in sys.modules]\n"
+        "print(json.dumps({'seconds': seconds, 'loaded': lazy}))\n"
+    )
+    python_path = [os.path.join(REPO_DIR, "src"), os.path.join(REPO_DIR, "dashdir")]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(python_path))
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=work_dir,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+@pytest.mark.parametrize("module", list(IMPORT_BUDGETS))
+def test_import_time(benchmark, module, tmp_path):
+    # app is imported the way gunicorn does, from a folder of cases. The time of the
+    # whole interpreter start is benchmarked, the import alone is checked against
+    # the budget and saved as extra_info.
+    os.makedirs(tmp_path / "cases")
+    results = []
+
+    def run():
+        results.append(import_module(module, str(tmp_path)))
+
+    benchmark.pedantic(run, rounds=3)
+    seconds = min(result["seconds"] for result in results)
+    benchmark.extra_info["import_seconds"] = seconds
+    assert results[0]["loaded"] == []
+    budget = IMPORT_BUDGETS[module] * float(os.environ.get(IMPORT_SCALE_ENV, 1))
+    assert seconds < budget
@@ -0,0 +1,93 @@
+import shutil
+
+import pytest
+from cmip6_dash import storage_utils
+from cmip6_dash.wrangling_utils import get_cmpi6_model_run
+from cmip6_dash.wrangling_utils import get_month_and_year
+from cmip6_dash.wrangling_utils import get_month_and_year_for_models
+
+
+@pytest.mark.parametrize("members", [1, 3])
+def test_get_cmip6_model_run(benchmark, data_store, members):
+    dsets = benchmark(
+        get_cmpi6_model_run, data_store, "tas", "CESM2", "historical", members
+    )
+    assert len(dsets) == members
+
+
+@pytest.mark.parametrize("members", [1, 3])
+def test_get_cmip6_model_run_remote(benchmark, data_store, remote_storage, members):
+    def open_and_slice():
+        dsets = get_cmpi6_model_run(data_store, "tas", "CESM2", "historical", members)
+        return [get_month_and_year(dset, "tas", "02", "1952").load() for dset in dsets]
+
+    var_data = benchmark(open_and_slice)
+    assert len(var_data) == members
+    assert remote_storage.stats["requests"] > 0
+
+
+@pytest.mark.parametrize("max_workers", [1, 8], ids=["sequential", "concurrent"])
+def test_open_members_remote(benchmark, data_store, remote_storage, max_workers):
+    # Only the metadata round trips of opening each member
+    dsets = benchmark(
+        get_cmpi6_model_run,
+        data_store,
+        "tas",
+        "CESM2",
+        "historical",
+        3,
+        max_workers=max_workers,
+    )
+    assert len(dsets) == 3
+
+
+@pytest.mark.parametrize("warm", [False, True], ids=["cold", "warm"])
+def test_chunk_cache_remote(benchmark, data_store, remote_storage, tmp_path, warm):
+    # A developer mode map request (open, slice, load) through the chunk cache
+    def configure_cache():
+        shutil.rmtree(tmp_path / "chunks", ignore_errors=True)
+        storage_utils._storage_fs_cache.clear()
+        storage_utils.configure_storage(
+            "memory",
+            latency=remote_storage.latency,
+            bandwidth=remote_storage.bandwidth,
+            chunk_cache=str(tmp_path / "chunks"),
+        )
+        if warm:
+            open_and_slice()
+        return (), {}
+
+    def open_and_slice():
+        dset = get_cmpi6_model_run(data_store, "ta", "CESM2", "historical")[0]
+        return get_month_and_year(dset, "ta", "02", "1952").load()
+
+    var_data = benchmark.pedantic(open_and_slice, setup=configure_cache, rounds=5)
+    assert var_data.shape == (192, 288)
+
+
+@pytest.mark.parametrize("var_id", ["tas", "ta"])
+def test_get_month_and_year(benchmark, data_store, var_id):
+    dset = get_cmpi6_model_run(data_store, var_id, "CESM2", "historical")[0]
+
+    def slice_and_load():
+        return get_month_and_year(dset, var_id, "02", "1952").load()
+
+    var_data = benchmark(slice_and_load)
+    assert var_data.shape == (192, 288)
+
+
+@pytest.mark.parametrize("max_workers", [1, None], ids=["sequential", "concurrent"])
+def test_month_and_year_for_models_remote(
+    benchmark, data_store, remote_storage, max_workers
+):
+    # The comparison histogram's fetch, one model at a time vs all at once
+    slices = benchmark(
+        get_month_and_year_for_models,
+        data_store,
+        "tas",
+        ["CanESM5", "CESM2"],
+        "02",
+        "1952",
+        max_workers=max_workers,
+    )
+    assert len(slices) == 2
@@ -1,52 +1,436 @@
 import json
+import logging
 import os
-import re
+import threading
+import time
+from functools import lru_cache
+from html import escape
+from urllib.parse import urlencode
 
 import dash
 import dash_bootstrap_components as dbc
 import numpy as np
-import xarray as xr
+from cmip6_dash.case_registry import get_case_entry
+from cmip6_dash.case_registry import get_case_opts
+from cmip6_dash.case_registry import get_case_signature
+from cmip6_dash.case_registry import is_date_in_case
+from cmip6_dash.case_utils import aggregate_climatology
+from cmip6_dash.case_utils import get_aggregate_period
+from cmip6_dash.case_utils import get_anomaly
+from cmip6_dash.case_utils import get_case_file_path
+from cmip6_dash.case_utils import get_point_series
+from cmip6_dash.case_utils import get_resolution_key
 from cmip6_dash.case_utils import join_members
+from cmip6_dash.case_utils import load_case_climatology
+from cmip6_dash.case_utils import load_case_hovmoller
+from cmip6_dash.case_utils import load_case_quantiles
+from cmip6_dash.case_utils import load_case_trend
+from cmip6_dash.case_utils import open_case_aggregate
+from cmip6_dash.case_utils import open_case_file
+from cmip6_dash.ensemble_utils import get_case_ensemble_stat
+from cmip6_dash.ensemble_utils import get_member_opts
+from cmip6_dash.ensemble_utils import is_ensemble_stat
+from cmip6_dash.ensemble_utils import select_member
+from cmip6_dash.export_utils import acquire_export_slot
+from cmip6_dash.export_utils import ExportStream
+from cmip6_dash.export_utils import get_export_format_key
+from cmip6_dash.export_utils import parse_export_args
+from cmip6_dash.export_utils import release_export_slot
+from cmip6_dash.export_utils import select_subset
+from cmip6_dash.extremes_utils import DEFAULT_QUANTILES
+from cmip6_dash.extremes_utils import get_heatmap_opts
+from cmip6_dash.extremes_utils import get_quantile_label
+from cmip6_dash.metrics_utils import get_metrics_text
+from cmip6_dash.metrics_utils import METRICS_LOG_ENV
+from cmip6_dash.metrics_utils import record_span
+from cmip6_dash.metrics_utils import register_lru_cache
+from cmip6_dash.metrics_utils import timed
+from cmip6_dash.plot_utils import plot_difference_map
+from cmip6_dash.plot_utils import plot_hovmoller
 from cmip6_dash.plot_utils import plot_member_line_comp
 from cmip6_dash.plot_utils import plot_model_comparisons
+from cmip6_dash.plot_utils import plot_point_series
+from cmip6_dash.plot_utils import plot_quantile_map
+from cmip6_dash.plot_utils import plot_trend_map
 from cmip6_dash.plot_utils import plot_year_plotly
+from cmip6_dash.profile_utils import finish_profile
+from cmip6_dash.profile_utils import get_profile_config
+from cmip6_dash.profile_utils import list_profiles
+from cmip6_dash.profile_utils import load_profile
+from cmip6_dash.profile_utils import PROFILE_HEADER
+from cmip6_dash.profile_utils import should_profile
+from cmip6_dash.profile_utils import start_profile
+from cmip6_dash.reduction_utils import lat_weights
+from cmip6_dash.reduction_utils import meridional_mean
+from cmip6_dash.reduction_utils import weighted_mean
+from cmip6_dash.reduction_utils import weighted_std
+from cmip6_dash.reduction_utils import zonal_mean
+from cmip6_dash.regrid_utils import align_datasets
+from cmip6_dash.regrid_utils import regrid_to_common_grid
 from cmip6_dash.wrangling_utils import dict_to_dash_opts
 from cmip6_dash.wrangling_utils import get_cmpi6_model_run
+from cmip6_dash.wrangling_utils import get_cmpi6_model_runs
 from cmip6_dash.wrangling_utils import get_esm_datastore
 from cmip6_dash.wrangling_utils import get_experiment_key
 from cmip6_dash.wrangling_utils import get_model_key
 from cmip6_dash.wrangling_utils import get_month_and_year
+from cmip6_dash.wrangling_utils import get_month_and_year_for_models
 from cmip6_dash.wrangling_utils import get_var_key
 from dash import dcc
 from dash import html
 from dash.dependencies import Input
 from dash.dependencies import Output
 from dash.exceptions import PreventUpdate
+from flask import abort
 from flask import Flask
+from flask import g
+from flask import request
+from flask import Response
 
 server = Flask(__name__)
 
 app = dash.Dash(
+    # Named explicitly, otherwise dash inspects the call stack which is slow on import
+    __name__,
     server=server,
     requests_pathname_prefix="/cmip6dash/",
     external_stylesheets=[dbc.themes.BOOTSTRAP],
     suppress_callback_exceptions=True,  # because of the tabs, not all callbacks are accessible so we suppress callback exceptions
 )
 
+# Structured logs of every timed span, see metrics_utils
+if os.environ.get(METRICS_LOG_ENV):
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+# Set to a file path to append every callback request to it as a JSON line, giving a
+# trace that benchmarks/loadtest.py can replay
+TRACE_FILE_ENV = "CMIP6_TRACE_FILE"
+
+
+@server.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.profile = None
+    if request.path.endswith("_dash-update-component"):
+        if should_profile(PROFILE_HEADER in request.headers):
+            g.profile = start_profile()
+
+
+@server.after_request
+def record_request_time(response):
+    """Times whole callback requests. Compared with the callback.* spans this shows
+    the time spent decoding inputs and serializing figures to JSON. Profiled requests
+    and traces are written out here along with their inputs."""
+    if request.path.endswith("_dash-update-component"):
+        callback_request = request.get_json(silent=True) or {}
+        record_span(
+            "dash_update_request",
+            time.perf_counter() - g.request_start,
+            output=callback_request.get("output"),
+            response_bytes=response.calculate_content_length(),
+        )
+        if os.environ.get(TRACE_FILE_ENV):
+            # One write per line so lines from different workers do not interleave
+            with open(os.environ[TRACE_FILE_ENV], "a") as trace_file:
+                trace_file.write(json.dumps(callback_request) + "\n")
+        if g.profile is not None:
+            finish_profile(
+                g.profile,
+                callback_request.get("output"),
+                callback_request.get("inputs"),
+            )
+            g.profile = None
+    return response
+
+
+@server.teardown_request
+def stop_failed_profile(exception):
+    """Writes out (and so releases) the profile of a request that failed before
+    record_request_time() could"""
+    if exception is not None and g.get("profile") is not None:
+        finish_profile(g.profile, f"failed: {request.path}")
+        g.profile = None
+
+
+@server.route("/metrics")
+def metrics():
+    """Prometheus metrics of this worker"""
+    return Response(get_metrics_text(), mimetype="text/plain; version=0.0.4")
+
+
+@server.route("/admin/profiles")
+def profile_index():
+    """Lists the recent request profiles of every worker, only when profiling is
+    enabled (see profile_utils.get_profile_config())"""
+    if not get_profile_config()["enabled"]:
+        abort(404)
+    rows = [
+        f"<tr><td><a href='profiles/{profile['id']}'>{profile['time']}</a></td>"
+        f"<td>{profile['duration']:.3f}</td><td>{profile['pid']}</td>"
+        f"<td>{escape(str(profile['name']))}</td></tr>"
+        for profile in list_profiles()
+    ]
+    return (
+        "<h2>Recent profiles</h2><table><tr><th>Time</th><th>Duration (s)</th>"
+        "<th>Worker</th><th>Callback outputs</th></tr>" + "".join(rows) + "</table>"
+    )
+
+
+@server.route("/admin/profiles/<profile_id>")
+def profile_detail(profile_id):
+    """Shows one profile: its inputs, cumulative time and allocation sites"""
+    profile = load_profile(profile_id) if get_profile_config()["enabled"] else None
+    if profile is None:
+        abort(404)
+    sections = [
+        ("Callback outputs", profile["name"]),
+        ("Callback inputs", json.dumps(profile["inputs"], indent=2)),
+        ("Duration (s)", f"{profile['duration']:.3f}"),
+        ("Peak traced memory (bytes)", profile["peak_traced_bytes"]),
+        ("Top functions by cumulative time", profile["cumulative_stats"]),
+        ("Top allocation sites", "\n".join(profile["memory_diff"])),
+    ]
+    body = "".join(
+        f"<h3>{title}</h3><pre>{escape(str(content))}</pre>"
+        for title, content in sections
+    )
+    link = f"<p><a href='{profile_id}.prof'>Download the raw cProfile stats</a></p>"
+    return f"<h2>Profile {escape(profile_id)}</h2>" + link + body
+
+
+@server.route("/admin/profiles/<profile_id>.prof")
+def profile_download(profile_id):
+    """The raw cProfile stats of a profile, for snakeviz or pstats"""
+    profile_dir = get_profile_config()["profile_dir"]
+    file_path = os.path.join(profile_dir, os.path.basename(profile_id) + ".prof")
+    if not get_profile_config()["enabled"] or not os.path.isfile(file_path):
+        abort(404)
+    with open(file_path, "rb") as read_file:
+        return Response(read_file.read(), mimetype="application/octet-stream")
+
+
+@server.route("/export")
+def export_subset():
+    """Streams a subset of a case file as NetCDF, Zarr (zipped) or CSV, see
+    export_utils.parse_export_args() for the query arguments. Each worker streams
+    get_export_config()["max_exports"] exports at once and refuses further ones with
+    a 503 rather than tying up the threads serving the dashboard."""
+    try:
+        export = parse_export_args(request.args)
+    except ValueError as error:
+        abort(400, str(error))
+    try:
+        case_files = get_case_entry(path, export["case"])["files"]
+    except KeyError:
+        abort(404)
+    if (export["model"], export["var"]) not in case_files:
+        abort(404)
+    file_path = case_files[(export["model"], export["var"])]["path"]
+    if not acquire_export_slot():
+        return Response(
+            "Too many exports in progress, try again shortly\n",
+            status=503,
+            headers={"Retry-After": "10"},
+        )
+    try:
+        dset = open_case_file(file_path, export["var"])
+    except Exception:
+        release_export_slot()
+        raise
+    try:
+        subset = select_subset(dset, export["var"], **export)
+    except Exception as error:
+        dset.close()
+        release_export_slot()
+        if isinstance(error, ValueError):
+            abort(400, str(error))
+        raise
+    if 0 in subset[export["var"]].shape:
+        dset.close()
+        release_export_slot()
+        abort(400, "The selection is empty")
+
+    export_format = get_export_format_key()[export["format"]]
+    case_name = export["case"].split(".")[0]
+    file_name = f"{case_name}_{export['model']}_{export['var']}"
+    file_name += export_format["extension"]
+    return Response(
+        # Closed by the server whether or not it was read, releasing the slot
+        ExportStream(subset, export["var"], export["format"], dset),
+        mimetype=export_format["mimetype"],
+        headers={"Content-Disposition": f"attachment; filename={file_name}"},
+    )
+
+
+# The ESM datastore is opened by the first callback in developer mode rather than at
+# import, so workers boot without fetching the catalog and sessions looking only at
+# cases never fetch it
+_col = None
+_col_lock = threading.Lock()
+
+
+def get_col():
+    """Returns the ESM datastore, opening it on first use"""
+    global _col
+    with _col_lock:
+        if _col is None:
+            _col = get_esm_datastore()
+        return _col
 
-# Grabbing the ESM datastore
-col = get_esm_datastore()
 
 var_key = get_var_key()
 mod_key = get_model_key()
 exp_key = get_experiment_key()
-# Getting the names of the cases for the dropdown
+# The cases offered are read from an index of this folder that is refreshed when
+# definitions or case files are added, edited or removed (see case_registry)
 path = "cases/"
-cases = os.listdir(path)
-cases = [case for case in cases if re.search(r".json$", case)]
-case_defs = [{"label": "Developer Mode", "value": "None"}]
-for case in cases:
-    case_defs.append({"label": case, "value": case})
+
+
+display_opts = [
+    {"label": "Absolute Values", "value": "absolute"},
+    {"label": "Anomaly From Baseline", "value": "anomaly"},
+]
+
+
+def get_case_climatology(scenario_drop, mod_id, var_id, display="absolute"):
+    """Returns the cached baseline climatology of a case if anomalies are requested
+    and the case was built with a baseline, otherwise None"""
+    if display != "anomaly" or scenario_drop == "None":
+        return None
+    folder_path = path + scenario_drop.split(".")[0]
+    return load_case_climatology(folder_path, mod_id, var_id)
+
+
+def open_case_dset(
+    scenario_drop, mod_id, var_id, member=None, display="absolute", resolution="monthly"
+):
+    """Opens the case file for a model and variable, resolving the member selection
+
+    Ensemble statistics are served from the per-case cache in ensemble_utils, so
+    they are only computed the first time they are selected for a case. Anomalies
+    subtract the climatology cached with the case so the baseline is never re-read.
+    Seasonal and annual means are read from the aggregates written with the case,
+    with the climatology aggregated the same way for anomalies.
+    """
+    folder_path = path + scenario_drop.split(".")[0]
+    clim = get_case_climatology(scenario_drop, mod_id, var_id, display)
+    if resolution == "monthly":
+        file_path = get_case_file_path(folder_path, mod_id, var_id)
+        dset = None
+    else:
+        file_path = get_case_file_path(folder_path, mod_id, var_id, resolution)
+        dset = open_case_aggregate(folder_path, mod_id, var_id, resolution)
+        if clim is not None:
+            calendar = dset["time"].dt.calendar
+            clim = aggregate_climatology(clim, var_id, resolution, calendar)
+    if member is not None and is_ensemble_stat(member) and os.path.isfile(file_path):
+        return get_case_ensemble_stat(file_path, var_id, member, clim)
+    if dset is None:
+        dset = open_case_file(file_path, var_id)
+    if clim is not None:
+        dset = get_anomaly(dset, var_id, clim)
+    if member is None:
+        return dset
+    return select_member(dset, var_id, member)
+
+
+@lru_cache(maxsize=16)
+def get_aligned_pair(
+    scenario_drop,
+    var_id,
+    mod_id,
+    mod_comp_id,
+    exp_id,
+    member,
+    display,
+    resolution,
+    case_signature=None,
+):
+    """Returns the selected model and comparison model on their common grid
+
+    The lazily regridded datasets are cached per selection so switching months only
+    slices the existing time chunks instead of opening and regridding again. For
+    cases, case_signature (see case_registry.get_case_signature()) is part of the
+    key, so a case rebuilt or updated while the app runs is opened again rather
+    than served from the replaced files.
+    """
+    if scenario_drop == "None":
+        runs = get_cmpi6_model_runs(get_col(), var_id, [mod_id, mod_comp_id], exp_id)
+        dsets = [run[0] for run in runs]
+    else:
+        dsets = [
+            open_case_dset(scenario_drop, mod, var_id, member, display, resolution)
+            for mod in (mod_id, mod_comp_id)
+        ]
+    return tuple(align_datasets(dsets, var_id))
+
+
+register_lru_cache("aligned_pair", get_aligned_pair)
+
+
+def get_comp_models(mod_comp_drop):
+    """Returns the comparison model selection as a list, accepting the single model
+    id sent by traces recorded before the dropdown allowed several"""
+    if mod_comp_drop is None:
+        return []
+    if isinstance(mod_comp_drop, str):
+        return [mod_comp_drop]
+    return list(mod_comp_drop)
+
+
+def check_case_date(
+    scenario_drop, date_input, var_id, models, resolution="monthly", exp_id=None
+):
+    """Stops a callback in case mode when the date (or its whole season or year at
+    a coarser resolution) is outside the months on disk for any of the models,
+    rather than plotting an empty selection. Maps of piControl runs (exp_id) are
+    drawn from the last year on disk whatever the year, so only the month counts."""
+    if scenario_drop == "None":
+        return
+    for mod_id in models:
+        if not is_date_in_case(
+            path,
+            scenario_drop,
+            date_input,
+            mod_id,
+            var_id,
+            resolution,
+            ignore_year=exp_id == "piControl",
+        ):
+            raise PreventUpdate
+
+
+def get_resolution_date(scenario_drop, date_input, resolution="monthly"):
+    """Returns the [year, month] to select and the part of a figure title describing
+    the temporal resolution
+
+    Aggregates are labelled with the first month of their period, so any month of a
+    season or year selects its mean. Developer mode only has monthly data.
+    """
+    if scenario_drop == "None" or resolution == "monthly":
+        return date_input.split("/"), ""
+    start, end = get_aggregate_period(date_input, resolution)
+    return start.split("-"), f" ({start} to {end} mean)"
+
+
+def get_selection_values(selection):
+    """Returns the values and cos(lat) area weights of the heatmap points in a box or
+    lasso selection as numpy arrays"""
+    points = [point for point in selection["points"] if "marker.color" in point]
+    values = np.array([point["marker.color"] for point in points], dtype="float64")
+    weights = lat_weights([point["y"] for point in points])
+    return values, weights
+
+
+def get_display_label(scenario_drop, mod_id, var_id, display="absolute"):
+    """Returns the part of a figure title describing the display mode"""
+    if display != "anomaly":
+        return ""
+    clim = get_case_climatology(scenario_drop, mod_id, var_id, display)
+    if clim is None:
+        return " (no baseline available, showing absolute values)"
+    return f" (anomaly from {clim[var_id].attrs['baseline_period']} baseline)"
+
 
 # Plot displaying heatmap of selected run card
 climate_heatmap_card = [
@@ -72,6 +456,73 @@ climate_heatmap_card = [
     )
 ]
 
+# Time series of every member at the grid cell clicked on the heatmap, for cases
+climate_heatmap_card.append(
+    dcc.Loading(
+        dbc.Card(
+            [
+                dbc.CardHeader(
+                    "Click a grid cell of a case map to see its time series",
+                    id="point_series_title",
+                    style={"fontWeight": "bold"},
+                ),
+                dbc.CardBody(
+                    dcc.Graph(
+                        id="point_series",
+                        style={
+                            "border-width": "0",
+                            "width": "100%",
+                            "height": "100%",
+                        },
+                    )
+                ),
+            ]
+        )
+    )
+)
+
+# Download of the selected case, model, variable and member over the months entered
+# and the region selected on the heatmap, see export_subset()
+climate_heatmap_card.append(
+    dbc.Card(
+        [
+            dbc.CardHeader(
+                "Export the selected data (box select a region of a case map)",
+                style={"fontWeight": "bold"},
+            ),
+            dbc.CardBody(
+                dbc.Row(
+                    [
+                        dbc.Col(
+                            dcc.Input(
+                                id="export_start",
+                                placeholder="Start YYYY/MM (case start)",
+                                style={"border-width": "0", "width": "100%"},
+                            )
+                        ),
+                        dbc.Col(
+                            dcc.Input(
+                                id="export_end",
+                                placeholder="End YYYY/MM (case end)",
+                                style={"border-width": "0", "width": "100%"},
+                            )
+                        ),
+                        dbc.Col(
+                            dcc.RadioItems(
+                                id="export_format",
+                                options=dict_to_dash_opts(get_export_format_key()),
+                                value="netcdf",
+                                inline=True,
+                            )
+                        ),
+                        dbc.Col(html.A("Download", id="export_link")),
+                    ]
+                )
+            ),
+        ]
+    )
+)
+
 # Comparison tab-
 comp_tab_contents = dbc.Col(
     [
@@ -95,6 +546,26 @@ comp_tab_contents = dbc.Col(
                 ]
             )
         ),
+        dcc.Loading(
+            dbc.Card(
+                [
+                    dbc.CardHeader(  # Difference between the models
+                        id="diff_map_title",
+                        style={"fontWeight": "bold"},
+                    ),
+                    dbc.CardBody(
+                        dcc.Graph(
+                            id="difference_map",
+                            style={
+                                "border-width": "0",
+                                "width": "100%",
+                                "height": "100%",
+                            },
+                        )
+                    ),
+                ]
+            )
+        ),
         dcc.Loading(
             dbc.Card(
                 [
@@ -119,105 +590,222 @@ comp_tab_contents = dbc.Col(
 )
 
 
-# Dropdowns for specifying contents of the graphs
-dashboard_controls = dbc.Col(
+# Hovmöller tab- zonal or meridional means of a case against time
+hovmoller_tab_contents = dbc.Col(
     [
-        html.H6("Scenario"),
-        dcc.Dropdown(id="scenario_drop", value="None", options=case_defs),
-        html.Br(),
-        html.H6("Model Variable"),
-        dcc.Dropdown(id="var_drop", value="tas", options=dict_to_dash_opts(var_key)),
-        html.Br(),
-        html.H6("Model"),
-        dcc.Dropdown(
-            id="mod_drop", value="CanESM5", options=dict_to_dash_opts(mod_key)
-        ),
-        html.Br(),
-        html.H6("Model Comparison"),
-        dcc.Dropdown(
-            id="mod_comp_drop", value="CESM2", options=dict_to_dash_opts(mod_key)
-        ),
-        html.Br(),
-        html.H6("Date YYYY/MM"),
-        dcc.Input(
-            id="date_input",
-            value="1975/02",
-            style={"border-width": "0", "width": "100%"},
+        dcc.RadioItems(
+            id="hovmoller_drop",
+            value="lat",
+            options=[
+                {"label": "Zonal Mean (Time x Latitude)", "value": "lat"},
+                {"label": "Meridional Mean (Time x Longitude)", "value": "lon"},
+            ],
+            inline=True,
+            inputStyle={"margin-right": 5, "margin-left": 15},
         ),
-        html.Br(),
-        html.Br(),
-        html.H6("Experiment Label"),
-        dcc.Dropdown(
-            id="exp_drop",
-            value="historical",
-            options=dict_to_dash_opts(exp_key),
+        dcc.Loading(
+            dbc.Card(
+                [
+                    dbc.CardHeader(
+                        "Select a case to see its Hovmöller diagram",
+                        id="hovmoller_title",
+                        style={"fontWeight": "bold"},
+                    ),
+                    dbc.CardBody(
+                        dcc.Graph(
+                            id="hovmoller",
+                            style={
+                                "border-width": "0",
+                                "width": "100%",
+                                "height": "100%",
+                            },
+                        )
+                    ),
+                ]
+            )
         ),
-        html.Br(),
-        html.H6("Mean"),
-        dbc.Card(dbc.CardBody(id="mean_card")),
-        html.Br(),
-        html.H6("Std. Dev"),
-        dbc.Card(dbc.CardBody(id="var_card")),
-    ],
-    md=2,
-    style={
-        "background-color": "#e6e6e6",
-        "padding": 15,
-        "border-radius": 3,
-    },
+    ]
 )
 
 
-app.layout = dbc.Container(
+# Trend tab- linear trend of every grid cell of a case over a period
+trend_tab_contents = dbc.Col(
     [
         dbc.Row(
             [
                 dbc.Col(
-                    [
-                        html.H1(  # The big blue header
-                            "CMIP-6 Dashboard",
+                    dcc.Input(
+                        id="trend_start",
+                        debounce=True,
+                        placeholder="Start YYYY/MM (case start)",
+                        style={"border-width": "0", "width": "100%"},
+                    )
+                ),
+                dbc.Col(
+                    dcc.Input(
+                        id="trend_end",
+                        debounce=True,
+                        placeholder="End YYYY/MM (case end)",
+                        style={"border-width": "0", "width": "100%"},
+                    )
+                ),
+            ]
+        ),
+        html.Br(),
+        dcc.Loading(
+            dbc.Card(
+                [
+                    dbc.CardHeader(
+                        "Select a case to see its trends",
+                        id="trend_title",
+                        style={"fontWeight": "bold"},
+                    ),
+                    dbc.CardBody(
+                        dcc.Graph(
+                            id="trend_map",
                             style={
-                                "color": "white",
-                                "text-align": "left",
-                                "font-size": "48px",
+                                "border-width": "0",
+                                "width": "100%",
+                                "height": "100%",
                             },
                         )
-                    ],
-                    style={
-                        "backgroundColor": "steelblue",
-                        "border-radius": 3,
-                        "padding": 15,
-                        "margin-top": 20,
-                        "margin-bottom": 20,
-                        "margin-right": 15,
-                    },
-                )
-            ]
-        ),
-        dbc.Row(  # The tabs
-            [
-                dcc.Tabs(
-                    id="tab_switch",
-                    value="map_tab",
-                    children=[
-                        dcc.Tab(label="Climate Map", value="map_tab"),
-                        dcc.Tab(label="Compare", value="comp_tab"),
-                    ],
-                )
-            ]
-        ),
-        dbc.Row(  # The sidebar with controls
-            [
-                dashboard_controls,
-                dbc.Col(id="tab_switch_content"),
-            ]
+                    ),
+                ]
+            )
         ),
-        html.Hr(),
-        html.P(""),
     ]
 )
 
 
+# Dropdowns for specifying contents of the graphs
+def get_dashboard_controls():
+    """Builds the sidebar, offering the cases defined right now as scenarios"""
+    return dbc.Col(
+        [
+            html.H6("Scenario"),
+            dcc.Dropdown(id="scenario_drop", value="None", options=get_case_opts(path)),
+            html.Br(),
+            html.H6("Model Variable"),
+            dcc.Dropdown(
+                id="var_drop", value="tas", options=dict_to_dash_opts(var_key)
+            ),
+            html.Br(),
+            html.H6("Model"),
+            dcc.Dropdown(
+                id="mod_drop", value="CanESM5", options=dict_to_dash_opts(mod_key)
+            ),
+            html.Br(),
+            html.H6("Model Comparison"),
+            dcc.Dropdown(
+                id="mod_comp_drop",
+                value=["CESM2"],
+                options=dict_to_dash_opts(mod_key),
+                multi=True,
+            ),
+            html.Br(),
+            html.H6("Date YYYY/MM"),
+            dcc.Input(
+                id="date_input",
+                value="1975/02",
+                style={"border-width": "0", "width": "100%"},
+            ),
+            html.Br(),
+            html.Br(),
+            html.H6("Temporal Resolution"),
+            dcc.Dropdown(
+                id="resolution_drop",
+                value="monthly",
+                options=dict_to_dash_opts(get_resolution_key()),
+            ),
+            html.Br(),
+            html.H6("Heatmap"),
+            dcc.Dropdown(id="heatmap_drop", value="month", options=get_heatmap_opts()),
+            html.Br(),
+            html.H6("Experiment Label"),
+            dcc.Dropdown(
+                id="exp_drop",
+                value="historical",
+                options=dict_to_dash_opts(exp_key),
+            ),
+            html.Br(),
+            html.H6("Ensemble Member"),
+            dcc.Dropdown(id="member_drop", value="0", options=get_member_opts(1)),
+            html.Br(),
+            html.H6("Display"),
+            dcc.Dropdown(id="display_drop", value="absolute", options=display_opts),
+            html.Br(),
+            html.H6("Mean"),
+            dbc.Card(dbc.CardBody(id="mean_card")),
+            html.Br(),
+            html.H6("Std. Dev"),
+            dbc.Card(dbc.CardBody(id="var_card")),
+        ],
+        md=2,
+        style={
+            "background-color": "#e6e6e6",
+            "padding": 15,
+            "border-radius": 3,
+        },
+    )
+
+
+def serve_layout():
+    """Served on every page load so cases built while the app runs are offered"""
+    return dbc.Container(
+        [
+            dbc.Row(
+                [
+                    dbc.Col(
+                        [
+                            html.H1(  # The big blue header
+                                "CMIP-6 Dashboard",
+                                style={
+                                    "color": "white",
+                                    "text-align": "left",
+                                    "font-size": "48px",
+                                },
+                            )
+                        ],
+                        style={
+                            "backgroundColor": "steelblue",
+                            "border-radius": 3,
+                            "padding": 15,
+                            "margin-top": 20,
+                            "margin-bottom": 20,
+                            "margin-right": 15,
+                        },
+                    )
+                ]
+            ),
+            dbc.Row(  # The tabs
+                [
+                    dcc.Tabs(
+                        id="tab_switch",
+                        value="map_tab",
+                        children=[
+                            dcc.Tab(label="Climate Map", value="map_tab"),
+                            dcc.Tab(label="Compare", value="comp_tab"),
+                            dcc.Tab(label="Hovmöller", value="hovmoller_tab"),
+                            dcc.Tab(label="Trend", value="trend_tab"),
+                        ],
+                    )
+                ]
+            ),
+            dbc.Row(  # The sidebar with controls
+                [
+                    get_dashboard_controls(),
+                    dbc.Col(id="tab_switch_content"),
+                ]
+            ),
+            html.Hr(),
+            html.P(""),
+        ]
+    )
+
+
+app.layout = serve_layout
+
+
 # Callbacks- these do all the dynamic updating and are where the calls to
 # The various plotting and wrangling functions actually happen
 @app.callback(
@@ -227,8 +815,23 @@ app.layout = dbc.Container(
     Input("mod_drop", "value"),
     Input("date_input", "value"),
     Input("exp_drop", "value"),
+    Input("member_drop", "value"),
+    Input("display_drop", "value"),
+    Input("resolution_drop", "value"),
+    Input("heatmap_drop", "value"),
 )
-def update_map(scenario_drop, var_drop, mod_drop, date_input, exp_drop):
+@timed("callback.update_map")
+def update_map(
+    scenario_drop,
+    var_drop,
+    mod_drop,
+    date_input,
+    exp_drop,
+    member_drop,
+    display_drop,
+    resolution_drop="monthly",
+    heatmap_drop="month",
+):
     """Updates the climate map graph when a different variable is selected
 
 
@@ -244,18 +847,51 @@ def update_map(scenario_drop, var_drop, mod_drop, date_input, exp_drop):
         Input date selection
     exp_drop : str
         Experiment dropdown selection
+    member_drop : str
+        Member number or ensemble statistic selection
+    display_drop : str
+        Whether to display absolute values or anomalies from the case baseline
+    resolution_drop : str
+        Monthly values or seasonal or annual means, see get_resolution_key()
+    heatmap_drop : str
+        "month" for the selected date, or a quantile of the case over all members
+        and months
 
     Returns
     -------
     Plotly figure
         Heatmap based on selections
     """
-    date_list = date_input.split("/")
+    full_var_name = var_key[var_drop]["fullname"]
+    if scenario_drop != "None" and heatmap_drop not in (None, "month"):
+        # Extremes written with the case, independent of the date and member
+        quantile = float(heatmap_drop)
+        folder_path = path + scenario_drop.split(".")[0]
+        dset = load_case_quantiles(folder_path, mod_drop, var_drop, [quantile])
+        fig = plot_quantile_map(dset, var_drop, mod_drop, quantile)
+        attrs = dset[var_drop].attrs
+        title = f"{get_quantile_label(quantile)} of {full_var_name} over \
+     {attrs['quantile_period']} and {attrs['quantile_members']} Members of the \
+     {exp_drop} run of {mod_drop}"
+        return fig, title
+
+    check_case_date(
+        scenario_drop, date_input, var_drop, [mod_drop], resolution_drop, exp_drop
+    )
+    date_list, resolution_label = get_resolution_date(
+        scenario_drop, date_input, resolution_drop
+    )
     if scenario_drop == "None":
-        xarray_dset = get_cmpi6_model_run(col, var_drop, mod_drop, exp_drop)[0]
+        xarray_dset = get_cmpi6_model_run(get_col(), var_drop, mod_drop, exp_drop)[0]
     else:
-        folder_path = path + scenario_drop.split(".")[0]
-        xarray_dset = xr.open_dataset(f"{folder_path}/{mod_drop}_{var_drop}.nc")
+        xarray_dset = open_case_dset(
+            scenario_drop,
+            mod_drop,
+            var_drop,
+            member_drop,
+            display_drop,
+            resolution_drop,
+        )
 
     fig = plot_year_plotly(
         xarray_dset,
@@ -264,10 +900,12 @@ def update_map(scenario_drop, var_drop, mod_drop, date_input, exp_drop):
         month=date_list[1],
         year=date_list[0],
         exp_id=exp_drop,
+        member=member_drop,
     )
-    full_var_name = var_key[var_drop]["fullname"]
     title = f"Heatmap of {full_var_name} on {date_list[0]}/{date_list[1]} \
      for {exp_drop} run of {mod_drop}"
+    title += resolution_label
+    title += get_display_label(scenario_drop, mod_drop, var_drop, display_drop)
     return fig, title
 
 
@@ -278,8 +916,12 @@ def update_map(scenario_drop, var_drop, mod_drop, date_input, exp_drop):
     Input("mod_drop", "value"),
     Input("date_input", "value"),
     Input("exp_drop", "value"),
+    Input("display_drop", "value"),
 )
-def update_line_comp(scenario_drop, var_drop, mod_drop, date_input, exp_drop):
+@timed("callback.update_line_comp")
+def update_line_comp(
+    scenario_drop, var_drop, mod_drop, date_input, exp_drop, display_drop
+):
     """Updates the climate map graph when a different variable is selected
 
 
@@ -297,6 +939,8 @@ def update_line_comp(scenario_drop, var_drop, mod_drop, date_input, exp_drop):
         Input date selection
     exp_drop : str
         Experiment dropdown selection
+    display_drop : str
+        Whether to display absolute values or anomalies from the case baseline
 
     Returns
     -------
@@ -307,18 +951,16 @@ def update_line_comp(scenario_drop, var_drop, mod_drop, date_input, exp_drop):
     start_date = date_list[0]
     end_date = str(int(date_list[0]) + 1)
     if scenario_drop == "None":
-        dset_list = get_cmpi6_model_run(col, var_drop, mod_drop, exp_drop, 1)
+        dset_list = get_cmpi6_model_run(get_col(), var_drop, mod_drop, exp_drop, 1)
         dset = join_members(dset_list).sel(time=slice(start_date, end_date))
     else:
-        folder_path = path + scenario_drop.split(".")[0]
-        with open(path + scenario_drop) as f:
-            data = json.load(f)
-        dset = xr.open_dataset(f"{folder_path}/{mod_drop}_{var_drop}.nc")
+        dset = open_case_dset(scenario_drop, mod_drop, var_drop, display=display_drop)
 
     fig = plot_member_line_comp(dset, var_drop)
     full_var_name = var_key[var_drop]["fullname"]
     title = f"Member Comparison of {full_var_name} Across the Full Scenario Timespan \
      of an {exp_drop} Run of {mod_drop}"
+    title += get_display_label(scenario_drop, mod_drop, var_drop, display_drop)
     return fig, title
 
 
@@ -331,9 +973,21 @@ def update_line_comp(scenario_drop, var_drop, mod_drop, date_input, exp_drop):
     Input("mod_comp_drop", "value"),
     Input("date_input", "value"),
     Input("exp_drop", "value"),
+    Input("member_drop", "value"),
+    Input("display_drop", "value"),
+    Input("resolution_drop", "value"),
 )
+@timed("callback.update_comparison_hist")
 def update_comparison_hist(
-    scenario_drop, var_drop, mod_drop, mod_comp_drop, date_input, exp_drop
+    scenario_drop,
+    var_drop,
+    mod_drop,
+    mod_comp_drop,
+    date_input,
+    exp_drop,
+    member_drop,
+    display_drop,
+    resolution_drop="monthly",
 ):
     """Updates the model comparison plot when inputs are changed
 
@@ -345,54 +999,347 @@ def update_comparison_hist(
         Var dropdown output
     mod_drop : str
         Mod dropdown selection
-    mod_comp_drop : str
-        Mod comp dropdown selection
+    mod_comp_drop : list of str
+        Mod comp dropdown selection, one or more models
     date_input : str
         Input date selection
     exp_drop : str
         Experiment dropdown selection
+    member_drop : str
+        Member number or ensemble statistic selection
+    display_drop : str
+        Whether to display absolute values or anomalies from the case baseline
+    resolution_drop : str
+        Monthly values or seasonal or annual means, see get_resolution_key()
 
     Returns
     -------
     Plotly Figure
         Plotly figure plotted
     """
-    date_list = date_input.split("/")
+    date_list, resolution_label = get_resolution_date(
+        scenario_drop, date_input, resolution_drop
+    )
+    comp_models = get_comp_models(mod_comp_drop)
+    if not comp_models:
+        raise PreventUpdate
+    models = [mod_drop] + comp_models
+    check_case_date(
+        scenario_drop, date_input, var_drop, models, resolution_drop, exp_drop
+    )
 
     if scenario_drop == "None":
-        dset_comp = get_cmpi6_model_run(col, var_drop, mod_comp_drop, exp_drop)[0]
-        dset_comp = get_month_and_year(
-            dset_comp, var_drop, date_list[1], date_list[0], exp_drop
+        # Fetching every model at once so the wait is the slowest fetch, not the sum
+        dset_list = get_month_and_year_for_models(
+            get_col(), var_drop, models, date_list[1], date_list[0], exp_drop
         )
-        filt_dset = get_cmpi6_model_run(col, var_drop, mod_drop, exp_drop)[0]
-        filt_dset = get_month_and_year(
-            filt_dset, var_drop, date_list[1], date_list[0], exp_drop
-        )
-        dset_tuple = (filt_dset, dset_comp)
     else:
-        folder_path = path + scenario_drop.split(".")[0]
-        filt_dset = xr.open_dataset(f"{folder_path}/{mod_drop}_{var_drop}.nc")
-        filt_dset = get_month_and_year(
-            filt_dset, var_drop, date_list[1], date_list[0], exp_drop
-        )
-        dset_comp = xr.open_dataset((f"{folder_path}/{mod_comp_drop}_{var_drop}.nc"))
-        dset_comp = get_month_and_year(
-            dset_comp, var_drop, date_list[1], date_list[0], exp_drop
-        )
-        dset_tuple = (filt_dset, dset_comp)
+        dset_list = [
+            get_month_and_year(
+                open_case_dset(
+                    scenario_drop,
+                    mod,
+                    var_drop,
+                    member_drop,
+                    display_drop,
+                    resolution_drop,
+                ),
+                var_drop,
+                date_list[1],
+                date_list[0],
+                exp_drop,
+            )
+            for mod in models
+        ]
+
+    # The models are on different grids so they are mapped onto a common grid first,
+    # giving each histogram the same area weighting and number of samples
+    dset_tuple = tuple(regrid_to_common_grid(dset_list))
 
     fig = plot_model_comparisons(
         dset_tuple,
         var_drop,
         mod_drop,
-        mod_comp_id=mod_comp_drop,
+        mod_comp_id=comp_models,
     )
     full_var_name = var_key[var_drop]["fullname"]
     title = (
         title
     ) = f"Probability Density of {full_var_name} on {date_list[0]}/{date_list[1]} for \
-        {exp_drop} Runs of {mod_drop} and {mod_comp_drop}"
+        {exp_drop} Runs of {mod_drop} and {', '.join(comp_models)}"
+    title += resolution_label
+    title += get_display_label(scenario_drop, mod_drop, var_drop, display_drop)
+
+    return fig, title
+
+
+@app.callback(
+    [Output("difference_map", "figure"), Output("diff_map_title", "children")],
+    Input("scenario_drop", "value"),
+    Input("var_drop", "value"),
+    Input("mod_drop", "value"),
+    Input("mod_comp_drop", "value"),
+    Input("date_input", "value"),
+    Input("exp_drop", "value"),
+    Input("member_drop", "value"),
+    Input("display_drop", "value"),
+    Input("resolution_drop", "value"),
+)
+@timed("callback.update_difference_map")
+def update_difference_map(
+    scenario_drop,
+    var_drop,
+    mod_drop,
+    mod_comp_drop,
+    date_input,
+    exp_drop,
+    member_drop,
+    display_drop,
+    resolution_drop="monthly",
+):
+    """Updates the map of the difference between the model and comparison model
+
+    Parameters
+    ----------
+    scenario_drop : str
+        Output of string dropdown
+    var_drop : str
+        Var dropdown output
+    mod_drop : str
+        Mod dropdown selection
+    mod_comp_drop : list of str
+        Mod comp dropdown selection, the first model is subtracted from mod_drop
+    date_input : str
+        Input date selection
+    exp_drop : str
+        Experiment dropdown selection
+    member_drop : str
+        Member number or ensemble statistic selection
+    display_drop : str
+        Whether to display absolute values or anomalies from the case baseline
+    resolution_drop : str
+        Monthly values or seasonal or annual means, see get_resolution_key()
+
+    Returns
+    -------
+    Plotly Figure
+        Heatmap of the difference on the common grid of the two models
+    """
+    date_list, resolution_label = get_resolution_date(
+        scenario_drop, date_input, resolution_drop
+    )
+    comp_models = get_comp_models(mod_comp_drop)
+    if not comp_models:
+        raise PreventUpdate
+    mod_comp_drop = comp_models[0]
+    check_case_date(
+        scenario_drop,
+        date_input,
+        var_drop,
+        [mod_drop, mod_comp_drop],
+        resolution_drop,
+        exp_drop,
+    )
+    case_signature = None
+    if scenario_drop != "None":
+        case_signature = get_case_signature(path, scenario_drop)
+    dset_tuple = get_aligned_pair(
+        scenario_drop,
+        var_drop,
+        mod_drop,
+        mod_comp_drop,
+        exp_drop,
+        member_drop,
+        display_drop,
+        resolution_drop,
+        case_signature,
+    )
+    fig = plot_difference_map(
+        dset_tuple,
+        var_drop,
+        mod_drop,
+        mod_comp_drop,
+        month=date_list[1],
+        year=date_list[0],
+        exp_id=exp_drop,
+    )
+    full_var_name = var_key[var_drop]["fullname"]
+    title = f"Difference in {full_var_name} on {date_list[0]}/{date_list[1]} \
+     Between {exp_drop} Runs of {mod_drop} and {mod_comp_drop}"
+    title += resolution_label
+    title += get_display_label(scenario_drop, mod_drop, var_drop, display_drop)
+    return fig, title
+
+
+@app.callback(
+    [Output("point_series", "figure"), Output("point_series_title", "children")],
+    Input("histogram", "clickData"),
+    Input("scenario_drop", "value"),
+    Input("var_drop", "value"),
+    Input("mod_drop", "value"),
+    Input("display_drop", "value"),
+)
+@timed("callback.update_point_series")
+def update_point_series(click_data, scenario_drop, var_drop, mod_drop, display_drop):
+    """Updates the time series of the grid cell clicked on the heatmap
+
+    Parameters
+    ----------
+    click_data : dict
+        The clicked point of the heatmap, its x is the longitude and y the latitude
+    scenario_drop : str
+        Output of string dropdown
+    var_drop : str
+        Var dropdown output
+    mod_drop : str
+        Mod dropdown selection
+    display_drop : str
+        Whether to display absolute values or anomalies from the case baseline
+
+    Returns
+    -------
+    Plotly Figure
+        Time series of every member at the grid cell nearest to the click
+    """
+    # Only case files are laid out for reading a point, a model run would be read
+    # whole
+    if scenario_drop == "None" or not click_data:
+        raise PreventUpdate
+    point = click_data["points"][0]
+    folder_path = path + scenario_drop.split(".")[0]
+    dset = get_point_series(folder_path, mod_drop, var_drop, point["y"], point["x"])
+    clim = get_case_climatology(scenario_drop, mod_drop, var_drop, display_drop)
+    if clim is not None:
+        clim = clim.sel(lat=dset["lat"], lon=dset["lon"])
+        dset = get_anomaly(dset, var_drop, clim)
+
+    fig = plot_point_series(dset, var_drop)
+    full_var_name = var_key[var_drop]["fullname"]
+    lat = float(dset["lat"])
+    lon = float(dset["lon"])
+    lon = lon - 360 if lon > 180 else lon
+    title = f"{full_var_name} at {lat:.2f}, {lon:.2f} for Every Member of {mod_drop}"
+    title += get_display_label(scenario_drop, mod_drop, var_drop, display_drop)
+    return fig, title
 
+
+@app.callback(
+    [Output("hovmoller", "figure"), Output("hovmoller_title", "children")],
+    Input("scenario_drop", "value"),
+    Input("var_drop", "value"),
+    Input("mod_drop", "value"),
+    Input("member_drop", "value"),
+    Input("display_drop", "value"),
+    Input("hovmoller_drop", "value"),
+)
+@timed("callback.update_hovmoller")
+def update_hovmoller(
+    scenario_drop, var_drop, mod_drop, member_drop, display_drop, hovmoller_drop
+):
+    """Updates the Hovmöller diagram of the selected case
+
+    Parameters
+    ----------
+    scenario_drop : str
+        Output of string dropdown
+    var_drop : str
+        Var dropdown output
+    mod_drop : str
+        Mod dropdown selection
+    member_drop : str
+        Member number or ensemble statistic selection, statistics are taken across
+        the members' means
+    display_drop : str
+        Whether to display absolute values or anomalies from the case baseline
+    hovmoller_drop : str
+        "lat" for the zonal mean or "lon" for the meridional mean
+
+    Returns
+    -------
+    Plotly Figure
+        Heatmap of the mean against time
+    """
+    # The means are computed when cases are built, model runs would be read whole
+    if scenario_drop == "None":
+        raise PreventUpdate
+    folder_path = path + scenario_drop.split(".")[0]
+    dset = load_case_hovmoller(folder_path, mod_drop, var_drop, hovmoller_drop)
+    clim = get_case_climatology(scenario_drop, mod_drop, var_drop, display_drop)
+    colorscale, zmid = None, None
+    if clim is not None:
+        reduce = zonal_mean if hovmoller_drop == "lat" else meridional_mean
+        dset = get_anomaly(dset, var_drop, reduce(clim[var_drop]).to_dataset())
+        colorscale, zmid = "RdBu_r", 0
+    dset = select_member(dset, var_drop, member_drop)
+
+    fig = plot_hovmoller(dset, var_drop, hovmoller_drop, colorscale, zmid)
+    full_var_name = var_key[var_drop]["fullname"]
+    mean_name = "Zonal" if hovmoller_drop == "lat" else "Meridional"
+    title = f"{mean_name} Mean of {full_var_name} for {mod_drop}"
+    title += get_display_label(scenario_drop, mod_drop, var_drop, display_drop)
+    return fig, title
+
+
+@app.callback(
+    [Output("trend_map", "figure"), Output("trend_title", "children")],
+    Input("scenario_drop", "value"),
+    Input("var_drop", "value"),
+    Input("mod_drop", "value"),
+    Input("member_drop", "value"),
+    Input("trend_start", "value"),
+    Input("trend_end", "value"),
+)
+@timed("callback.update_trend_map")
+def update_trend_map(
+    scenario_drop, var_drop, mod_drop, member_drop, trend_start, trend_end
+):
+    """Updates the map of linear trends of the selected case
+
+    Parameters
+    ----------
+    scenario_drop : str
+        Output of string dropdown
+    var_drop : str
+        Var dropdown output
+    mod_drop : str
+        Mod dropdown selection
+    member_drop : str
+        Member number or ensemble statistic selection, statistics are taken across
+        the members' trends
+    trend_start, trend_end : str
+        First and last month of the period fitted as YYYY/MM, the start or end of
+        the case when empty
+
+    Returns
+    -------
+    Plotly Figure
+        Heatmap of the trend per decade
+    """
+    # Fitting needs every month of the period, model runs would be read whole
+    if scenario_drop == "None":
+        raise PreventUpdate
+    period = []
+    for date in (trend_start, trend_end):
+        if not date:
+            period.append(None)
+            continue
+        try:
+            date = get_aggregate_period(date, "monthly")[0]
+        except ValueError:
+            # Stops on malformed input, e.g. while a month is still being typed
+            raise PreventUpdate
+        check_case_date(scenario_drop, date, var_drop, [mod_drop])
+        period.append(date)
+    if None not in period and period[0] >= period[1]:
+        raise PreventUpdate
+    folder_path = path + scenario_drop.split(".")[0]
+    dset = load_case_trend(folder_path, mod_drop, var_drop, *period)
+    dset = select_member(dset, var_drop, member_drop)
+
+    fig = plot_trend_map(dset, var_drop, mod_drop)
+    full_var_name = var_key[var_drop]["fullname"]
+    trend_period = dset[var_drop].attrs["trend_period"]
+    title = f"Linear Trend of {full_var_name} over {trend_period} for {mod_drop}"
     return fig, title
 
 
@@ -403,9 +1350,12 @@ def update_comparison_hist(
         Output("mod_comp_drop", "options"),
         Output("date_input", "value"),
         Output("exp_drop", "options"),
+        Output("member_drop", "options"),
+        Output("member_drop", "value"),
     ],
     Input("scenario_drop", "value"),
 )
+@timed("callback.update_options")
 def update_options(scenario_drop):
     """Updates the options for var_drop, mod_drop, and exp_drop based on scenario
 
@@ -423,14 +1373,18 @@ def update_options(scenario_drop):
         Start date of scenario
     exp_opts
         Exp of the scenario selected to set exp options to
+    member_opts
+        Members of the scenario plus the ensemble statistics
+    member_val
+        Resets the member selection to the first member
     """
     # Stops this from updating if we no scenario selected
     if scenario_drop == "None":
         raise PreventUpdate
 
-    # Read the json file for the selected case
-    with open(path + scenario_drop) as f:
-        data = json.load(f)
+    # The definition and what was built for it, from the case index
+    case_entry = get_case_entry(path, scenario_drop)
+    data = case_entry["definition"]
     var_opts = dict_to_dash_opts(var_key, key_subset=data["var_id_list"])
     mod_opts = dict_to_dash_opts(mod_key, key_subset=data["mod_id_list"])
     mod_comp_opts = mod_opts
@@ -440,10 +1394,113 @@ def update_options(scenario_drop):
     start_dates = data["start_date"].split("-")
     date_val = start_dates[0] + "/" + start_dates[1]
 
-    return var_opts, mod_opts, mod_comp_opts, date_val, exp_opts
+    # Members actually on disk, which may be fewer than defined while a case builds
+    member_opts = get_member_opts(case_entry["members"])
+
+    return var_opts, mod_opts, mod_comp_opts, date_val, exp_opts, member_opts, "0"
+
+
+@app.callback(
+    [Output("heatmap_drop", "options"), Output("heatmap_drop", "value")],
+    Input("scenario_drop", "value"),
+)
+@timed("callback.update_heatmap_opts")
+def update_heatmap_opts(scenario_drop):
+    """Offers the quantiles of the selected case as heatmaps, resetting the heatmap
+    to the selected month
+
+    Parameters
+    ----------
+    scenario_drop : str
+        Output of string dropdown
+
+    Returns
+    -------
+    heatmap_opts
+        The selected month and the quantiles written with the case, see
+        get_heatmap_opts()
+    heatmap_val
+        "month"
+    """
+    if scenario_drop == "None":
+        return get_heatmap_opts(), "month"
+    definition = get_case_entry(path, scenario_drop)["definition"]
+    return get_heatmap_opts(definition.get("quantiles", DEFAULT_QUANTILES)), "month"
+
+
+@app.callback(
+    Output("export_link", "href"),
+    Input("scenario_drop", "value"),
+    Input("var_drop", "value"),
+    Input("mod_drop", "value"),
+    Input("member_drop", "value"),
+    Input("histogram", "selectedData"),
+    Input("export_format", "value"),
+    Input("export_start", "value"),
+    Input("export_end", "value"),
+)
+@timed("callback.update_export_link")
+def update_export_link(
+    scenario_drop,
+    var_drop,
+    mod_drop,
+    member_drop,
+    selection,
+    export_format,
+    export_start,
+    export_end,
+):
+    """Points the download link at an export of the current selection
+
+    Parameters
+    ----------
+    scenario_drop : str
+        Output of string dropdown
+    var_drop : str
+        Var dropdown output
+    mod_drop : str
+        Mod dropdown selection
+    member_drop : str
+        Member number, or an ensemble statistic which exports every member
+    selection : dictionary
+        Data selected on the climate graph, whose bounding box is exported
+    export_format : str
+        A key in get_export_format_key()
+    export_start, export_end : str
+        First and last month exported as YYYY/MM, the start or end of the case when
+        empty
+
+    Returns
+    -------
+    str
+        Relative url of export_subset(), None in developer mode as only cases are
+        exported
+    """
+    if scenario_drop == "None":
+        return None
+    export = {
+        "case": scenario_drop,
+        "model": mod_drop,
+        "var": var_drop,
+        "format": export_format,
+    }
+    if member_drop is not None and not is_ensemble_stat(member_drop):
+        export["members"] = member_drop
+    for name, date in (("start", export_start), ("end", export_end)):
+        if date:
+            export[name] = date.replace("/", "-")
+    points = [] if selection is None else selection["points"]
+    if points:
+        lons = [point["x"] for point in points]
+        lats = [point["y"] for point in points]
+        export.update(
+            lon_min=min(lons), lon_max=max(lons), lat_min=min(lats), lat_max=max(lats)
+        )
+    return "export?" + urlencode(export)
 
 
 @app.callback(Output("mean_card", "children"), Input("histogram", "selectedData"))
+@timed("callback.update_mean")
 def update_mean(selection):
     """Updates the mean card depending on the selected data in the graph
 
@@ -456,19 +1513,17 @@ def update_mean(selection):
     Returns
     -------
     str
-        Mean climatology selected for a given time period
+        Area weighted mean climatology selected for a given time period
     """
     if selection is None:
         return 0
-    var_vals = []
-    for dict in selection["points"]:
-        val = dict["marker.color"]
-        var_vals.append(val)
-        mean = np.mean(np.array(var_vals))
+    values, weights = get_selection_values(selection)
+    mean = weighted_mean(values, weights)
     return f"{mean:.2e}"
 
 
 @app.callback(Output("var_card", "children"), Input("histogram", "selectedData"))
+@timed("callback.update_variance")
 def update_variance(selection):
     """Updates the variance of card based on selection on graph
 
@@ -480,19 +1535,17 @@ def update_variance(selection):
     Returns
     -------
     str
-        Standard deviation of the map selection
+        Area weighted standard deviation of the map selection
     """
     if selection is None:
         return 0
-    var_vals = []
-    for dict in selection["points"]:
-        val = dict["marker.color"]
-        var_vals.append(val)
-        std = np.std(np.array(var_vals))
+    values, weights = get_selection_values(selection)
+    std = weighted_std(values, weights)
     return f"{std:.2e}"
 
 
 @app.callback(Output("tab_switch_content", "children"), Input("tab_switch", "value"))
+@timed("callback.render_content")
 def render_content(tab):
     """Switches the content displayed when a different tab is selected
 
@@ -510,6 +1563,10 @@ def render_content(tab):
         return climate_heatmap_card
     elif tab == "comp_tab":
         return comp_tab_contents
+    elif tab == "hovmoller_tab":
+        return hovmoller_tab_contents
+    elif tab == "trend_tab":
+        return trend_tab_contents
 
 
 # Remove the debug=True here in deployment
@@ -0,0 +1,715 @@
+"""Builds every case definition JSON in a directory, sharing fetches between cases
+
+    python -m cmip6_dash.build_cases dashdir/cases --workers 4
+
+The union of the (model, variable, experiment) runs the cases need is planned first.
+Cases reading a run over overlapping regions and periods share one fetch of it, with
+the most members any of them asks for, over the bounding box of their regions and
+periods, so stores shared between cases are only read once. Cases are built from
+the fetched runs as soon as everything they need has arrived, and each fetch is
+dropped once the cases reading it are written. With --update, cases already built
+are brought in line with their edited definitions instead, fetching only the months,
+members, models and variables missing from their folders (see update_case()).
+Storage is configured through the environment as for the app (see storage_utils).
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import xarray as xr
+
+from .case_utils import _write_case_product
+from .case_utils import AGGREGATE_PRODUCTS
+from .case_utils import clip_xarray
+from .case_utils import compute_climatology
+from .case_utils import DEFAULT_CASE_ENCODING
+from .case_utils import get_case_data
+from .case_utils import get_case_file_path
+from .case_utils import HOVMOLLER_PRODUCTS
+from .case_utils import join_members
+from .case_utils import lon_180_to_360
+from .case_utils import open_case_file
+from .case_utils import read_case_manifest
+from .case_utils import write_case_aggregates
+from .case_utils import write_case_hovmoller
+from .case_utils import write_case_manifest
+from .case_utils import write_case_quantiles
+from .case_utils import write_case_series
+from .extremes_utils import DEFAULT_QUANTILES
+from .wrangling_utils import get_cmpi6_model_run
+from .wrangling_utils import get_esm_datastore
+
+
+def read_case_definitions(case_dir, case_names=None):
+    """Reads the case definition JSONs of case_dir, optionally only those in
+    case_names, sorted by case name"""
+    case_definitions = []
+    for file_name in sorted(os.listdir(case_dir)):
+        if not file_name.endswith(".json"):
+            continue
+        with open(os.path.join(case_dir, file_name)) as read_file:
+            case_definition = json.load(read_file)
+        if case_names is None or case_definition["case_name"] in case_names:
+            case_definitions.append(case_definition)
+    return case_definitions
+
+
+def _fetches_overlap(fetch, other):
+    # Fetches of one run are shared if both their regions and periods overlap, or if
+    # one case needs both (e.g. a baseline from the experiment of the case)
+    if set(fetch["cases"]) & set(other["cases"]):
+        return True
+    if fetch["start_date"] is not None:
+        if fetch["start_date"] > other["end_date"]:
+            return False
+        if other["start_date"] > fetch["end_date"]:
+            return False
+    lats_overlap = max(fetch["bottom_right"][0], other["bottom_right"][0]) <= min(
+        fetch["top_left"][0], other["top_left"][0]
+    )
+    lons_overlap = max(fetch["top_left"][1], other["top_left"][1]) <= min(
+        fetch["bottom_right"][1], other["bottom_right"][1]
+    )
+    return lats_overlap and lons_overlap
+
+
+def _merge_fetches(fetch, other):
+    # One fetch of the bounding box and period of both
+    merged = {
+        "members": max(fetch["members"], other["members"]),
+        "top_left": [
+            max(fetch["top_left"][0], other["top_left"][0]),
+            min(fetch["top_left"][1], other["top_left"][1]),
+        ],
+        "bottom_right": [
+            min(fetch["bottom_right"][0], other["bottom_right"][0]),
+            max(fetch["bottom_right"][1], other["bottom_right"][1]),
+        ],
+        "start_date": fetch["start_date"],
+        "end_date": fetch["end_date"],
+        "cases": list(dict.fromkeys(fetch["cases"] + other["cases"])),
+    }
+    if fetch["start_date"] is not None:
+        merged["start_date"] = min(fetch["start_date"], other["start_date"])
+        merged["end_date"] = max(fetch["end_date"], other["end_date"])
+    return merged
+
+
+def plan_fetches(case_definitions):
+    """Plans the runs needed to build case_definitions, sharing fetches between
+    cases whose regions and periods overlap
+
+    The cases reading a (model, variable, experiment) run are grouped by overlapping
+    regions and periods, and each group is fetched once over the bounding box and
+    period of its cases. Cases far apart in space or time get fetches of their own
+    rather than one spanning everything in between.
+
+    Parameters
+    ----------
+    case_definitions : list of dict
+        From write_case_definition()
+
+    Returns
+    -------
+    dict
+        Keyed on (model, variable, experiment, fetch number), holding the members to
+        fetch (the most any case of the group asks for), the bounding box of the
+        case regions (top_left and bottom_right as [lat, lon], lon 0-360), the period
+        covering every case (start_date and end_date, None for piControl whose period
+        comes from the run itself) and the names of the cases using the fetch. Every
+        case reads one fetch of each run it needs.
+    """
+    runs = {}
+
+    def add_fetch(case_definition, mod, var, exp_id, start_date, end_date):
+        # Longitudes in the 0-360 frame the stores use, where regions on either
+        # side of the Greenwich meridian do not overlap and their bounding box can
+        # not wrap around
+        fetch = {
+            "members": case_definition["members"],
+            "top_left": [
+                case_definition["top_left"][0],
+                lon_180_to_360(case_definition["top_left"][1]),
+            ],
+            "bottom_right": [
+                case_definition["bottom_right"][0],
+                lon_180_to_360(case_definition["bottom_right"][1]),
+            ],
+            "start_date": start_date,
+            "end_date": end_date,
+            "cases": [case_definition["case_name"]],
+        }
+        fetches = runs.setdefault((mod, var, exp_id), [])
+        # A merged fetch can overlap fetches neither part did, so merging goes on
+        # until nothing overlaps
+        merging = True
+        while merging:
+            merging = False
+            for num, other in enumerate(fetches):
+                if _fetches_overlap(other, fetch):
+                    fetch = _merge_fetches(fetches.pop(num), fetch)
+                    merging = True
+                    break
+        fetches.append(fetch)
+
+    for case_definition in case_definitions:
+        exp_id = case_definition["exp_id"]
+        for mod in case_definition["mod_id_list"]:
+            for var in case_definition["var_id_list"]:
+                if exp_id == "piControl":
+                    add_fetch(case_definition, mod, var, exp_id, None, None)
+                else:
+                    add_fetch(
+                        case_definition,
+                        mod,
+                        var,
+                        exp_id,
+                        case_definition["start_date"],
+                        case_definition["end_date"],
+                    )
+                baseline_exp = case_definition.get("baseline_exp_id")
+                if baseline_exp not in (None, "piControl"):
+                    add_fetch(
+                        case_definition,
+                        mod,
+                        var,
+                        baseline_exp,
+                        case_definition["baseline_start"],
+                        case_definition["baseline_end"],
+                    )
+    # Cases and fetches in the order of the definitions
+    case_names = [case_definition["case_name"] for case_definition in case_definitions]
+    plan = {}
+    for run, fetches in runs.items():
+        for fetch in fetches:
+            fetch["cases"].sort(key=case_names.index)
+        fetches.sort(key=lambda fetch: case_names.index(fetch["cases"][0]))
+        for num, fetch in enumerate(fetches):
+            plan[run + (num,)] = fetch
+    return plan
+
+
+def fetch_run(data_store, key, fetch):
+    """Fetches one planned run into memory
+
+    Parameters
+    ----------
+    data_store : esm_datastore
+        The data store to query
+    key : tuple
+        (model, variable, experiment, fetch number)
+    fetch : dict
+        The plan of the run from plan_fetches()
+
+    Returns
+    -------
+    list of xarray.Dataset
+        The loaded members, clipped to the planned region and period
+    """
+    mod, var, exp_id = key[:3]
+    dsets = get_cmpi6_model_run(data_store, var, mod, exp_id, fetch["members"])
+    if exp_id == "piControl":
+        # The last two years, as get_case_data() takes from piControl runs
+        year = dsets[0]["time"].isel(time=slice(-2, -1)).dt.year.values[0]
+        start_date, end_date = str(year - 1), str(year)
+    else:
+        start_date, end_date = fetch["start_date"], fetch["end_date"]
+    return [
+        clip_xarray(
+            dset,
+            fetch["top_left"][0],
+            fetch["bottom_right"][0],
+            fetch["bottom_right"][1],
+            fetch["top_left"][1],
+            lons_360=True,
+        )
+        .sel(time=slice(start_date, end_date))
+        .load()
+        for dset in dsets
+    ]
+
+
+def build_cases(data_store, case_definitions, write_path, workers=4):
+    """Builds case_definitions into write_path, fetching shared runs once
+
+    Runs are fetched by a pool of workers threads, and each case is built by a
+    second pool as soon as the runs it needs are fetched. HDF5 is not thread safe,
+    so while the builds (and the products derived from their case files) compute in
+    parallel, their files are written one at a time, see case_utils._case_write_lock.
+
+    Parameters
+    ----------
+    data_store : esm_datastore
+        The data store to query
+    case_definitions : list of dict
+        From write_case_definition(), their case folders must not exist yet
+    write_path : str
+        Directory the case folders are written to
+    workers : int
+        Number of runs fetched (and cases built) at once
+
+    Returns
+    -------
+    dict
+        Timings: "fetches" holds seconds and bytes per fetched run, "cases" the
+        seconds spent building each case after its runs arrived and the seconds
+        from the start until it was written, "seconds" and "bytes" the totals
+    """
+    start = time.perf_counter()
+    plan = plan_fetches(case_definitions)
+    fetch_report = {}
+
+    def timed_fetch(key):
+        fetch_start = time.perf_counter()
+        dsets = fetch_run(data_store, key, plan[key])
+        fetch_report[key] = {
+            "seconds": time.perf_counter() - fetch_start,
+            "bytes": sum(dset.nbytes for dset in dsets),
+        }
+        return dsets
+
+    # Cases still to be built from each fetch, which is dropped once they are
+    remaining = {key: len(fetch["cases"]) for key, fetch in plan.items()}
+    remaining_lock = threading.Lock()
+
+    def build_case(case_definition):
+        keys = [
+            key
+            for key, fetch in plan.items()
+            if case_definition["case_name"] in fetch["cases"]
+        ]
+        try:
+            fetched = {key[:3]: fetch_futures[key].result() for key in keys}
+            build_start = time.perf_counter()
+            get_case_data(data_store, case_definition, write_path, fetched=fetched)
+            return {
+                "seconds": time.perf_counter() - build_start,
+                "finished": time.perf_counter() - start,
+            }
+        finally:
+            with remaining_lock:
+                for key in keys:
+                    remaining[key] -= 1
+                    if not remaining[key]:
+                        # The future held the last reference to the loaded run
+                        del fetch_futures[key]
+
+    with ThreadPoolExecutor(max_workers=workers) as fetch_pool:
+        fetch_futures = {key: fetch_pool.submit(timed_fetch, key) for key in plan}
+        with ThreadPoolExecutor(max_workers=workers) as build_pool:
+            case_reports = dict(
+                zip(
+                    [
+                        case_definition["case_name"]
+                        for case_definition in case_definitions
+                    ],
+                    build_pool.map(build_case, case_definitions),
+                )
+            )
+    return {
+        "fetches": fetch_report,
+        "cases": case_reports,
+        "seconds": time.perf_counter() - start,
+        "bytes": sum(fetch["bytes"] for fetch in fetch_report.values()),
+    }
+
+
+def shift_month(date, months):
+    """Shifts a YYYY-MM date by a number of months"""
+    year, month = (int(part) for part in date.split("-"))
+    month_num = year * 12 + month - 1 + months
+    return f"{month_num // 12:04d}-{month_num % 12 + 1:02d}"
+
+
+def fetch_members(
+    data_store, case_definition, mod, var, exp_id, start_date, end_date, first_member=0
+):
+    """Fetches members first_member up to the case's members of one model and
+    variable over the case region, joined on member_num as in the case files"""
+    dsets = get_cmpi6_model_run(
+        data_store, var, mod, exp_id, case_definition["members"]
+    )[first_member:]
+    dsets = [
+        clip_xarray(
+            dset,
+            case_definition["top_left"][0],
+            case_definition["bottom_right"][0],
+            case_definition["bottom_right"][1],
+            case_definition["top_left"][1],
+            lons_360=False,
+        ).sel(time=slice(start_date, end_date))
+        for dset in dsets
+    ]
+    joined = join_members(dsets).load()
+    return joined.assign_coords(member_num=joined["member_num"] + first_member)
+
+
+def update_case(data_store, case_definition, write_path):
+    """Brings an already built case folder in line with an edited case definition
+
+    Each model and variable file is compared with the definition and only what is
+    missing is fetched: months before or after the period on disk for the members
+    already there, and the whole period for added members, models or variables.
+    Months and members no longer in the definition are dropped. The climatology is
+    extended for added members, or recomputed if the baseline changed. Changing the
+    region, experiment or encoding rebuilds the files affected from scratch. The
+    zonal and meridional means, seasonal and annual means, quantiles and point time
+    series copies are rewritten from case files that changed (the quantiles also when
+    the definition lists others), and the copies removed if the definition no longer
+    asks for them. Files are replaced atomically and the
+    definition is recorded as the case manifest.
+
+    Parameters
+    ----------
+    data_store : esm_datastore
+        The data store to query
+    case_definition : dict
+        The edited definition, from write_case_definition()
+    write_path : str
+        Directory holding the case folder
+
+    Returns
+    -------
+    list of str
+        What was changed, empty if the folder already matched the definition
+    """
+    case_folder = os.path.join(write_path, case_definition["case_name"])
+    if not os.path.isdir(case_folder):
+        get_case_data(data_store, case_definition, write_path)
+        return ["built"]
+    built = read_case_manifest(case_folder)
+    # As it would read back from JSON, so tuples compare equal to the lists on disk
+    case_definition = json.loads(json.dumps(case_definition))
+    baseline_keys = ["baseline_start", "baseline_end", "baseline_exp_id"]
+    # Folders built before manifests were written are assumed to match the region,
+    # experiment and encoding, and to have a stale baseline
+    rebuild_all = built is not None and any(
+        built.get(key) != case_definition.get(key)
+        for key in ["top_left", "bottom_right", "exp_id", "encoding"]
+    )
+    baseline_changed = built is None or any(
+        built.get(key) != case_definition.get(key) for key in baseline_keys
+    )
+
+    changes = []
+    for mod in case_definition["mod_id_list"]:
+        for var in case_definition["var_id_list"]:
+            file_path = get_case_file_path(case_folder, mod, var)
+            if rebuild_all or not os.path.isfile(file_path):
+                _rebuild_case_file(data_store, case_definition, mod, var, case_folder)
+                changes.append(f"{mod} {var}: rebuilt")
+                continue
+            changes.extend(
+                _update_case_file(
+                    data_store, case_definition, mod, var, case_folder, baseline_changed
+                )
+            )
+    if "baseline_start" not in case_definition:
+        for mod in case_definition["mod_id_list"]:
+            for var in case_definition["var_id_list"]:
+                clim_path = get_case_file_path(case_folder, mod, var, "clim")
+                if os.path.isfile(clim_path):
+                    os.remove(clim_path)
+                    changes.append(f"{mod} {var}: climatology removed")
+    for mod in case_definition["mod_id_list"]:
+        for var in case_definition["var_id_list"]:
+            changes.extend(
+                _update_derived_files(case_definition, mod, var, case_folder)
+            )
+    if changes or built != case_definition:
+        write_case_manifest(case_folder, case_definition)
+    return changes
+
+
+def _rebuild_case_file(data_store, case_definition, mod, var, case_folder):
+    # Builds the model and variable as a case of its own and moves its files over
+    single_definition = dict(case_definition, mod_id_list=[mod], var_id_list=[var])
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(case_folder)) as tmp_dir:
+        get_case_data(data_store, single_definition, tmp_dir)
+        tmp_folder = os.path.join(tmp_dir, case_definition["case_name"])
+        products = ["clim", "series", "quantiles", *HOVMOLLER_PRODUCTS.values()]
+        for product in [None, *products, *AGGREGATE_PRODUCTS]:
+            tmp_path = get_case_file_path(tmp_folder, mod, var, product)
+            if os.path.isfile(tmp_path):
+                os.replace(tmp_path, get_case_file_path(case_folder, mod, var, product))
+
+
+def _update_derived_files(case_definition, mod, var, case_folder):
+    # The means, aggregates, quantiles and point series copy are derived from the case
+    # file, so they are rewritten whenever that is
+    file_path = get_case_file_path(case_folder, mod, var)
+    encoding = case_definition.get("encoding", DEFAULT_CASE_ENCODING)
+
+    def is_stale(product):
+        product_path = get_case_file_path(case_folder, mod, var, product)
+        return not os.path.isfile(product_path) or (
+            os.path.getmtime(product_path) < os.path.getmtime(file_path)
+        )
+
+    changes = []
+    if any(is_stale(product) for product in HOVMOLLER_PRODUCTS.values()):
+        write_case_hovmoller(case_folder, mod, var, encoding)
+        changes.append(f"{mod} {var}: zonal and meridional means written")
+    if any(is_stale(product) for product in AGGREGATE_PRODUCTS):
+        write_case_aggregates(case_folder, mod, var, encoding)
+        changes.append(f"{mod} {var}: seasonal and annual means written")
+    quantiles = case_definition.get("quantiles", DEFAULT_QUANTILES)
+    quantiles_changed = False
+    if not is_stale("quantiles"):
+        quantile_path = get_case_file_path(case_folder, mod, var, "quantiles")
+        with open_case_file(quantile_path, var) as written:
+            quantiles_changed = written["quantile"].values.tolist() != quantiles
+    if quantiles_changed or is_stale("quantiles"):
+        write_case_quantiles(case_folder, mod, var, quantiles, encoding)
+        changes.append(f"{mod} {var}: quantiles written")
+    series_path = get_case_file_path(case_folder, mod, var, "series")
+    if not case_definition.get("point_series"):
+        if os.path.isfile(series_path):
+            os.remove(series_path)
+            changes.append(f"{mod} {var}: point series removed")
+    elif is_stale("series"):
+        write_case_series(case_folder, mod, var, encoding)
+        changes.append(f"{mod} {var}: point series written")
+    return changes
+
+
+def _update_case_file(
+    data_store, case_definition, mod, var, case_folder, baseline_changed
+):
+    file_path = get_case_file_path(case_folder, mod, var)
+    exp_id = case_definition["exp_id"]
+    members = case_definition["members"]
+    encoding = case_definition.get("encoding", DEFAULT_CASE_ENCODING)
+    with open_case_file(file_path, var) as old:
+        old = old.load()
+    old_members = old.sizes["member_num"]
+    old_dates = old["time"].dt.strftime("%Y-%m").values
+    if exp_id == "piControl":
+        # The period comes from the run itself so only the members can change
+        start_date, end_date = old_dates[0], old_dates[-1]
+    else:
+        start_date, end_date = (
+            case_definition["start_date"],
+            case_definition["end_date"],
+        )
+
+    changes = []
+    kept = old.isel(member_num=slice(0, members)).sel(time=slice(start_date, end_date))
+    pieces = [kept]
+    if start_date < old_dates[0]:
+        before_end = min(end_date, shift_month(old_dates[0], -1))
+        pieces.insert(
+            0,
+            fetch_members(
+                data_store,
+                dict(case_definition, members=min(members, old_members)),
+                mod,
+                var,
+                exp_id,
+                start_date,
+                before_end,
+            ),
+        )
+        changes.append(f"{mod} {var}: added {start_date} to {before_end}")
+    if end_date > old_dates[-1]:
+        after_start = max(start_date, shift_month(old_dates[-1], 1))
+        pieces.append(
+            fetch_members(
+                data_store,
+                dict(case_definition, members=min(members, old_members)),
+                mod,
+                var,
+                exp_id,
+                after_start,
+                end_date,
+            )
+        )
+        changes.append(f"{mod} {var}: added {after_start} to {end_date}")
+    if kept.sizes["time"] < old.sizes["time"]:
+        changes.append(
+            f"{mod} {var}: dropped months outside {start_date} to {end_date}"
+        )
+    updated = xr.concat(pieces, dim="time") if len(pieces) > 1 else kept
+    if members > old_members:
+        added = fetch_members(
+            data_store,
+            case_definition,
+            mod,
+            var,
+            exp_id,
+            start_date,
+            end_date,
+            first_member=old_members,
+        )
+        updated = xr.concat([updated, added], dim="member_num")
+        changes.append(f"{mod} {var}: added members {old_members} to {members - 1}")
+    elif members < old_members:
+        changes.append(f"{mod} {var}: dropped members {members} to {old_members - 1}")
+    if changes:
+        _write_case_product(updated, var, file_path, encoding)
+
+    if "baseline_start" in case_definition:
+        changes.extend(
+            _update_climatology(
+                data_store,
+                case_definition,
+                mod,
+                var,
+                case_folder,
+                start_date,
+                end_date,
+                baseline_changed,
+            )
+        )
+    return changes
+
+
+def _update_climatology(
+    data_store,
+    case_definition,
+    mod,
+    var,
+    case_folder,
+    start_date,
+    end_date,
+    baseline_changed,
+):
+    members = case_definition["members"]
+    encoding = case_definition.get("encoding", DEFAULT_CASE_ENCODING)
+    clim_path = get_case_file_path(case_folder, mod, var, "clim")
+    baseline_exp = case_definition["baseline_exp_id"]
+    if baseline_exp == "piControl":
+        base_start, base_end = start_date, end_date
+    else:
+        base_start = case_definition["baseline_start"]
+        base_end = case_definition["baseline_end"]
+    if baseline_changed or not os.path.isfile(clim_path):
+        first_member = 0
+        old_clim = None
+        change = f"{mod} {var}: climatology computed"
+    else:
+        with open_case_file(clim_path, var) as old_clim:
+            old_clim = old_clim.load()
+        first_member = old_clim.sizes["member_num"]
+        if first_member >= members:
+            if first_member == members:
+                return []
+            clim = old_clim.isel(member_num=slice(0, members))
+            _write_case_product(clim, var, clim_path, encoding)
+            return [f"{mod} {var}: climatology members dropped"]
+        change = f"{mod} {var}: climatology extended to {members} members"
+    baseline = fetch_members(
+        data_store,
+        case_definition,
+        mod,
+        var,
+        baseline_exp,
+        base_start,
+        base_end,
+        first_member=first_member,
+    )
+    clim = compute_climatology(baseline, var, base_start, base_end)
+    if old_clim is not None:
+        clim = xr.concat([old_clim, clim], dim="member_num")
+    _write_case_product(clim.load(), var, clim_path, encoding)
+    return [change]
+
+
+def print_report(report):
+    print(f"{'run':<40} {'seconds':>8} {'MB':>8}")
+    for (mod, var, exp_id, num), fetch in sorted(report["fetches"].items()):
+        name = f"{mod} {var} {exp_id}" + (f" #{num + 1}" if num else "")
+        print(f"{name:<40} {fetch['seconds']:>8.2f} {fetch['bytes'] / 1e6:>8.2f}")
+    print(f"{'case':<40} {'build s':>8} {'done s':>8}")
+    for case_name, case in report["cases"].items():
+        print(f"{case_name:<40} {case['seconds']:>8.2f} {case['finished']:>8.2f}")
+    print(
+        f"{len(report['cases'])} cases from {len(report['fetches'])} runs in "
+        f"{report['seconds']:.1f} s, {report['bytes'] / 1e6:.2f} MB fetched at "
+        f"{report['bytes'] / 1e6 / report['seconds']:.2f} MB/s"
+    )
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("case_dir", help="Directory of case definition JSONs")
+    parser.add_argument(
+        "--write-path", help="Where the case folders are written, case_dir by default"
+    )
+    parser.add_argument("--workers", type=int, default=4, help="Parallel fetches")
+    parser.add_argument(
+        "--cases", nargs="+", help="Only build these cases (by case name)"
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Also build cases whose folder already exists, replacing it",
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Update cases whose folder already exists to match their definition, "
+        "fetching only what is missing",
+    )
+    parser.add_argument(
+        "--catalog", help="Catalog JSON to query instead of the pangeo catalog"
+    )
+    parser.add_argument("--json", help="Also write the timings to this file")
+    args = parser.parse_args(args)
+
+    write_path = args.case_dir if args.write_path is None else args.write_path
+    case_definitions = read_case_definitions(args.case_dir, args.cases)
+    data_store = get_esm_datastore(args.catalog)
+    updates = {}
+    if args.update and not args.rebuild:
+        for case_definition in case_definitions:
+            case_name = case_definition["case_name"]
+            if not os.path.isdir(os.path.join(write_path, case_name)):
+                continue
+            update_start = time.perf_counter()
+            changes = update_case(data_store, case_definition, write_path)
+            updates[case_name] = {
+                "changes": changes,
+                "seconds": time.perf_counter() - update_start,
+            }
+            print(
+                f"Updated {case_name} in {updates[case_name]['seconds']:.2f} s: "
+                f"{', '.join(changes) or 'already up to date'}"
+            )
+    if not args.rebuild:
+        case_definitions = [
+            case_definition
+            for case_definition in case_definitions
+            if not os.path.isdir(os.path.join(write_path, case_definition["case_name"]))
+        ]
+    if not case_definitions and not updates:
+        print("No cases to build")
+        return None
+
+    report = {"fetches": {}, "cases": {}}
+    if case_definitions:
+        print(f"Building {', '.join(case['case_name'] for case in case_definitions)}")
+        if args.rebuild:
+            for case_definition in case_definitions:
+                case_folder = os.path.join(write_path, case_definition["case_name"])
+                shutil.rmtree(case_folder, ignore_errors=True)
+        report = build_cases(data_store, case_definitions, write_path, args.workers)
+        print_report(report)
+    report["updates"] = updates
+    if args.json:
+        with open(args.json, "w") as write_file:
+            report["fetches"] = {
+                " ".join(str(part) for part in key): fetch
+                for key, fetch in report["fetches"].items()
+            }
+            json.dump(report, write_file, indent=4)
+    return report
+
+
+if __name__ == "__main__":
+    main()
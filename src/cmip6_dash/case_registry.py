@@ -0,0 +1,236 @@
+import json
+import os
+import threading
+import time
+
+from .case_utils import CASE_MANIFEST
+from .case_utils import get_aggregate_period
+from .case_utils import get_case_file_path
+from .case_utils import open_case_file
+
+# Seconds between checks of a case folder for added, edited or removed cases. Each
+# process (e.g. gunicorn worker) checks on its own when the index is next used, so
+# cases built while the app runs show up without a restart.
+CASE_RELOAD_INTERVAL = 2.0
+
+# Index of each case folder, keyed on the folder path, holding the entries of its
+# cases, the signature of the files each entry was built from and when the folder
+# was last checked
+_case_indexes = {}
+_case_index_lock = threading.Lock()
+
+
+def _case_signature(case_dir, json_name):
+    # Name, size and modification time of the definition and of every case file
+    signature = []
+    json_path = os.path.join(case_dir, json_name)
+    stat = os.stat(json_path)
+    signature.append((json_name, stat.st_size, stat.st_mtime_ns))
+    case_folder = os.path.join(case_dir, os.path.splitext(json_name)[0])
+    if os.path.isdir(case_folder):
+        for entry in sorted(os.scandir(case_folder), key=lambda entry: entry.name):
+            if entry.name.endswith(".nc"):
+                stat = entry.stat()
+                signature.append((entry.name, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+def index_case(case_dir, json_name):
+    """Indexes a case definition and the data built for it
+
+    Parameters
+    ----------
+    case_dir : str
+        The folder of case definitions, e.g. "cases/"
+    json_name : str
+        File name of the definition, e.g. "bc_case_2.json"
+
+    Returns
+    -------
+    dict
+        definition (the parsed JSON), folder (the case folder), built (whether the
+        folder exists), files (keyed on (model, variable), the path, size in bytes,
+        first and last month as YYYY-MM, number of time steps, members and
+        (lat, lon) grid shape of each case file, and whether it has a climatology),
+        members (the fewest members of any file, so every member offered exists),
+        time_range (the months every file covers) and bytes (the size of all files)
+    """
+    with open(os.path.join(case_dir, json_name)) as read_file:
+        definition = json.load(read_file)
+    case_folder = os.path.join(case_dir, os.path.splitext(json_name)[0])
+    files = {}
+    for mod in definition["mod_id_list"]:
+        for var in definition["var_id_list"]:
+            file_path = get_case_file_path(case_folder, mod, var)
+            if not os.path.isfile(file_path):
+                continue
+            with open_case_file(file_path, var) as dset:
+                dates = dset["time"].dt.strftime("%Y-%m").values
+                files[(mod, var)] = {
+                    "path": file_path,
+                    "bytes": os.path.getsize(file_path),
+                    "start": dates[0],
+                    "end": dates[-1],
+                    "time_steps": len(dates),
+                    "members": dset.sizes.get("member_num", 1),
+                    "grid_shape": (dset.sizes["lat"], dset.sizes["lon"]),
+                    "has_clim": os.path.isfile(
+                        get_case_file_path(case_folder, mod, var, "clim")
+                    ),
+                }
+    time_range = None
+    if files:
+        time_range = (
+            max(file_info["start"] for file_info in files.values()),
+            min(file_info["end"] for file_info in files.values()),
+        )
+    return {
+        "definition": definition,
+        "folder": case_folder,
+        "built": os.path.isdir(case_folder),
+        "files": files,
+        "members": min(
+            (file_info["members"] for file_info in files.values()),
+            default=definition["members"],
+        ),
+        "time_range": time_range,
+        "bytes": sum(file_info["bytes"] for file_info in files.values()),
+    }
+
+
+def get_case_index(case_dir, max_age=CASE_RELOAD_INTERVAL):
+    """Returns the index of every case definition in case_dir, re-indexing the cases
+    whose definition or files changed if the folder was last checked more than
+    max_age seconds ago
+
+    Returns
+    -------
+    dict
+        Entries from index_case() keyed on the definition's file name, sorted by name
+    """
+    with _case_index_lock:
+        cached = _case_indexes.get(case_dir)
+        if cached is not None and time.monotonic() - cached["checked"] < max_age:
+            return cached["cases"]
+        if cached is not None:
+            # Other threads keep using the current index while this one re-indexes
+            cached["checked"] = time.monotonic()
+        old_cases = {} if cached is None else cached["cases"]
+        old_signatures = {} if cached is None else cached["signatures"]
+    # Indexed without the lock, as re-indexing a case opens its files
+    cases = {}
+    signatures = {}
+    for json_name in sorted(os.listdir(case_dir)):
+        if not json_name.endswith(".json") or json_name == CASE_MANIFEST:
+            continue
+        try:
+            signature = _case_signature(case_dir, json_name)
+            if old_signatures.get(json_name) == signature:
+                cases[json_name] = old_cases[json_name]
+            else:
+                cases[json_name] = index_case(case_dir, json_name)
+        except (OSError, ValueError, KeyError) as error:
+            # A definition or file being written right now, picked up next time
+            print(f"Could not index case {json_name}: {error}")
+            if json_name in old_cases:
+                cases[json_name] = old_cases[json_name]
+                signatures[json_name] = old_signatures[json_name]
+            continue
+        signatures[json_name] = signature
+    with _case_index_lock:
+        _case_indexes[case_dir] = {
+            "cases": cases,
+            "signatures": signatures,
+            "checked": time.monotonic(),
+        }
+    return cases
+
+
+def get_case_entry(case_dir, json_name):
+    """Returns the index entry of one case, see index_case()"""
+    try:
+        return get_case_index(case_dir)[json_name]
+    except KeyError:
+        print(f"case should be one of {get_case_index(case_dir).keys()}")
+        raise KeyError
+
+
+def get_case_signature(case_dir, json_name):
+    """Returns the name, size and modification time of the definition and of every
+    file of a case as last indexed, which changes whenever the case is rebuilt or
+    updated, e.g. to key caches of data read from the case on"""
+    get_case_index(case_dir)
+    with _case_index_lock:
+        signatures = _case_indexes[case_dir]["signatures"]
+    try:
+        return signatures[json_name]
+    except KeyError:
+        print(f"case should be one of {signatures.keys()}")
+        raise KeyError
+
+
+def get_case_opts(case_dir):
+    """Options of the scenario dropdown: developer mode and every indexed case"""
+    case_opts = [{"label": "Developer Mode", "value": "None"}]
+    for json_name in get_case_index(case_dir):
+        case_opts.append({"label": json_name, "value": json_name})
+    return case_opts
+
+
+def is_date_in_case(
+    case_dir,
+    json_name,
+    date,
+    mod_id=None,
+    var_id=None,
+    resolution="monthly",
+    ignore_year=False,
+):
+    """Checks a date against the months on disk for a case
+
+    Parameters
+    ----------
+    case_dir : str
+        The folder of case definitions
+    json_name : str
+        File name of the case definition
+    date : str
+        YYYY/MM or YYYY-MM
+    mod_id, var_id : str, optional
+        Check against the file of this model and variable only, otherwise against
+        the months every file of the case covers
+    resolution : str
+        At coarser resolutions every month of the season or year holding date
+        must be on disk, as incomplete periods are not aggregated
+    ignore_year : bool
+        Check the month of date in the last year on disk instead, as piControl
+        cases are plotted from that year whatever the year selected (see
+        wrangling_utils.get_month_and_year())
+
+    Returns
+    -------
+    bool
+    """
+    entry = get_case_index(case_dir).get(json_name)
+    if entry is None:
+        return False
+    if mod_id is not None and var_id is not None:
+        file_info = entry["files"].get((mod_id, var_id))
+        if file_info is None:
+            return False
+        start, end = file_info["start"], file_info["end"]
+    elif entry["time_range"] is None:
+        return False
+    else:
+        start, end = entry["time_range"]
+    if ignore_year:
+        date_parts = date.replace("/", "-").split("-")
+        if len(date_parts) != 2:
+            return False
+        date = f"{end.split('-')[0]}-{date_parts[1]}"
+    try:
+        period_start, period_end = get_aggregate_period(date, resolution)
+    except ValueError:
+        # Still being typed into the date input
+        return False
+    return start <= period_start and period_end <= end
@@ -1,16 +1,285 @@
 import json
 import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 
+import cftime
+import netCDF4
+import numpy as np
 import xarray as xr
 
+from .extremes_utils import compute_quantiles
+from .extremes_utils import DEFAULT_QUANTILES
+from .extremes_utils import validate_quantiles
+from .metrics_utils import record_cache
+from .metrics_utils import timed
+from .reduction_utils import linear_trend
+from .reduction_utils import meridional_mean
+from .reduction_utils import zonal_mean
 from .wrangling_utils import get_cmpi6_model_run
 from .wrangling_utils import get_model_key
 from .wrangling_utils import get_var_key
 from .wrangling_utils import is_date_valid_for_exp
+from .wrangling_utils import select_var
 
+# Held while writing a case file, and while opening or closing the case file the
+# products derived from it are computed from. The HDF5 library under netCDF4 is not
+# thread safe and xarray only locks its reads and writes, not every open and close,
+# so cases built by parallel threads (see build_cases) could otherwise fail with an
+# HDF error.
+_case_write_lock = threading.RLock()
 
+
+class CaseFileCache:
+    """Products loaded or computed from case files, kept in memory
+
+    Entries are keyed on the file path, its modification time and whatever else
+    the product depends on. Caching an entry for a rewritten file drops the
+    entries of its older versions, and once max_entries are held the least
+    recently used entry is dropped, so long running workers do not accumulate
+    whole cases as they are updated or browsed.
+
+    Parameters
+    ----------
+    name : str
+        Name of the cache in the metrics, see metrics_utils.record_cache()
+    max_entries : int
+        Entries kept at most
+    """
+
+    def __init__(self, name, max_entries):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, file_path, key, load):
+        """Returns the entry of file_path and key (a tuple), calling load() to
+        create it if it is not cached"""
+        mtime = os.path.getmtime(file_path)
+        cache_key = (file_path, mtime, *key)
+        with self._lock:
+            hit = cache_key in self._entries
+            if hit:
+                self._entries.move_to_end(cache_key)
+                value = self._entries[cache_key]
+        record_cache(self.name, hit)
+        if hit:
+            return value
+        # Loaded without the lock, so one slow load does not hold up other entries
+        value = load()
+        with self._lock:
+            for old_key in list(self._entries):
+                if old_key[0] == file_path and old_key[1] != mtime:
+                    del self._entries[old_key]
+            self._entries[cache_key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Climatologies loaded from case folders
+_climatology_cache = CaseFileCache("climatology", 32)
+
+# Zonal and meridional means loaded from case folders, or computed from case files
+# built without them, keyed on the dimension each keeps
+_hovmoller_cache = CaseFileCache("hovmoller", 16)
+
+# Products written with every case file for the Hovmöller views, keyed on the
+# dimension each keeps besides member_num and time
+HOVMOLLER_PRODUCTS = {"lat": "zonal_mean", "lon": "meridional_mean"}
+
+# Aggregates computed from case files built without them, keyed on resolution
+_aggregate_cache = CaseFileCache("aggregate", 8)
+
+# Quantiles loaded from case folders, or computed from case files built without
+# them keyed on the quantiles
+_quantile_cache = CaseFileCache("quantiles", 16)
+
+# Trends of case files keyed on the start and end typed in the app, so bounded
+# tightly as each holds a map per member
+_trend_cache = CaseFileCache("trend", 8)
+
+# Products written with every case file holding its seasonal and annual means, named
+# after their key in get_resolution_key()
+AGGREGATE_PRODUCTS = ["season", "annual"]
+
+
+# This function returns a dictionary used to generate the temporal resolution
+# dropdown and to compute the aggregates of case files. anchor_month is a month the
+# periods start in and months their length.
+def get_resolution_key():
+    resolution_key = {
+        "monthly": {"fullname": "Monthly", "months": 1, "anchor_month": 1},
+        "season": {
+            "fullname": "Seasonal (DJF, MAM, JJA, SON)",
+            "months": 3,
+            "anchor_month": 12,
+        },
+        "annual": {
+            "fullname": "Annual",
+            "months": 12,
+            "anchor_month": 1,
+        },
+    }
+    return resolution_key
+
+
+# Name of the copy of the case definition written into a case folder once its files
+# are, recording what the folder holds for incremental updates
+CASE_MANIFEST = "case_definition.json"
+
+# Encoding used for case files whose definition does not name one
+DEFAULT_CASE_ENCODING = "none"
+
+
+# This function returns a dictionary used to validate the encoding of a case
+# definition and to build the encoding its netcdf files are written with
+def get_case_encoding_key():
+    encoding_key = {
+        "none": {"fullname": "xarray defaults, uncompressed"},
+        "float32": {"fullname": "Float32, uncompressed", "dtype": "float32"},
+        "float32_zlib": {
+            "fullname": "Float32, zlib level 4 with shuffle",
+            "dtype": "float32",
+            "compression": "zlib",
+            "complevel": 4,
+            "shuffle": True,
+        },
+        "float32_zstd": {
+            "fullname": "Float32, zstd level 3 with shuffle",
+            "dtype": "float32",
+            "compression": "zstd",
+            "complevel": 3,
+            "shuffle": True,
+        },
+        "int16_zlib": {
+            "fullname": "Int16 scale/offset packing, zlib level 4 with shuffle",
+            "dtype": "int16",
+            "compression": "zlib",
+            "complevel": 4,
+            "shuffle": True,
+        },
+        "int16_zstd": {
+            "fullname": "Int16 scale/offset packing, zstd level 3 with shuffle",
+            "dtype": "int16",
+            "compression": "zstd",
+            "complevel": 3,
+            "shuffle": True,
+        },
+    }
+    return encoding_key
+
+
+def get_case_encoding(dset, var_id, encoding_id, layout="map"):
+    """Builds the to_netcdf() encoding of a case file
+
+    var_id is stored with the dtype of the encoding, packed into int16 with a scale
+    factor and offset spanning its range for the int16 encodings, which computes the
+    range of var_id (so dset should be loaded first). Every data variable is
+    compressed as the encoding specifies, in chunks of one member and up to a year of
+    time steps so reading one month decompresses little besides that month. With the
+    "series" layout every variable is chunked as one grid cell with all its members
+    and time steps instead, whatever the encoding, so reading the time series of a
+    cell reads one chunk.
+
+    Parameters
+    ----------
+    dset : xarray.Dataset
+        The dataset to write
+    var_id : str
+        The variable the case holds
+    encoding_id : str
+        Must be a key in the dict returned by get_case_encoding_key()
+    layout : str
+        "map" for case files or "series" for their point time series copies
+
+    Returns
+    -------
+    dict
+        Encoding keyed on variable name, to pass to to_netcdf()
+    """
+    try:
+        options = get_case_encoding_key()[encoding_id]
+    except KeyError:
+        print(f"encoding should be one of {get_case_encoding_key().keys()}")
+        raise KeyError
+    zstd_support = getattr(netCDF4, "__has_zstandard_support__", False)
+    if options.get("compression") == "zstd" and not zstd_support:
+        print("This netCDF4 build can not write zstd compressed files")
+        raise AssertionError
+
+    encoding = {}
+    for name, data in dset.data_vars.items():
+        var_encoding = {}
+        if options.get("compression") == "zlib":
+            # Understood by netCDF4 and xarray releases predating compression=
+            var_encoding["zlib"] = True
+        elif "compression" in options:
+            var_encoding["compression"] = options["compression"]
+        if "compression" in options:
+            var_encoding["complevel"] = options["complevel"]
+            var_encoding["shuffle"] = options["shuffle"]
+            var_encoding["chunksizes"] = tuple(
+                1 if dim == "member_num" else min(size, 12) if dim == "time" else size
+                for dim, size in data.sizes.items()
+            )
+        if layout == "series":
+            var_encoding["chunksizes"] = tuple(
+                1 if dim in ("lat", "lon") else size for dim, size in data.sizes.items()
+            )
+        if name == var_id and "dtype" in options:
+            var_encoding["dtype"] = options["dtype"]
+        if name == var_id and options.get("dtype") == "int16":
+            # -32767 to 32767 hold the values, -32768 marks missing values
+            data_min = float(data.min())
+            data_max = float(data.max())
+            scale_factor = (data_max - data_min) / (2**16 - 2) or 1.0
+            var_encoding["scale_factor"] = np.float32(scale_factor)
+            var_encoding["add_offset"] = np.float32((data_max + data_min) / 2)
+            var_encoding["_FillValue"] = np.int16(-(2**15))
+        if var_encoding:
+            encoding[name] = var_encoding
+    return encoding
+
+
+def get_case_file_path(case_folder, mod_id, var_id, product=None):
+    """Returns the path of a case file
+
+    The monthly data for a model and variable lives in case_folder/model_variable.nc,
+    and products derived from it (e.g. the climatology) live alongside it in
+    case_folder/model_variable_product.nc
+    """
+    if product is None:
+        return f"{case_folder}/{mod_id}_{var_id}.nc"
+    return f"{case_folder}/{mod_id}_{var_id}_{product}.nc"
+
+
+def open_case_file(file_path, var_id):
+    """Opens var_id from a case file, skipping the bounds written with it
+
+    See select_var(); the time bounds of each member are the bulk of a case file's
+    metadata and would otherwise be decoded on every open.
+    """
+    return select_var(xr.open_dataset(file_path, decode_cf=False), var_id)
+
+
+@timed("case_write")
 def scenario_data_dict_to_netcdf(
-    scenario_name, xarray_dict, write_path, write_over=False
+    scenario_name,
+    xarray_dict,
+    write_path,
+    write_over=False,
+    product_dict=None,
+    encoding=DEFAULT_CASE_ENCODING,
 ):
     """Takes a dict of model, vars, and xarray dsets concatted along member axis,
     Creates a folder with the name of the scenario, and saves each xarray as a netcdf
@@ -21,19 +290,441 @@ def scenario_data_dict_to_netcdf(
                'var2' : xarray_dataset},
      ...
      'modely' {'var1' : xarray_dataset,
-               'var2' : xarray_dataset},"""
+               'var2' : xarray_dataset},
+
+    product_dict optionally holds dicts of the same form keyed on a product name
+    (e.g. {'clim': {'modelx': {'var1': xarray_dataset}}}) which are saved as
+    model_variable_product
+
+    Every file is written with the encoding named by encoding, see
+    get_case_encoding_key()"""
     file_path = write_path + "/" + scenario_name
     if os.path.isdir(file_path) & (not write_over):
         print("Scenario folder exists and write_over set to false!")
         raise OSError
-    os.mkdir(file_path)
+    os.makedirs(file_path, exist_ok=True)
     for mod in xarray_dict.keys():
         for var in xarray_dict[mod].keys():
-            xarray_dict[mod][var].to_netcdf(f"{file_path}/{mod}_{var}.nc")
+            write_case_file(
+                xarray_dict[mod][var],
+                var,
+                get_case_file_path(file_path, mod, var),
+                encoding,
+            )
+    if product_dict is None:
+        return
+    for product, product_data in product_dict.items():
+        for mod in product_data.keys():
+            for var in product_data[mod].keys():
+                write_case_file(
+                    product_data[mod][var],
+                    var,
+                    get_case_file_path(file_path, mod, var, product),
+                    encoding,
+                )
+
+
+def write_case_file(
+    dset, var_id, file_path, encoding=DEFAULT_CASE_ENCODING, layout="map"
+):
+    """Writes one case netcdf file with the named encoding and layout, see
+    get_case_encoding()"""
+    if get_case_encoding_key().get(encoding, {}).get("dtype") == "int16":
+        # Loaded once here rather than read for the range and again for the write
+        dset = dset.load()
+    with _case_write_lock:
+        dset.to_netcdf(
+            file_path, encoding=get_case_encoding(dset, var_id, encoding, layout)
+        )
+
+
+def _write_case_product(
+    dset, var_id, file_path, encoding=DEFAULT_CASE_ENCODING, layout="map"
+):
+    """Writes a case file or product through a temporary file swapped in with
+    os.replace(), so the app never reads half a file, see write_case_file()"""
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with _case_write_lock:
+        write_case_file(dset, var_id, tmp_path, encoding, layout)
+        os.replace(tmp_path, file_path)
+
+
+@contextmanager
+def _open_case_source(file_path, var_id):
+    # Opens the case file a product is computed from, see _case_write_lock. Only the
+    # open and close wait for other threads' writes, so products of several cases
+    # are computed at once.
+    with _case_write_lock:
+        dset = open_case_file(file_path, var_id)
+    try:
+        yield dset
+    finally:
+        with _case_write_lock:
+            dset.close()
+
+
+def write_case_series(case_folder, mod_id, var_id, encoding=DEFAULT_CASE_ENCODING):
+    """Writes the point time series copy of a case file
+
+    The copy (model_variable_series.nc) holds var_id only, laid out for reading the
+    time series of one grid cell (see get_case_encoding()) rather than one month of
+    the whole region.
+    """
+    file_path = get_case_file_path(case_folder, mod_id, var_id)
+    series_path = get_case_file_path(case_folder, mod_id, var_id, "series")
+    with _open_case_source(file_path, var_id) as dset:
+        dset = dset[[var_id]].load()
+    _write_case_product(dset, var_id, series_path, encoding, layout="series")
+
+
+def compute_hovmoller(dset, var_id, dim, time_chunk=12):
+    """Computes the zonal (dim="lat") or meridional (dim="lon") mean of a case
+
+    The case is chunked along time and reduced with dask, so the data is streamed
+    through a year at a time when the mean is computed or written rather than being
+    loaded into memory as a whole.
+
+    Parameters
+    ----------
+    dset : xarray.Dataset
+        Case dataset, e.g. from open_case_file(), with lat and lon dimensions
+    var_id : str
+        The variable to reduce
+    dim : str
+        The dimension kept, a key of HOVMOLLER_PRODUCTS
+    time_chunk : int
+        Time steps reduced at once
+
+    Returns
+    -------
+    xarray.Dataset
+        Lazy dataset with var_id reduced over the other horizontal dimension
+    """
+    var_data = dset[var_id].chunk({"time": time_chunk})
+    if dim == "lat":
+        mean = zonal_mean(var_data)
+    elif dim == "lon":
+        mean = meridional_mean(var_data)
+    else:
+        print(f"dim should be one of {HOVMOLLER_PRODUCTS.keys()}")
+        raise KeyError
+    return mean.to_dataset(name=var_id)
+
+
+def write_case_hovmoller(case_folder, mod_id, var_id, encoding=DEFAULT_CASE_ENCODING):
+    """Writes the zonal and meridional means of a case file alongside it
+
+    Each mean is streamed from the case file on disk, see compute_hovmoller().
+    """
+    file_path = get_case_file_path(case_folder, mod_id, var_id)
+    with _open_case_source(file_path, var_id) as dset:
+        for dim, product in HOVMOLLER_PRODUCTS.items():
+            product_path = get_case_file_path(case_folder, mod_id, var_id, product)
+            mean = compute_hovmoller(dset, var_id, dim).load()
+            _write_case_product(mean, var_id, product_path, encoding)
+
+
+def load_case_hovmoller(case_folder, mod_id, var_id, dim):
+    """Loads the zonal (dim="lat") or meridional (dim="lon") mean of a case file,
+    caching it in memory
+
+    Cases built without the means have them computed from the case file, streaming
+    through it once, and cached in the same way.
+    """
+    file_path = get_case_file_path(case_folder, mod_id, var_id, HOVMOLLER_PRODUCTS[dim])
+    written = os.path.isfile(file_path)
+    if not written:
+        file_path = get_case_file_path(case_folder, mod_id, var_id)
+
+    def load():
+        with open_case_file(file_path, var_id) as dset:
+            if not written:
+                dset = compute_hovmoller(dset, var_id, dim)
+            return dset.load()
+
+    return _hovmoller_cache.get(file_path, (dim,), load)
+
+
+def _period_start(month_num, resolution):
+    # Months counted from year 0 to the first month of their period
+    options = get_resolution_key()[resolution]
+    return month_num - (month_num - options["anchor_month"] + 1) % options["months"]
+
 
+def get_aggregate_period(date, resolution):
+    """Returns the first and last month of the period at a temporal resolution
+    holding a month, e.g. ("1951-12", "1952-02") for "1952-01" and "season"
 
-def get_case_data(data_store, case_definition, write_path="None"):
+    Parameters
+    ----------
+    date : str
+        YYYY-MM or YYYY/MM
+    resolution : str
+        Must be a key in the dict returned by get_resolution_key()
+
+    Returns
+    -------
+    tuple of str
+        YYYY-MM dates. Aggregates are labelled with their first month.
+
+    Raises
+    ------
+    ValueError
+        If date is not a month of the form above
+    """
+    year, month = (int(part) for part in date.replace("/", "-").split("-"))
+    if not 1 <= month <= 12:
+        raise ValueError(f"{date} is not a month")
+    start_num = _period_start(year * 12 + month - 1, resolution)
+    end_num = start_num + get_resolution_key()[resolution]["months"] - 1
+    return tuple(f"{num // 12:04d}-{num % 12 + 1:02d}" for num in (start_num, end_num))
 
+
+def compute_aggregate(dset, var_id, resolution, time_chunk=12):
+    """Computes the seasonal or annual means of a case
+
+    Each month is weighted by its number of days in the calendar of the case (e.g.
+    30 for every month of 360_day calendars, 28 for every February of noleap ones)
+    and missing values are left out. Periods the case only partly covers, like the
+    first DJF of a case starting in January, are dropped. The case is chunked along
+    time and reduced per period with dask, so it is streamed through a year at a
+    time when the means are computed or written. Each mean is labelled with the time
+    of the first month of its period, so get_month_and_year() selects it with that
+    month.
+
+    Parameters
+    ----------
+    dset : xarray.Dataset
+        Monthly case dataset, e.g. from open_case_file()
+    var_id : str
+        The variable to aggregate
+    resolution : str
+        "season" or "annual", see get_resolution_key()
+    time_chunk : int
+        Time steps read at once
+
+    Returns
+    -------
+    xarray.Dataset
+        Lazy dataset of var_id with one time step per period
+    """
+    var_data = dset[var_id].chunk({"time": time_chunk})
+    times = var_data["time"]
+    month_num = times.dt.year * 12 + times.dt.month - 1
+    period = _period_start(month_num, resolution).rename("period")
+    days = times.dt.days_in_month
+    total = (var_data * days).groupby(period).sum()
+    weight_sum = days.where(var_data.notnull(), 0).groupby(period).sum()
+    mean = (total / weight_sum).where(weight_sum > 0)
+
+    months = period.groupby(period).count()
+    first_time = times.groupby(period).min()
+    mean = mean.assign_coords(period=first_time.values).rename(period="time")
+    complete = months.values == get_resolution_key()[resolution]["months"]
+    mean = mean.isel(time=complete).transpose(*var_data.dims)
+    mean.attrs = dict(dset[var_id].attrs)
+    mean.attrs["resolution"] = resolution
+    return mean.to_dataset(name=var_id)
+
+
+def write_case_aggregates(case_folder, mod_id, var_id, encoding=DEFAULT_CASE_ENCODING):
+    """Writes the seasonal and annual means of a case file alongside it
+
+    Each is streamed from the case file on disk, see compute_aggregate(), and held
+    in memory only until written.
+    """
+    file_path = get_case_file_path(case_folder, mod_id, var_id)
+    with _open_case_source(file_path, var_id) as dset:
+        for resolution in AGGREGATE_PRODUCTS:
+            product_path = get_case_file_path(case_folder, mod_id, var_id, resolution)
+            aggregate = compute_aggregate(dset, var_id, resolution).load()
+            _write_case_product(aggregate, var_id, product_path, encoding)
+
+
+def open_case_aggregate(case_folder, mod_id, var_id, resolution):
+    """Opens the seasonal or annual means of a case file
+
+    Cases built without them have them computed from the case file once and cached
+    in memory.
+    """
+    file_path = get_case_file_path(case_folder, mod_id, var_id, resolution)
+    if os.path.isfile(file_path):
+        return open_case_file(file_path, var_id)
+    file_path = get_case_file_path(case_folder, mod_id, var_id)
+
+    def load():
+        with open_case_file(file_path, var_id) as dset:
+            return compute_aggregate(dset, var_id, resolution).load()
+
+    return _aggregate_cache.get(file_path, (resolution,), load)
+
+
+def aggregate_climatology(clim, var_id, resolution, calendar="noleap"):
+    """Aggregates a monthly climatology to the periods of a temporal resolution
+
+    The months are weighted by their days in calendar, as in compute_aggregate(), so
+    get_anomaly() of the aggregates with the result gives the aggregates of the
+    monthly anomalies (leap days aside).
+
+    Returns
+    -------
+    xarray.Dataset
+        var_id indexed by the first month of each period in place of the month
+    """
+    month = clim["month"]
+    days = xr.DataArray(
+        [
+            cftime.datetime(2001, int(num), 1, calendar=calendar).daysinmonth
+            for num in month.values
+        ],
+        coords={"month": month},
+        dims="month",
+    )
+    first_month = _period_start(month - 1, resolution) % 12 + 1
+    clim_data = clim[var_id]
+    total = (clim_data * days).groupby(first_month.rename("period")).sum()
+    weight_sum = (
+        days.where(clim_data.notnull(), 0).groupby(first_month.rename("period")).sum()
+    )
+    aggregate = (total / weight_sum).rename(period="month").transpose(*clim_data.dims)
+    aggregate.attrs = dict(clim_data.attrs)
+    return aggregate.to_dataset(name=var_id)
+
+
+def write_case_quantiles(
+    case_folder,
+    mod_id,
+    var_id,
+    quantiles=DEFAULT_QUANTILES,
+    encoding=DEFAULT_CASE_ENCODING,
+):
+    """Writes the quantiles of every grid cell over all members and months of a case
+    file alongside it
+
+    They are computed block by block from the case file on disk, see
+    extremes_utils.compute_quantiles().
+    """
+    file_path = get_case_file_path(case_folder, mod_id, var_id)
+    product_path = get_case_file_path(case_folder, mod_id, var_id, "quantiles")
+    with _open_case_source(file_path, var_id) as dset:
+        result = compute_quantiles(dset, var_id, quantiles).load()
+    _write_case_product(result, var_id, product_path, encoding)
+
+
+def load_case_quantiles(case_folder, mod_id, var_id, quantiles):
+    """Loads quantiles of every grid cell of a case file, caching them in memory
+
+    The quantiles written with the case are used if they include every one asked
+    for, otherwise they are computed from the case file and cached in the same way.
+
+    Returns
+    -------
+    xarray.Dataset
+        var_id with a quantile dimension, see extremes_utils.compute_quantiles()
+    """
+    quantiles = validate_quantiles(quantiles)
+    file_path = get_case_file_path(case_folder, mod_id, var_id, "quantiles")
+    if os.path.isfile(file_path):
+
+        def load_written():
+            with open_case_file(file_path, var_id) as dset:
+                return dset.load()
+
+        written = _quantile_cache.get(file_path, (), load_written)
+        if np.isin(quantiles, written["quantile"].values).all():
+            return written.sel(quantile=quantiles)
+    case_path = get_case_file_path(case_folder, mod_id, var_id)
+
+    def load():
+        with open_case_file(case_path, var_id) as dset:
+            return compute_quantiles(dset, var_id, quantiles).load()
+
+    return _quantile_cache.get(case_path, tuple(quantiles), load)
+
+
+def compute_trend(dset, var_id, start_date=None, end_date=None, time_chunk=12):
+    """Computes the linear trend per decade of every grid cell (and member) of a case
+
+    The trend is the least squares slope of reduction_utils.linear_trend(), found
+    in a single pass over the case chunked along time.
+
+    Parameters
+    ----------
+    dset : xarray.Dataset
+        Monthly case dataset, e.g. from open_case_file()
+    var_id : str
+        The variable to fit
+    start_date, end_date : str, optional
+        First and last month of the period as YYYY-MM, the whole case by default
+    time_chunk : int
+        Time steps read at once
+
+    Returns
+    -------
+    xarray.Dataset
+        Lazy dataset of var_id with the time dimension reduced. The attribute
+        trend_period holds the months fitted as YYYY-MM/YYYY-MM.
+    """
+    var_data = dset[var_id].sel(time=slice(start_date, end_date))
+    dates = var_data["time"].dt.strftime("%Y-%m").values
+    if len(dates) == 0:
+        print(f"No months of the case are between {start_date} and {end_date}")
+        raise KeyError
+    trend = linear_trend(var_data.chunk({"time": time_chunk})) * 10
+    trend.attrs = dict(dset[var_id].attrs)
+    trend.attrs["trend_period"] = f"{dates[0]}/{dates[-1]}"
+    return trend.to_dataset(name=var_id)
+
+
+def load_case_trend(case_folder, mod_id, var_id, start_date=None, end_date=None):
+    """Loads the trends per decade of a case file over a period, see compute_trend(),
+    caching them in memory so switching members or statistics does not refit"""
+    file_path = get_case_file_path(case_folder, mod_id, var_id)
+
+    def load():
+        with open_case_file(file_path, var_id) as dset:
+            return compute_trend(dset, var_id, start_date, end_date).load()
+
+    return _trend_cache.get(file_path, (start_date, end_date), load)
+
+
+@timed("point_series")
+def get_point_series(case_folder, mod_id, var_id, lat, lon):
+    """Reads every member's time series at the grid cell nearest to a point
+
+    Reads the point time series copy of the case file when the case was built with
+    one, and the case file itself otherwise.
+
+    Parameters
+    ----------
+    case_folder : str
+        The folder of the case
+    mod_id : str
+        The model
+    var_id : str
+        The variable
+    lat : float
+        Latitude of the point
+    lon : float
+        Longitude of the point, -180 to 180 or 0 to 360
+
+    Returns
+    -------
+    xarray.Dataset
+        var_id with member_num and time dimensions, and the lat and lon of the cell
+        as scalar coordinates
+    """
+    file_path = get_case_file_path(case_folder, mod_id, var_id, "series")
+    if not os.path.isfile(file_path):
+        file_path = get_case_file_path(case_folder, mod_id, var_id)
+    with open_case_file(file_path, var_id) as dset:
+        if float(dset["lon"].max()) > 180:
+            lon = lon % 360
+        return dset[[var_id]].sel(lat=lat, lon=lon, method="nearest").load()
+
+
+@timed("get_case_data")
+def get_case_data(data_store, case_definition, write_path="None", fetched=None):
     """Queries a given data store for the specification and returns and writes the data
 
     Wraps a query for the data_store to get the xarray. Variable id must be supported
@@ -51,7 +742,15 @@ def get_case_data(data_store, case_definition, write_path="None"):
 
     write_path : str
         Ignored if xarr_write_path is set to none. Path where the netCDF file with
-        case data will be written.
+        case data will be written. If the case definition has a baseline, the
+        monthly climatology of each model and variable is written alongside, as are
+        their zonal and meridional means (see write_case_hovmoller()).
+
+    fetched : dict
+        Optional members already fetched, as a list of datasets keyed on
+        (model, variable, experiment) covering at least the region and periods of
+        the case, to build from instead of querying data_store (see
+        build_cases.fetch_run())
 
 
     Returns
@@ -65,21 +764,38 @@ def get_case_data(data_store, case_definition, write_path="None"):
     right_lon_bnd = case_definition["bottom_right"][1]
     left_lon_bnd = case_definition["top_left"][1]
 
+    def clip_members(dsets, start_date, end_date):
+        # The clipping to geographic area and time step
+        return [
+            clip_xarray(
+                dset,
+                top_lat_bnd,
+                bottom_lat_bnd,
+                right_lon_bnd,
+                left_lon_bnd,
+                lons_360=False,
+            ).sel(time=slice(start_date, end_date))
+            for dset in dsets
+        ]
+
+    def open_run(var, mod, exp_id):
+        if fetched is not None:
+            return fetched[(mod, var, exp_id)][: case_definition["members"]]
+        return get_cmpi6_model_run(
+            data_store, var, mod, exp_id, case_definition["members"]
+        )
+
     return_dict = {}
+    clim_dict = {}
     # Iterating through all the models, creating a dictionary with a variable var_dict
     # and fetching the xarray set for the first n members in that variable/model
     # combo and joining all the members into the same xarray set
     for mod in case_definition["mod_id_list"]:
         var_dict = {}
+        clim_var_dict = {}
         # The fetching step
         for var in case_definition["var_id_list"]:
-            dsets = get_cmpi6_model_run(
-                data_store,
-                var,
-                mod,
-                case_definition["exp_id"],
-                case_definition["members"],
-            )
+            dsets = open_run(var, mod, case_definition["exp_id"])
             # Here we deal with the piControl edge case. Since the dates are not
             # Consistent between models for piControl, we get the last year available
             # And save that as the data for each model.
@@ -94,30 +810,148 @@ def get_case_data(data_store, case_definition, write_path="None"):
             else:
                 start_date = case_definition["start_date"]
                 end_date = case_definition["end_date"]
-            # The clipping to geographic area and time step
-            dsets_clipped = [
-                clip_xarray(
-                    dset,
-                    top_lat_bnd,
-                    bottom_lat_bnd,
-                    right_lon_bnd,
-                    left_lon_bnd,
-                    lons_360=False,
-                ).sel(time=slice(start_date, end_date))
-                for dset in dsets
-            ]
+            dsets_clipped = clip_members(dsets, start_date, end_date)
             # The joining on member axis step
             var_dict[var] = join_members(dsets_clipped)
+
+            # The baseline climatology, only fetching again if the baseline comes
+            # from a different experiment than the case. piControl dates are not
+            # comparable between models so its baseline is the case period itself.
+            if "baseline_start" in case_definition:
+                baseline_exp = case_definition["baseline_exp_id"]
+                if baseline_exp == "piControl":
+                    base_start, base_end = start_date, end_date
+                else:
+                    base_start = case_definition["baseline_start"]
+                    base_end = case_definition["baseline_end"]
+                if baseline_exp != case_definition["exp_id"]:
+                    dsets = open_run(var, mod, baseline_exp)
+                baseline_dset = join_members(clip_members(dsets, base_start, base_end))
+                clim_var_dict[var] = compute_climatology(
+                    baseline_dset, var, base_start, base_end
+                )
         return_dict[mod] = var_dict
+        clim_dict[mod] = clim_var_dict
 
     if write_path != "None":
+        product_dict = None
+        if "baseline_start" in case_definition:
+            product_dict = {"clim": clim_dict}
         scenario_data_dict_to_netcdf(
-            case_definition["case_name"], return_dict, write_path
+            case_definition["case_name"],
+            return_dict,
+            write_path,
+            product_dict=product_dict,
+            encoding=case_definition.get("encoding", DEFAULT_CASE_ENCODING),
         )
+        case_folder = write_path + "/" + case_definition["case_name"]
+        encoding = case_definition.get("encoding", DEFAULT_CASE_ENCODING)
+        for mod in return_dict:
+            for var in return_dict[mod]:
+                write_case_hovmoller(case_folder, mod, var, encoding)
+                write_case_aggregates(case_folder, mod, var, encoding)
+                quantiles = case_definition.get("quantiles", DEFAULT_QUANTILES)
+                write_case_quantiles(case_folder, mod, var, quantiles, encoding)
+                if case_definition.get("point_series"):
+                    write_case_series(case_folder, mod, var, encoding)
+        write_case_manifest(case_folder, case_definition)
     else:
         return return_dict
 
 
+def write_case_manifest(case_folder, case_definition):
+    """Records the definition a case folder was built from, see CASE_MANIFEST"""
+    tmp_path = f"{case_folder}/{CASE_MANIFEST}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as write_file:
+        json.dump(case_definition, write_file, indent=4)
+    os.replace(tmp_path, f"{case_folder}/{CASE_MANIFEST}")
+
+
+def read_case_manifest(case_folder):
+    """The definition a case folder was built from, None for folders built before
+    manifests were written"""
+    try:
+        with open(f"{case_folder}/{CASE_MANIFEST}") as read_file:
+            return json.load(read_file)
+    except FileNotFoundError:
+        return None
+
+
+def compute_climatology(dset, var_id, start_date, end_date, time_chunk=12):
+    """Computes the monthly climatology of a variable over a baseline period
+
+    The baseline is chunked along time and reduced with a dask groupby, so the data
+    is streamed through once when the climatology is computed or written rather than
+    being loaded into memory as a whole.
+
+    Parameters
+    ----------
+    dset : xarray.Dataset
+        Dataset covering the baseline period, may have a member_num dimension
+    var_id : str
+        The variable to compute the climatology for
+    start_date : str
+        Of the form YYYY-MM. Start of the baseline period
+    end_date : str
+        Of the form YYYY-MM. End of the baseline period
+
+    Returns
+    -------
+    clim : xarray.Dataset
+        Lazy dataset with var_id indexed by month (1-12) in place of time
+    """
+    baseline = dset[var_id].sel(time=slice(start_date, end_date))
+    if baseline.sizes["time"] == 0:
+        print(f"No data between {start_date} and {end_date} for the baseline!")
+        raise AssertionError
+    clim = baseline.chunk({"time": time_chunk}).groupby("time.month").mean("time")
+    clim.attrs = dict(dset[var_id].attrs)
+    clim.attrs["baseline_period"] = f"{start_date}/{end_date}"
+    return clim.to_dataset(name=var_id)
+
+
+def get_anomaly(dset, var_id, clim):
+    """Subtracts a monthly climatology from a dataset
+
+    Parameters
+    ----------
+    dset : xarray.Dataset
+        Dataset with a time dimension
+    var_id : str
+        The variable to compute the anomaly of
+    clim : xarray.Dataset
+        Climatology created by compute_climatology(). If it has a member_num
+        dimension that dset does not, the ensemble mean climatology is used.
+
+    Returns
+    -------
+    xarray.Dataset
+        Copy of dset with var_id replaced by its anomaly
+    """
+    clim_data = clim[var_id]
+    if "member_num" in clim_data.dims and "member_num" not in dset[var_id].dims:
+        clim_data = clim_data.mean("member_num")
+    anomaly = dset[var_id].groupby("time.month") - clim_data
+    anomaly.attrs = dset[var_id].attrs
+    return dset.assign({var_id: anomaly.drop_vars("month")})
+
+
+def load_case_climatology(case_folder, mod_id, var_id):
+    """Loads the climatology written with a case, caching it in memory
+
+    Returns None if the case was built without a baseline.
+    """
+    file_path = get_case_file_path(case_folder, mod_id, var_id, "clim")
+    if not os.path.isfile(file_path):
+        return None
+
+    def load():
+        with xr.open_dataset(file_path) as clim:
+            return clim.load()
+
+    return _climatology_cache.get(file_path, (), load)
+
+
 def clip_xarray(
     xarray_dset,
     top_lat_bnd,
@@ -182,6 +1016,10 @@ def write_case_definition(
     top_left,
     bottom_right,
     write_path="None",
+    baseline=None,
+    encoding=None,
+    point_series=False,
+    quantiles=None,
 ):
     """
     This function creates and validates a dictionary to use with get_case and writes
@@ -230,6 +1068,26 @@ def write_case_definition(
     write_path : str
         The file path + file name for writing the json
 
+    baseline : tuple (str, str)
+        Optional (start, end) dates of the form YYYY-MM e.g ('1850-01', '1900-12')
+        of the period to compute a monthly climatology over for anomalies. The
+        baseline is taken from the historical experiment if it is not covered by
+        exp_id. Ignored for piControl, where the case period is used.
+
+    encoding : str
+        Optional encoding of the case files, a key in the dict returned by
+        get_case_encoding_key(). DEFAULT_CASE_ENCODING if not given.
+
+    point_series : bool
+        Also write a copy of each case file laid out for reading the time series of
+        a grid cell (see write_case_series()), making clicks on the map fast at the
+        cost of about doubling the size of the case.
+
+    quantiles : list of float
+        Optional quantiles between 0 and 1 of every grid cell over all members and
+        months to write with the case for the extremes maps (see
+        write_case_quantiles()). DEFAULT_QUANTILES if not given.
+
     Returns
     -------
     case_definition : dict
@@ -298,6 +1156,31 @@ def write_case_definition(
         "bottom_right": bottom_right,
     }
 
+    if baseline is not None:
+        baseline_exp = exp_id
+        for date in baseline:
+            if not is_date_valid_for_exp(exp_id, date, sep="-"):
+                baseline_exp = "historical"
+        for date in baseline:
+            if not is_date_valid_for_exp(baseline_exp, date, sep="-"):
+                print(f"baseline {date} not valid for {baseline_exp}!")
+                raise AssertionError
+        case_definition["baseline_start"] = baseline[0]
+        case_definition["baseline_end"] = baseline[1]
+        case_definition["baseline_exp_id"] = baseline_exp
+
+    if encoding is not None:
+        if encoding not in get_case_encoding_key():
+            print(f"encoding should be one of {get_case_encoding_key().keys()}")
+            raise KeyError
+        case_definition["encoding"] = encoding
+
+    if point_series:
+        case_definition["point_series"] = True
+
+    if quantiles is not None:
+        case_definition["quantiles"] = validate_quantiles(quantiles)
+
     if write_path != "None":
         with open(write_path, "w") as write_file:
             json.dump(case_definition, write_file, indent=4)
@@ -0,0 +1,160 @@
+from .case_utils import CaseFileCache
+from .case_utils import get_anomaly
+from .case_utils import open_case_file
+
+# Computed ensemble statistics for case files, keyed on var_id, stat and baseline
+# besides the file and its modification time, so a rewritten case file is never
+# served stale statistics. Each holds the whole case period.
+_case_stat_cache = CaseFileCache("ensemble_stat", 8)
+
+
+# This function returns a dictionary used to (1) generate the ensemble options in
+# the member dropdown and (2) validate the stat requested from ensemble_stat()
+def get_ensemble_stat_key():
+    stat_key = {
+        "mean": {"fullname": "Ensemble Mean"},
+        "std": {"fullname": "Ensemble Std. Dev"},
+        "p10": {"fullname": "Ensemble 10th Percentile", "quantile": 0.1},
+        "p90": {"fullname": "Ensemble 90th Percentile", "quantile": 0.9},
+        "spread": {"fullname": "Ensemble Spread (Max - Min)"},
+    }
+    return stat_key
+
+
+def get_member_opts(members):
+    """Generates the dash options for the member dropdown of a case
+
+    Parameters
+    ----------
+    members : int
+        Number of members in the case
+
+    Returns
+    -------
+    member_opts : list
+        Individual members followed by the ensemble statistics, of the form
+        [{"label": "Member 0", "value": "0"}, ...
+         {"label": "Ensemble Mean", "value": "mean"}, ...]
+    """
+    member_opts = [
+        {"label": f"Member {num}", "value": str(num)} for num in range(members)
+    ]
+    for stat, stat_dict in get_ensemble_stat_key().items():
+        member_opts.append({"label": stat_dict["fullname"], "value": stat})
+    return member_opts
+
+
+def is_ensemble_stat(member):
+    """Returns true if the member selection is an ensemble statistic rather than
+    an individual member number"""
+    return str(member) in get_ensemble_stat_key()
+
+
+def ensemble_stat(dset, var_id, stat, space_chunk=90, time_chunk=12):
+    """Lazily computes an ensemble statistic across the member_num dimension
+
+    The member dimension is kept in a single chunk (required for quantiles) and the
+    data is chunked along space and time so only the chunks touched by a later
+    selection are ever computed.
+
+    Parameters
+    ----------
+    dset : xarray.Dataset
+        Multi-member dataset in the format created by join_members()
+    var_id : str
+        The variable to compute the statistic for
+    stat : str
+        Must be a key in the dict returned by get_ensemble_stat_key()
+    space_chunk : int
+        Chunk size along lat and lon
+    time_chunk : int
+        Chunk size along time
+
+    Returns
+    -------
+    stat_dset : xarray.Dataset
+        Dask backed dataset containing var_id with the member_num dimension reduced
+    """
+    stat_key = get_ensemble_stat_key()
+    if stat not in stat_key:
+        print(f"stat should be one of {stat_key.keys()}")
+        raise KeyError
+
+    chunks = {"member_num": -1}
+    for dim, size in (("lat", space_chunk), ("lon", space_chunk), ("time", time_chunk)):
+        if dim in dset[var_id].dims:
+            chunks[dim] = size
+    var_data = dset[var_id].chunk(chunks)
+
+    if stat == "mean":
+        stat_data = var_data.mean(dim="member_num")
+    elif stat == "std":
+        stat_data = var_data.std(dim="member_num")
+    elif stat == "spread":
+        stat_data = var_data.max(dim="member_num") - var_data.min(dim="member_num")
+    else:
+        stat_data = var_data.quantile(
+            stat_key[stat]["quantile"], dim="member_num"
+        ).drop_vars("quantile")
+
+    stat_data.attrs = dset[var_id].attrs
+    return stat_data.to_dataset(name=var_id)
+
+
+def select_member(dset, var_id, member=0):
+    """Resolves a member dropdown selection on a multi-member dataset
+
+    Parameters
+    ----------
+    dset : xarray.Dataset
+        Dataset which may or may not have a member_num dimension. Datasets without
+        one are returned unchanged.
+    var_id : str
+        The variable selected
+    member : int or str
+        Either a member number or a key of get_ensemble_stat_key()
+
+    Returns
+    -------
+    xarray.Dataset
+        Dataset without the member_num dimension
+    """
+    if "member_num" not in dset.dims:
+        return dset
+    if is_ensemble_stat(member):
+        return ensemble_stat(dset, var_id, str(member))
+    return dset.sel(member_num=int(member))
+
+
+def get_case_ensemble_stat(file_path, var_id, stat, clim=None):
+    """Computes and caches an ensemble statistic for a case file
+
+    The statistic is computed once over the whole case with dask and then held in
+    memory, so switching dates or views in the dashboard does not recompute it.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to a case netcdf written by scenario_data_dict_to_netcdf()
+    var_id : str
+        The variable to compute the statistic for
+    stat : str
+        Must be a key in the dict returned by get_ensemble_stat_key()
+    clim : xarray.Dataset
+        Optional climatology from compute_climatology(). If given, the statistic is
+        computed over the anomalies of each member.
+
+    Returns
+    -------
+    xarray.Dataset
+        The computed statistic with the member_num dimension reduced
+    """
+    baseline = None if clim is None else clim[var_id].attrs.get("baseline_period")
+
+    def load():
+        with open_case_file(file_path, var_id) as dset:
+            if clim is not None:
+                dset = get_anomaly(dset, var_id, clim)
+            return ensemble_stat(dset, var_id, stat).load()
+
+    return _case_stat_cache.get(file_path, (var_id, stat, baseline), load)
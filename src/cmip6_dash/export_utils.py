@@ -0,0 +1,385 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+
+import numpy as np
+
+from .case_utils import get_aggregate_period
+from .case_utils import lon_180_to_360
+from .metrics_utils import record_span
+
+# Environment variables read by get_export_config()
+EXPORT_ENV = {
+    "max_exports": "CMIP6_EXPORT_MAX",
+    "wait": "CMIP6_EXPORT_WAIT",
+    "time_chunk": "CMIP6_EXPORT_TIME_CHUNK",
+    "tmp_dir": "CMIP6_EXPORT_TMP_DIR",
+}
+
+# Bytes sent to the client at once
+EXPORT_PIECE_BYTES = 2**20
+
+
+def get_export_config():
+    """Returns the export configuration from the environment
+
+    Returns
+    -------
+    dict
+        max_exports (exports each process streams at once, default 1), wait (seconds
+        an export waits for one of those slots before being refused, default 0),
+        time_chunk (time steps read and written at once, default 12) and tmp_dir
+        (where NetCDF and Zarr exports are staged, default the system temp dir)
+    """
+    return {
+        "max_exports": int(os.environ.get(EXPORT_ENV["max_exports"], 1)),
+        "wait": float(os.environ.get(EXPORT_ENV["wait"], 0)),
+        "time_chunk": int(os.environ.get(EXPORT_ENV["time_chunk"], 12)),
+        "tmp_dir": os.environ.get(EXPORT_ENV["tmp_dir"]) or None,
+    }
+
+
+# Exports a process streams at once. Each holds a server thread for as long as the
+# download takes, so without a limit a few downloads would leave no threads for the
+# dashboard's callbacks.
+_export_slots = threading.BoundedSemaphore(get_export_config()["max_exports"])
+
+
+# This function returns a dictionary used to validate the format of an export and
+# to build its response
+def get_export_format_key():
+    format_key = {
+        "netcdf": {
+            "fullname": "NetCDF",
+            "mimetype": "application/x-netcdf",
+            "extension": ".nc",
+        },
+        "zarr": {
+            "fullname": "Zarr (zip)",
+            "mimetype": "application/zip",
+            "extension": ".zarr.zip",
+        },
+        "csv": {"fullname": "CSV", "mimetype": "text/csv", "extension": ".csv"},
+    }
+    return format_key
+
+
+def parse_export_args(args):
+    """Reads the subset and format of an export from request arguments
+
+    Parameters
+    ----------
+    args : dict like
+        case, model and var (required), start and end (YYYY-MM), lat_min, lat_max,
+        lon_min and lon_max (lon -180-180), members (comma separated member
+        numbers) and format (a key in get_export_format_key(), default netcdf)
+
+    Returns
+    -------
+    dict
+        The arguments of select_subset() besides dset and var_id, plus case, model,
+        var and format
+
+    Raises
+    ------
+    ValueError
+        If an argument is missing or malformed, e.g. a month outside 1-12
+    """
+    export = {}
+    for name in ("case", "model", "var"):
+        if not args.get(name):
+            raise ValueError(f"{name} is required")
+        export[name] = args[name]
+    export["format"] = args.get("format", "netcdf")
+    if export["format"] not in get_export_format_key():
+        raise ValueError(f"format should be one of {list(get_export_format_key())}")
+    for name in ("start", "end"):
+        date = args.get(name) or None
+        if date is not None:
+            date = get_aggregate_period(date, "monthly")[0]
+        export[name] = date
+    for name in ("lat_min", "lat_max", "lon_min", "lon_max"):
+        export[name] = float(args[name]) if args.get(name) else None
+    members = args.get("members") or None
+    if members is not None:
+        members = [int(num) for num in members.split(",")]
+    export["members"] = members
+    return export
+
+
+def select_subset(
+    dset,
+    var_id,
+    start=None,
+    end=None,
+    lat_min=None,
+    lat_max=None,
+    lon_min=None,
+    lon_max=None,
+    members=None,
+    **kwargs,
+):
+    """Lazily selects the months, region and members of a case dataset
+
+    Parameters
+    ----------
+    dset : xarray.Dataset
+        Case dataset, e.g. from case_utils.open_case_file()
+    var_id : str
+        The variable exported
+    start, end : str, optional
+        First and last month as YYYY-MM
+    lat_min, lat_max, lon_min, lon_max : float, optional
+        Bounds of the region, lon -180-180
+    members : list of int, optional
+        Member numbers, every member by default
+    **kwargs
+        Ignored, so the result of parse_export_args() can be passed on
+
+    Returns
+    -------
+    xarray.Dataset
+        var_id over the selection, nothing read yet
+
+    Raises
+    ------
+    ValueError
+        If a member is not in dset
+    """
+    subset = dset[[var_id]].sel(time=slice(start, end))
+    lats = subset["lat"].values
+    lat_mask = np.ones(len(lats), dtype=bool)
+    if lat_min is not None:
+        lat_mask &= lats >= lat_min
+    if lat_max is not None:
+        lat_mask &= lats <= lat_max
+    lons = subset["lon"].values
+    lon_mask = np.ones(len(lons), dtype=bool)
+    if lons.max() > 180:
+        lon_min = None if lon_min is None else lon_180_to_360(lon_min)
+        lon_max = None if lon_max is None else lon_180_to_360(lon_max)
+    if lon_min is not None:
+        lon_mask &= lons >= lon_min
+    if lon_max is not None:
+        lon_mask &= lons <= lon_max
+    subset = subset.isel(lat=np.nonzero(lat_mask)[0], lon=np.nonzero(lon_mask)[0])
+    if members is not None and "member_num" in subset.dims:
+        missing = sorted(set(members) - set(subset["member_num"].values.tolist()))
+        if missing:
+            raise ValueError(f"members {missing} are not in the case")
+        subset = subset.sel(member_num=members)
+    return subset
+
+
+def acquire_export_slot(wait=None):
+    """Takes one of the export slots of this process, waiting up to wait seconds
+    (get_export_config() by default) for one to free up
+
+    Returns
+    -------
+    bool
+        False if every slot stayed taken, then the export should be refused
+    """
+    if wait is None:
+        wait = get_export_config()["wait"]
+    if wait > 0:
+        return _export_slots.acquire(timeout=wait)
+    return _export_slots.acquire(blocking=False)
+
+
+def release_export_slot():
+    """Returns a slot taken by acquire_export_slot()"""
+    _export_slots.release()
+
+
+def _stream_file(file_path):
+    # The file in pieces of EXPORT_PIECE_BYTES
+    with open(file_path, "rb") as read_file:
+        while True:
+            piece = read_file.read(EXPORT_PIECE_BYTES)
+            if not piece:
+                return
+            yield piece
+
+
+def _stream_csv(subset, var_id, time_chunk):
+    # A header, then the rows of time_chunk time steps at a time
+    yield (",".join([*subset[var_id].dims, var_id]) + "\n").encode()
+    for start in range(0, subset.sizes["time"], time_chunk):
+        block = subset[var_id].isel(time=slice(start, start + time_chunk))
+        # Only this request's thread computes, leaving dask's pool to the callbacks
+        block = block.reset_coords(drop=True).load(scheduler="synchronous")
+        frame = block.to_dataframe(name=var_id)
+        yield frame.to_csv(header=False).encode()
+
+
+def _stream_netcdf(subset, var_id, time_chunk, tmp_dir):
+    # NetCDF files can not be written front to back, so the file is written a
+    # time_chunk at a time to a temporary file which is then sent
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as stage_dir:
+        file_path = os.path.join(stage_dir, "export.nc")
+        write = subset.chunk({"time": time_chunk}).to_netcdf(file_path, compute=False)
+        write.compute(scheduler="synchronous")
+        yield from _stream_file(file_path)
+
+
+class _ZipStream:
+    """Write only file object buffering what zipfile writes until it is taken, so a
+    zip can be sent while it is being written"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+    def write(self, data):
+        self.buffer.extend(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def _stream_zarr(subset, var_id, time_chunk, tmp_dir):
+    # The store is written a time_chunk at a time to a temporary directory, then
+    # zipped one file at a time as it is sent. Chunks are already compressed, so the
+    # zip only stores them, which is also what zarr's ZipStore expects.
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as stage_dir:
+        store_path = os.path.join(stage_dir, "export.zarr")
+        subset = subset.chunk({"time": time_chunk})
+        for name in subset.variables:
+            # Chunk encodings read from the case file would not match the new chunks
+            subset[name].encoding.pop("chunksizes", None)
+            subset[name].encoding.pop("preferred_chunks", None)
+        write = subset.to_zarr(store_path, mode="w", compute=False)
+        write.compute(scheduler="synchronous")
+        stream = _ZipStream()
+        with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as zip_file:
+            for root, _, file_names in sorted(os.walk(store_path)):
+                for file_name in sorted(file_names):
+                    file_path = os.path.join(root, file_name)
+                    arcname = os.path.relpath(file_path, store_path)
+                    with open(file_path, "rb") as read_file:
+                        with zip_file.open(arcname, "w") as zip_entry:
+                            shutil.copyfileobj(read_file, zip_entry)
+                    yield stream.take()
+        yield stream.take()
+
+
+def stream_export(subset, var_id, export_format, config=None):
+    """Streams a subset of a case in an export format
+
+    The subset is read time_chunk time steps at a time (see get_export_config()), so
+    only that much of it is ever in memory. CSV rows are sent as they are read; NetCDF
+    files and Zarr stores are written to a temporary location first and sent as they
+    are read back. The computation runs on the calling thread only. The time taken
+    and bytes sent are recorded as the export span once the stream ends.
+
+    Parameters
+    ----------
+    subset : xarray.Dataset
+        From select_subset()
+    var_id : str
+        The variable exported
+    export_format : str
+        Must be a key in the dict returned by get_export_format_key()
+    config : dict
+        Configuration from get_export_config(), the current one if None
+
+    Yields
+    ------
+    bytes
+        The next piece of the file
+    """
+    if config is None:
+        config = get_export_config()
+    start = time.perf_counter()
+    sent = 0
+    if export_format == "csv":
+        pieces = _stream_csv(subset, var_id, config["time_chunk"])
+    elif export_format == "netcdf":
+        pieces = _stream_netcdf(subset, var_id, config["time_chunk"], config["tmp_dir"])
+    elif export_format == "zarr":
+        pieces = _stream_zarr(subset, var_id, config["time_chunk"], config["tmp_dir"])
+    else:
+        print(f"export_format should be one of {get_export_format_key().keys()}")
+        raise KeyError
+    try:
+        for piece in pieces:
+            if piece:
+                sent += len(piece)
+                yield piece
+    finally:
+        pieces.close()
+        record_span(
+            "export",
+            time.perf_counter() - start,
+            format=export_format,
+            var_id=var_id,
+            response_bytes=sent,
+        )
+
+
+class ExportStream:
+    """Response body of an export, streaming it with stream_export() and holding an
+    export slot until the response is closed
+
+    The WSGI server closes the body once the download ends or the client goes away,
+    and also when it is never read, as for HEAD requests or clients leaving before
+    the first piece. Closing ends the stream, closes dset and releases the slot,
+    once.
+
+    Parameters
+    ----------
+    subset : xarray.Dataset
+        From select_subset()
+    var_id : str
+        The variable exported
+    export_format : str
+        Must be a key in the dict returned by get_export_format_key()
+    dset : xarray.Dataset, optional
+        The case dataset subset was selected from, closed with the stream
+    config : dict
+        Configuration from get_export_config(), the current one if None
+    """
+
+    def __init__(self, subset, var_id, export_format, dset=None, config=None):
+        self.subset = subset
+        self.var_id = var_id
+        self.export_format = export_format
+        self.dset = dset
+        self.config = config
+        self._pieces = None
+        self._closed = False
+        self._close_lock = threading.Lock()
+
+    def __iter__(self):
+        if self._pieces is None:
+            self._pieces = stream_export(
+                self.subset, self.var_id, self.export_format, self.config
+            )
+        return self._pieces
+
+    def close(self):
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        try:
+            if self._pieces is not None:
+                self._pieces.close()
+            if self.dset is not None:
+                self.dset.close()
+        finally:
+            release_export_slot()
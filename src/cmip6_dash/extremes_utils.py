@@ -0,0 +1,122 @@
+import warnings
+
+import numpy as np
+import xarray as xr
+
+# Quantiles written with cases whose definition does not list its own
+DEFAULT_QUANTILES = [0.05, 0.95]
+
+# Bytes of a case read into memory at once when computing quantiles, one block of
+# latitude rows with every member and time step (per dask thread)
+QUANTILE_BLOCK_BYTES = 64e6
+
+
+def get_quantile_label(quantile):
+    """Names a quantile as a percentile, e.g. "95th Percentile" for 0.95"""
+    percent = f"{round(quantile * 100, 6):g}"
+    suffix = "th"
+    if "." not in percent and percent[-2:] not in ("11", "12", "13"):
+        suffix = {"1": "st", "2": "nd", "3": "rd"}.get(percent[-1], "th")
+    return f"{percent}{suffix} Percentile"
+
+
+def get_heatmap_opts(quantiles=()):
+    """Generates the dash options for the heatmap dropdown
+
+    Parameters
+    ----------
+    quantiles : list of float
+        Quantiles of the case, none in developer mode
+
+    Returns
+    -------
+    list
+        The selected month followed by the quantiles, of the form
+        [{"label": "Selected Month", "value": "month"},
+         {"label": "95th Percentile (All Months and Members)", "value": "0.95"}, ...]
+    """
+    heatmap_opts = [{"label": "Selected Month", "value": "month"}]
+    for quantile in quantiles:
+        label = f"{get_quantile_label(quantile)} (All Months and Members)"
+        heatmap_opts.append({"label": label, "value": str(quantile)})
+    return heatmap_opts
+
+
+def validate_quantiles(quantiles):
+    """Checks a list of quantiles is not empty and between 0 and 1, returning it
+    sorted as floats"""
+    if len(quantiles) == 0:
+        print("At least one quantile is needed")
+        raise AssertionError
+    for quantile in quantiles:
+        if not 0 <= quantile <= 1:
+            print(f"{quantile} is not between 0 and 1!")
+            raise AssertionError
+    return sorted(float(quantile) for quantile in quantiles)
+
+
+def _block_quantiles(values, quantiles, sample_axes):
+    # Exact quantiles of one block over its trailing sample axes, quantile last
+    values = values.reshape(values.shape[: values.ndim - sample_axes] + (-1,))
+    with warnings.catch_warnings():
+        # Cells missing in every member and month, e.g. ocean cells of land variables
+        warnings.simplefilter("ignore", RuntimeWarning)
+        result = np.nanquantile(values, quantiles, axis=-1)
+    return np.moveaxis(result, 0, -1)
+
+
+def compute_quantiles(
+    dset, var_id, quantiles=DEFAULT_QUANTILES, block_bytes=QUANTILE_BLOCK_BYTES
+):
+    """Computes quantiles of every grid cell over all members and time steps
+
+    A quantile needs every sample of a cell at once, so the data is split into
+    blocks of whole latitude rows holding every member and time step instead of
+    along time. Each block is at most block_bytes (or one row) and the exact
+    quantiles of its cells are computed before the next block is read, so memory
+    stays bounded however long the case is, without the error of a streaming
+    quantile sketch.
+
+    Parameters
+    ----------
+    dset : xarray.Dataset
+        Case dataset, e.g. from case_utils.open_case_file()
+    var_id : str
+        The variable to compute the quantiles of
+    quantiles : list of float
+        Between 0 and 1
+    block_bytes : float
+        Upper bound on the bytes of a block
+
+    Returns
+    -------
+    xarray.Dataset
+        Lazy dataset of var_id with a quantile dimension in place of member_num and
+        time. The attributes of var_id record the period and members it covers.
+    """
+    quantiles = validate_quantiles(quantiles)
+    var_data = dset[var_id]
+    sample_dims = [dim for dim in ("member_num", "time") if dim in var_data.dims]
+    other_dims = [dim for dim in var_data.dims if dim not in sample_dims]
+    row_bytes = 8 * var_data.size / var_data.sizes["lat"]
+    lat_chunk = max(1, int(block_bytes // row_bytes))
+    chunks = {dim: -1 for dim in var_data.dims}
+    chunks["lat"] = lat_chunk
+    var_data = var_data.transpose(*other_dims, *sample_dims).chunk(chunks)
+
+    result = xr.apply_ufunc(
+        _block_quantiles,
+        var_data,
+        input_core_dims=[sample_dims],
+        output_core_dims=[["quantile"]],
+        kwargs={"quantiles": quantiles, "sample_axes": len(sample_dims)},
+        dask="parallelized",
+        output_dtypes=["float64"],
+        dask_gufunc_kwargs={"output_sizes": {"quantile": len(quantiles)}},
+    )
+    result = result.assign_coords(quantile=quantiles).transpose("quantile", ...)
+    dates = dset["time"].dt.strftime("%Y-%m").values
+    result.attrs = dict(dset[var_id].attrs)
+    result.attrs["quantile_period"] = f"{dates[0]}/{dates[-1]}"
+    result.attrs["quantile_members"] = dset.sizes.get("member_num", 1)
+    return result.to_dataset(name=var_id)
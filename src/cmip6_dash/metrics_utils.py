@@ -0,0 +1,181 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Set to log every span and cache lookup as a JSON line on the cmip6_dash.metrics_utils
+# logger, on top of the aggregates served on /metrics
+METRICS_LOG_ENV = "CMIP6_METRICS_LOG"
+
+# Upper bounds (s) of the span duration histogram buckets
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Aggregates for this process. Spans are keyed on name, counters on
+# (metric name, sorted label items). Each gunicorn worker keeps its own.
+_metrics_lock = threading.Lock()
+_span_metrics = {}
+_counter_metrics = {}
+
+# functools.lru_cache wrapped functions reporting their own hits and misses
+_lru_caches = {}
+
+
+def _log_event(event, **fields):
+    if os.environ.get(METRICS_LOG_ENV):
+        logger.info(json.dumps(dict(event=event, **fields), default=str))
+
+
+def _increment(metric, value=1, **labels):
+    key = (metric, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counter_metrics[key] = _counter_metrics.get(key, 0) + value
+
+
+def record_span(name, seconds, **fields):
+    """Adds a duration to the histogram of span name
+
+    Parameters
+    ----------
+    name : str
+        The span, e.g. "zarr_open" or "callback.update_map"
+    seconds : float
+        Duration of the span
+    **fields
+        Extra context (model, variable, ...) written to the structured log only, so
+        the Prometheus series stay few
+    """
+    with _metrics_lock:
+        if name not in _span_metrics:
+            _span_metrics[name] = {
+                "buckets": [0] * len(SPAN_BUCKETS),
+                "sum": 0.0,
+                "count": 0,
+            }
+        metrics = _span_metrics[name]
+        for num, bound in enumerate(SPAN_BUCKETS):
+            if seconds <= bound:
+                metrics["buckets"][num] += 1
+        metrics["sum"] += seconds
+        metrics["count"] += 1
+    _log_event("span", span=name, seconds=round(seconds, 6), **fields)
+
+
+@contextmanager
+def span(name, **fields):
+    """Times the body of a with block as span name, see record_span()"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start, **fields)
+
+
+def timed(name):
+    """Decorator timing every call of a function as span name"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_cache(cache, hit):
+    """Counts a lookup in one of the package's caches
+
+    Parameters
+    ----------
+    cache : str
+        Name of the cache, e.g. "climatology"
+    hit : bool
+        True if the lookup was served from the cache
+    """
+    _increment("cache_requests_total", cache=cache, result="hit" if hit else "miss")
+    _log_event("cache", cache=cache, hit=hit)
+
+
+def record_bytes(source, nbytes):
+    """Counts bytes read from source (e.g. "storage" for the zarr stores)"""
+    _increment("bytes_read_total", nbytes, source=source)
+
+
+def register_lru_cache(cache, func):
+    """Reports the hits and misses of a functools.lru_cache wrapped function on
+    /metrics under the name cache"""
+    _lru_caches[cache] = func
+
+
+def reset_metrics():
+    """Clears every recorded metric"""
+    with _metrics_lock:
+        _span_metrics.clear()
+        _counter_metrics.clear()
+
+
+def _format_labels(labels):
+    label_str = ",".join(f'{label}="{value}"' for label, value in labels)
+    return "{" + label_str + "}"
+
+
+def get_metrics_text(prefix="cmip6_dash"):
+    """Renders the metrics of this process in the Prometheus text format
+
+    Parameters
+    ----------
+    prefix : str
+        Prepended to every metric name
+
+    Returns
+    -------
+    str
+        The body of a /metrics response
+    """
+    with _metrics_lock:
+        spans = {
+            name: dict(metrics, buckets=list(metrics["buckets"]))
+            for name, metrics in _span_metrics.items()
+        }
+        counters = dict(_counter_metrics)
+    for cache, func in _lru_caches.items():
+        info = func.cache_info()
+        counters[("cache_requests_total", (("cache", cache), ("result", "hit")))] = (
+            info.hits
+        )
+        counters[("cache_requests_total", (("cache", cache), ("result", "miss")))] = (
+            info.misses
+        )
+
+    lines = [
+        f"# HELP {prefix}_span_seconds Time spent in instrumented code",
+        f"# TYPE {prefix}_span_seconds histogram",
+    ]
+    for name, metrics in sorted(spans.items()):
+        for bound, count in zip(SPAN_BUCKETS, metrics["buckets"]):
+            labels = _format_labels([("span", name), ("le", bound)])
+            lines.append(f"{prefix}_span_seconds_bucket{labels} {count}")
+        labels = _format_labels([("span", name), ("le", "+Inf")])
+        lines.append(f"{prefix}_span_seconds_bucket{labels} {metrics['count']}")
+        labels = _format_labels([("span", name)])
+        lines.append(f"{prefix}_span_seconds_sum{labels} {metrics['sum']}")
+        lines.append(f"{prefix}_span_seconds_count{labels} {metrics['count']}")
+
+    help_text = {
+        "cache_requests_total": "Cache lookups by result",
+        "bytes_read_total": "Bytes read by source",
+    }
+    for metric, text in help_text.items():
+        lines.append(f"# HELP {prefix}_{metric} {text}")
+        lines.append(f"# TYPE {prefix}_{metric} counter")
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f"{prefix}_{metric}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
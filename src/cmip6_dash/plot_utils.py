@@ -1,16 +1,25 @@
-import cartopy.feature as cf
 import numpy as np
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
+import xarray as xr
 
+from .ensemble_utils import select_member
+from .extremes_utils import get_quantile_label
+from .metrics_utils import span
+from .reduction_utils import get_grid_weights
+from .reduction_utils import spatial_mean
 from .wrangling_utils import get_cmpi6_model_run
 from .wrangling_utils import get_month_and_year
 from .wrangling_utils import get_var_key
 
+# cartopy and plotly.express are imported by the functions using them, they take most
+# of the time importing this module and are not needed until a figure is made
+
 
 def get_outline(fig):
     """Takes a figure and adds cartopy's coastline geometries on it"""
+    import cartopy.feature as cf
+
     x_coords = []
     y_coords = []
     for coord_seq in cf.COASTLINE.geometries():
@@ -23,7 +32,7 @@ def get_outline(fig):
     return fig
 
 
-def plot_year_plotly(dset, var_id, mod_id, month, year, exp_id, layer=1):
+def plot_year_plotly(dset, var_id, mod_id, month, year, exp_id, layer=1, member=0):
     """This function plots the var for a given month and year
 
     Wraps plotly plotting code for a one month, year slice of cmpi-6 climate model
@@ -44,26 +53,64 @@ def plot_year_plotly(dset, var_id, mod_id, month, year, exp_id, layer=1):
 
     layer : int
         Must be between 0 and 18- only used for plotting humidity and temp
+    member : int or str
+        Member number or ensemble statistic (see get_ensemble_stat_key()) to plot
+        for multi-member sets
 
     Returns
     -------
     fig : plotly figure object
     """
+    # Resolving the member selection first if this is a multi-member set
+    dset = select_member(dset, var_id, member)
     var_data = get_month_and_year(dset, var_id, month, year, exp_id, layer)
 
     var_key = get_var_key()
+    title = var_key[var_id]["fullname"] + " " + year + "-" + month + " " + mod_id
+    return plot_map_plotly(var_data, var_id, title)
 
-    # Selecting along the first member dimension if this is a multi-member set
-    # Can be tweaked to average etc. in future
-    if "member_num" in var_data.dims:
-        var_data = var_data.sel(member_num=0)
 
-    # Converting to a df so we can use plotly
-    var_df = var_data.to_dataframe().reset_index()
+def plot_map_plotly(var_data, var_id, title, colorscale=None, zmid=None, units=None):
+    """Plots a lat/lon slice as a contour heatmap with coastlines
+
+    Parameters
+    ----------
+    var_data : xarray.DataArray
+        Two dimensional (lat, lon) slice, e.g. from get_month_and_year()
+    var_id : 'str'
+        The variable plotted, used for the units on the colorbar
+    title : 'str'
+        Title of the figure
+    colorscale : str, optional
+        Plotly colorscale name, by default plotly's own
+    zmid : float, optional
+        Value to centre the colorscale on, useful for diverging colorscales
+    units : str, optional
+        Units on the colorbar, by default those of var_id
+
+    Returns
+    -------
+    fig : plotly figure object
+    """
+    # Converting to a df so we can use plotly. Dask backed slices are computed here.
+    with span("to_dataframe", var_id=var_id):
+        var_df = var_data.to_dataframe(name=var_id).reset_index()
 
     # Converting from a 0-360 longitudinal system to a -180-180 longitudinal system
     var_df["lon_adj"] = var_df["lon"].apply(lambda x: x - 360 if x > 180 else x)
 
+    with span("figure", var_id=var_id):
+        fig = _map_figure(var_df, var_id, title, colorscale, zmid, units)
+    return fig
+
+
+def _map_figure(var_df, var_id, title, colorscale=None, zmid=None, units=None):
+    """Builds the heatmap of plot_map_plotly() from its dataframe"""
+    import plotly.express as px
+
+    if units is None:
+        units = get_var_key()[var_id]["units"]
+
     # Invisible plotly express scatter of var values at lons and lats. Added
     # this here to get the box and lasso select to do the mean/ variance.
     # A bit of a hack but seems to be the best option currently.
@@ -80,12 +127,14 @@ def plot_year_plotly(dset, var_id, mod_id, month, year, exp_id, layer=1):
             y=var_df["lat"],
             z=var_df[var_id],
             contours_coloring="heatmap",
+            colorscale=colorscale,
+            zmid=zmid,
             colorbar={
                 "borderwidth": 0,
                 "outlinewidth": 0,
                 "thickness": 15,
                 "tickfont": {"size": 14},
-                "title": var_key[var_id]["units"],
+                "title": units,
             },  # specifies units here
             # Sizing and spacing of contours can be changed by editing these
             # commented out options
@@ -115,21 +164,117 @@ def plot_year_plotly(dset, var_id, mod_id, month, year, exp_id, layer=1):
     # lives in on the dashboard
     fig.update_layout(
         margin={"r": 0, "t": 0, "l": 0, "b": 0},
-        title=var_key[var_id]["fullname"] + " " + year + "-" + month + " " + mod_id,
+        title=title,
     )
 
     return fig
 
 
+def plot_difference_map(
+    dsets, var_id, mod_id, mod_comp_id, month, year, exp_id, layer=1
+):
+    """Plots the difference between two models for a given month and year
+
+    Parameters
+    ----------
+    dsets : tuple
+        The two xarray.Dataset to difference, already on the same grid (see
+        regrid_utils.regrid_to_common_grid()) and without a member_num dimension
+    var_id : 'str'
+        The variable to be plotted.
+    mod_id : 'str'
+        The model the comparison model is subtracted from
+    mod_comp_id : 'str'
+        The model subtracted
+    month : 'str'
+        String specifying which month to plot.
+        Must be between '01'-'12'. 0 required for single digit months.
+    year : 'str'
+        Year to plot.
+    exp_id : 'str'
+        The experiment id, year is ignored for piControl
+    layer : int
+        Must be between 0 and 18- only used for plotting humidity and temp
+
+    Returns
+    -------
+    fig : plotly figure object
+    """
+    var_data = get_month_and_year(dsets[0], var_id, month, year, exp_id, layer)
+    comp_data = get_month_and_year(dsets[1], var_id, month, year, exp_id, layer)
+    # Dropping the time label since piControl years need not match between models
+    diff = var_data.drop_vars("time", errors="ignore") - comp_data.drop_vars(
+        "time", errors="ignore"
+    )
+
+    title = (
+        f"{get_var_key()[var_id]['fullname']} {year}-{month} {mod_id} - {mod_comp_id}"
+    )
+    return plot_map_plotly(diff, var_id, title, colorscale="RdBu_r", zmid=0)
+
+
+def plot_quantile_map(dset, var_id, mod_id, quantile, layer=1):
+    """Plots a quantile of every grid cell over all members and months
+
+    Parameters
+    ----------
+    dset : xarray.Dataset
+        Quantiles from case_utils.load_case_quantiles()
+    var_id : str
+        The variable plotted
+    mod_id : str
+        The model, used in the title
+    quantile : float
+        The quantile plotted, one of those in dset
+    layer : int
+        Level plotted of layered variables, as in get_month_and_year()
+
+    Returns
+    -------
+    fig : plotly figure object
+    """
+    var_data = dset[var_id].sel(quantile=quantile)
+    if var_data.ndim == 3:
+        var_data = var_data[layer]
+    title = f"{get_var_key()[var_id]['fullname']} {get_quantile_label(quantile)}"
+    return plot_map_plotly(var_data, var_id, f"{title} {mod_id}")
+
+
+def plot_trend_map(dset, var_id, mod_id, layer=1):
+    """Plots the linear trend per decade of every grid cell
+
+    Parameters
+    ----------
+    dset : xarray.Dataset
+        Trends from case_utils.load_case_trend() with the member selection resolved
+    var_id : str
+        The variable plotted
+    mod_id : str
+        The model, used in the title
+    layer : int
+        Level plotted of layered variables, as in get_month_and_year()
+
+    Returns
+    -------
+    fig : plotly figure object
+    """
+    var_data = dset[var_id]
+    if var_data.ndim == 3:
+        var_data = var_data[layer]
+    title = f"{get_var_key()[var_id]['fullname']} trend {mod_id}"
+    units = get_var_key()[var_id]["units"] + " per decade"
+    return plot_map_plotly(var_data, var_id, title, "RdBu_r", 0, units)
+
+
 def plot_model_comparisons(dsets, var_id, mod_id, mod_comp_id="CanESM5"):
-    """Plots a histogram comparing counts of different var_id values between two models
+    """Plots a histogram comparing counts of different var_id values between models
         for a given year
 
     Parameters
     ----------
     dsets : tuple
-        The two xarray.Dataset to plot. Should be the same set of vars except for the
-        different models.
+        The xarray.Dataset to plot, the main model's first. Should be the same set of
+        vars except for the different models.
     var_id : 'str'
         The variable to be plotted.
     mod_id : 'str
@@ -139,8 +284,8 @@ def plot_model_comparisons(dsets, var_id, mod_id, mod_comp_id="CanESM5"):
         Must be between '01'-'12'. 0 required for single digit months.
     year : 'str'
         Year to plot. Must be between '1850' and '2014'
-    mod_comp_id : str, optional
-        model to compare model specified by mod_id to, by default "CanESM5"
+    mod_comp_id : str or list of str, optional
+        model(s) to compare model specified by mod_id to, by default "CanESM5"
 
     Returns
     -------
@@ -148,25 +293,53 @@ def plot_model_comparisons(dsets, var_id, mod_id, mod_comp_id="CanESM5"):
         Plotly figure plot
 
     """
-    # Translating both xarray inputs to pandas dfs
-    df = dsets[0].to_dataframe().reset_index()
-    df_comp = dsets[1].to_dataframe().reset_index()
-
-    # Changing the column labels on the var_ids to be the model ids so we can melt
-    # i.e get everything into one pandas dataframe for plotting
-    df_comp = df_comp.rename({var_id: mod_comp_id}, axis=1)[[mod_comp_id]]
-    df = df.rename({var_id: mod_id}, axis=1)[[mod_id]]
-    uni_df = pd.concat([df, df_comp], axis=1)
-    uni_df = uni_df.melt(var_name="model")
-
-    # Plotting counts of different values against each ohter
+    if isinstance(mod_comp_id, str):
+        mod_comp_id = [mod_comp_id]
+    # Flattening the xarray inputs into one long pandas df along with the area
+    # weight of each cell so high latitude cells don't dominate the distribution
+    df_list = []
+    for data, model in zip(dsets, [mod_id] + list(mod_comp_id)):
+        if isinstance(data, xr.Dataset):
+            data = data[var_id]
+        data = data.transpose(..., "lat", "lon")
+        areacella = None
+        if "areacella" in data.coords:
+            areacella = data["areacella"].transpose("lat", "lon").values
+        weights = get_grid_weights(data["lat"].values, data["lon"].values, areacella)
+        with span("load", var_id=var_id, mod_id=model):
+            values = data.values.ravel()
+        valid = ~np.isnan(values)
+        df_list.append(
+            pd.DataFrame(
+                {
+                    "value": values[valid],
+                    "weight": np.broadcast_to(weights, data.shape).ravel()[valid],
+                    "model": model,
+                }
+            )
+        )
+    uni_df = pd.concat(df_list, ignore_index=True)
+
+    # Plotting the area weighted distributions of values against each other
+    with span("figure", var_id=var_id):
+        fig = _histogram_figure(uni_df)
+    return fig
+
+
+def _histogram_figure(uni_df):
+    """Builds the histogram of plot_model_comparisons() from its dataframe"""
+    import plotly.express as px
+
     fig = px.histogram(
         uni_df,
         x="value",
+        y="weight",
+        histfunc="sum",
         color="model",
         histnorm="probability density",
         facet_row="model",
     )
+    fig.update_yaxes(title_text="probability density")
 
     fig.update_layout(
         margin={"r": 0, "t": 0, "l": 0, "b": 0},
@@ -177,7 +350,8 @@ def plot_model_comparisons(dsets, var_id, mod_id, mod_comp_id="CanESM5"):
 def plot_member_line_comp(dset, var_id):
     """Plots mean global climatology for the given multi-member dset
 
-    Dset should be in the case format.
+    Dset should be in the case format. The mean over the area is weighted by cell
+    area.
 
     Parameters
     ----------
@@ -191,14 +365,19 @@ def plot_member_line_comp(dset, var_id):
     fig : plotly figure object
 
     """
-    # convert to a pandas dataframe calculate averages by run and time
-    df_pd = dset.to_dataframe().reset_index()
+    import plotly.express as px
+
+    # Area weighted averages by run and time before converting to pandas
+    var_data = spatial_mean(dset[var_id])
+    # Layered variables are also averaged over their levels
+    level_dims = [dim for dim in var_data.dims if dim not in ("member_num", "time")]
+    if level_dims:
+        var_data = var_data.mean(level_dims)
     # Assumes the model run dimension is called "member_num"
-    df_pd = (
-        df_pd.groupby(by=["member_num", "time"])
-        .mean()
-        .reset_index()[["member_num", "time", var_id]]
-    )
+    with span("to_dataframe", var_id=var_id):
+        df_pd = var_data.to_dataframe(name=var_id).reset_index()[
+            ["member_num", "time", var_id]
+        ]
     fig = px.line(
         df_pd,
         x="time",
@@ -212,6 +391,101 @@ def plot_member_line_comp(dset, var_id):
     return fig
 
 
+def plot_point_series(dset, var_id):
+    """Plots the time series of every member at one grid cell
+
+    Parameters
+    ----------
+    dset : xarray.Dataset
+        From case_utils.get_point_series(), var_id with member_num and time
+        dimensions
+    var_id : str
+        The var id to use
+
+    Returns
+    -------
+    fig : plotly figure object
+    """
+    import plotly.express as px
+
+    var_data = dset[var_id]
+    # Layered variables are averaged over their levels
+    level_dims = [dim for dim in var_data.dims if dim not in ("member_num", "time")]
+    if level_dims:
+        var_data = var_data.mean(level_dims)
+    df_pd = var_data.to_dataframe(name=var_id).reset_index()[
+        ["member_num", "time", var_id]
+    ]
+    fig = px.line(
+        df_pd,
+        x="time",
+        y=var_id,
+        color="member_num",
+        labels={var_id: get_var_key()[var_id]["units"]},
+    )
+    fig.update_layout(
+        margin={"r": 0, "t": 0, "l": 0, "b": 0},
+    )
+    return fig
+
+
+def plot_hovmoller(dset, var_id, dim, colorscale=None, zmid=None):
+    """Plots a Hovmöller diagram, a heatmap of time against latitude or longitude
+
+    Parameters
+    ----------
+    dset : xarray.Dataset
+        var_id with time and dim dimensions, e.g. a zonal mean (dim="lat") or
+        meridional mean (dim="lon") from case_utils.load_case_hovmoller() with the
+        member selection resolved
+    var_id : str
+        The variable plotted, used for the units on the colorbar
+    dim : str
+        "lat" or "lon"
+    colorscale : str, optional
+        Plotly colorscale name, by default plotly's own
+    zmid : float, optional
+        Value to centre the colorscale on, useful for diverging colorscales
+
+    Returns
+    -------
+    fig : plotly figure object
+    """
+    var_data = dset[var_id]
+    # Layered variables are averaged over their levels
+    level_dims = [d for d in var_data.dims if d not in ("time", dim)]
+    if level_dims:
+        var_data = var_data.mean(level_dims)
+    if dim == "lon":
+        # Converting from a 0-360 longitudinal system to a -180-180 one as the map
+        lons = var_data["lon"].values
+        var_data = var_data.assign_coords(lon=np.where(lons > 180, lons - 360, lons))
+        var_data = var_data.sortby("lon")
+    var_data = var_data.transpose(dim, "time")
+
+    fig = go.Figure(
+        go.Heatmap(
+            x=var_data["time"].dt.strftime("%Y-%m").values,
+            y=var_data[dim].values,
+            z=var_data.values,
+            colorscale=colorscale,
+            zmid=zmid,
+            colorbar={
+                "borderwidth": 0,
+                "outlinewidth": 0,
+                "thickness": 15,
+                "tickfont": {"size": 14},
+                "title": get_var_key()[var_id]["units"],
+            },
+        )
+    )
+    fig.update_yaxes(title="Latitude" if dim == "lat" else "Longitude")
+    fig.update_layout(
+        margin={"r": 0, "t": 0, "l": 0, "b": 0},
+    )
+    return fig
+
+
 def plotly_wrapper(
     data_store,
     var_id="tas",
@@ -0,0 +1,223 @@
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+
+import dask
+
+# Environment variables read by get_profile_config()
+PROFILE_ENV = {
+    "enabled": "CMIP6_PROFILE",
+    "sample_rate": "CMIP6_PROFILE_SAMPLE",
+    "profile_dir": "CMIP6_PROFILE_DIR",
+    "keep": "CMIP6_PROFILE_KEEP",
+}
+
+# Requests carrying this header (any value) are profiled whenever profiling is enabled
+PROFILE_HEADER = "X-CMIP6-Profile"
+
+# cProfile only sees the thread it runs in but tracemalloc traces the whole process,
+# so only one request per process is profiled at a time. Requests arriving while
+# another one is profiled are served unprofiled.
+_profile_lock = threading.Lock()
+
+
+def get_profile_config():
+    """Returns the profiling configuration from the environment
+
+    Returns
+    -------
+    dict
+        enabled (CMIP6_PROFILE set to anything but "0", default False), sample_rate
+        (fraction of requests profiled without being flagged, default 0),
+        profile_dir (where profiles are written, default "./.cache/profiles") and
+        keep (number of profiles kept, default 50)
+    """
+    return {
+        "enabled": os.environ.get(PROFILE_ENV["enabled"], "0") not in ("", "0"),
+        "sample_rate": float(os.environ.get(PROFILE_ENV["sample_rate"], 0)),
+        "profile_dir": os.environ.get(PROFILE_ENV["profile_dir"], "./.cache/profiles"),
+        "keep": int(os.environ.get(PROFILE_ENV["keep"], 50)),
+    }
+
+
+def should_profile(flagged=False, config=None):
+    """Decides whether to profile a request
+
+    Parameters
+    ----------
+    flagged : bool
+        True if the request asked to be profiled (see PROFILE_HEADER)
+    config : dict
+        Configuration from get_profile_config(), the current one if None
+
+    Returns
+    -------
+    bool
+    """
+    config = get_profile_config() if config is None else config
+    if not config["enabled"]:
+        return False
+    return flagged or random.random() < config["sample_rate"]
+
+
+def start_profile():
+    """Starts cProfile and tracemalloc for the current request
+
+    Dask is switched to its synchronous scheduler until finish_profile() so the
+    chunk computations run in (and are profiled with) the request's thread. Other
+    requests served by the process meanwhile also compute synchronously.
+
+    Returns
+    -------
+    dict or None
+        Handle to pass to finish_profile(), None if another request is already being
+        profiled by this process
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    handle = {
+        "profiler": profiler,
+        "snapshot": tracemalloc.take_snapshot(),
+        "started_tracing": started_tracing,
+        "dask_config": dask.config.set(scheduler="synchronous"),
+        "start": time.perf_counter(),
+    }
+    profiler.enable()
+    return handle
+
+
+def finish_profile(handle, name, inputs=None, profile_dir=None, keep=None):
+    """Stops a profile started with start_profile() and writes it to profile_dir
+
+    Each profile is written as <id>.json, holding the callback inputs, the duration,
+    the top functions by cumulative time and the top allocation sites, next to
+    <id>.prof, the raw cProfile stats for snakeviz or pstats.
+
+    Parameters
+    ----------
+    handle : dict
+        From start_profile()
+    name : str
+        What was profiled, e.g. the callback outputs
+    inputs : list, optional
+        The callback inputs, stored with the profile so the selection can be
+        reproduced
+    profile_dir : str
+        Defaults to the profile_dir of get_profile_config()
+    keep : int
+        Oldest profiles beyond this many are deleted, defaults to the keep of
+        get_profile_config()
+
+    Returns
+    -------
+    str
+        The id of the profile
+    """
+    try:
+        handle["profiler"].disable()
+        duration = time.perf_counter() - handle["start"]
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if handle["started_tracing"]:
+            tracemalloc.stop()
+        handle["dask_config"].__exit__(None, None, None)
+    finally:
+        _profile_lock.release()
+
+    config = get_profile_config()
+    profile_dir = config["profile_dir"] if profile_dir is None else profile_dir
+    keep = config["keep"] if keep is None else keep
+
+    stats_stream = io.StringIO()
+    stats = pstats.Stats(handle["profiler"], stream=stats_stream)
+    stats.sort_stats("cumulative").print_stats(40)
+    memory_diff = snapshot.compare_to(handle["snapshot"], "lineno")[:20]
+
+    # Nanosecond timestamps first so ids sort by age
+    profile_id = f"{time.time_ns()}-{uuid.uuid4().hex[:8]}"
+    record = {
+        "id": profile_id,
+        "name": name,
+        "inputs": inputs,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "pid": os.getpid(),
+        "duration": duration,
+        "peak_traced_bytes": peak,
+        "cumulative_stats": stats_stream.getvalue(),
+        "memory_diff": [str(stat) for stat in memory_diff],
+    }
+
+    os.makedirs(profile_dir, exist_ok=True)
+    _write_atomic(f"{profile_dir}/{profile_id}.prof", marshal.dumps(stats.stats))
+    _write_atomic(
+        f"{profile_dir}/{profile_id}.json", json.dumps(record, default=str).encode()
+    )
+    _prune_profiles(profile_dir, keep)
+    return profile_id
+
+
+def _write_atomic(file_path, data):
+    """Writes through a temporary file so other workers never read half a profile"""
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as write_file:
+        write_file.write(data)
+    os.replace(tmp_path, file_path)
+
+
+def _prune_profiles(profile_dir, keep):
+    profile_ids = [profile["id"] for profile in list_profiles(profile_dir)]
+    for profile_id in profile_ids[keep:]:
+        for ext in (".json", ".prof"):
+            try:
+                os.remove(f"{profile_dir}/{profile_id}{ext}")
+            except FileNotFoundError:
+                # Already pruned by another worker
+                pass
+
+
+def list_profiles(profile_dir=None):
+    """Summaries of the profiles in profile_dir, newest first
+
+    Returns
+    -------
+    list of dict
+        id, name, time, pid and duration of each profile
+    """
+    if profile_dir is None:
+        profile_dir = get_profile_config()["profile_dir"]
+    if not os.path.isdir(profile_dir):
+        return []
+    summaries = []
+    for file_name in sorted(os.listdir(profile_dir), reverse=True):
+        if not file_name.endswith(".json"):
+            continue
+        record = load_profile(os.path.splitext(file_name)[0], profile_dir)
+        if record is not None:
+            summaries.append(
+                {key: record[key] for key in ("id", "name", "time", "pid", "duration")}
+            )
+    return summaries
+
+
+def load_profile(profile_id, profile_dir=None):
+    """Loads a profile written by finish_profile(), None if there is no such profile"""
+    if profile_dir is None:
+        profile_dir = get_profile_config()["profile_dir"]
+    file_path = os.path.join(profile_dir, os.path.basename(profile_id) + ".json")
+    try:
+        with open(file_path) as read_file:
+            return json.load(read_file)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,245 @@
+import hashlib
+
+import numpy as np
+import xarray as xr
+
+from .metrics_utils import record_cache
+
+# Area weights for grids already seen by this process keyed on a hash of their
+# coordinates, so each grid's weights are only built once
+_grid_weights_cache = {}
+
+
+def lat_weights(lat):
+    """Cos(lat) weights proportional to the area of cells on a regular lat/lon grid
+
+    Parameters
+    ----------
+    lat : array like
+        Latitudes in degrees, of any shape
+
+    Returns
+    -------
+    numpy.ndarray
+        Weights with the same shape as lat
+    """
+    return np.clip(np.cos(np.deg2rad(np.asarray(lat, dtype="float64"))), 0, None)
+
+
+def get_grid_weights(lat, lon, areacella=None, mask=None):
+    """Returns the (lat, lon) area weights of a grid, building them once per grid
+
+    Parameters
+    ----------
+    lat : numpy.ndarray
+        1D latitude coordinate of the grid
+    lon : numpy.ndarray
+        1D longitude coordinate of the grid
+    areacella : array like, optional
+        Cell areas of shape (lat, lon), e.g. the CMIP6 fx variable areacella. Used in
+        place of cos(lat) weights when supplied.
+    mask : array like, optional
+        Boolean (lat, lon) array, False where cells should be left out (e.g. a land
+        or region mask)
+
+    Returns
+    -------
+    numpy.ndarray
+        Read only weights of shape (len(lat), len(lon))
+    """
+    sha = hashlib.sha1()
+    for item in (lat, lon, areacella, mask):
+        if item is not None:
+            item = np.ascontiguousarray(item, dtype="float64")
+            sha.update(str(item.shape).encode())
+            sha.update(item.tobytes())
+        else:
+            sha.update(b"None")
+    key = sha.hexdigest()
+
+    record_cache("grid_weights", key in _grid_weights_cache)
+    if key not in _grid_weights_cache:
+        if areacella is not None:
+            weights = np.array(areacella, dtype="float64")
+        else:
+            weights = np.repeat(lat_weights(lat)[:, None], len(lon), axis=1)
+        if mask is not None:
+            weights = np.where(np.asarray(mask, dtype=bool), weights, 0)
+        weights.setflags(write=False)
+        _grid_weights_cache[key] = weights
+    return _grid_weights_cache[key]
+
+
+def weighted_mean(values, weights, axis=None):
+    """NaN aware weighted mean of a NumPy or dask array
+
+    Parameters
+    ----------
+    values : numpy.ndarray or dask.array.Array
+        The values to reduce. NaNs are left out of both the sum and the weights.
+    weights : numpy.ndarray
+        Weights broadcastable to values
+    axis : int or tuple of int, optional
+        Axes to reduce over, all of them by default
+
+    Returns
+    -------
+    numpy.ndarray or dask.array.Array
+        The weighted mean, NaN where every value reduced over is NaN
+    """
+    valid = ~np.isnan(values)
+    total = np.sum(np.where(valid, values * weights, 0), axis=axis)
+    weight_sum = np.sum(np.where(valid, weights, 0), axis=axis)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return total / weight_sum
+
+
+def weighted_std(values, weights, axis=None):
+    """NaN aware weighted (population) standard deviation of a NumPy or dask array,
+    see weighted_mean() for the parameters"""
+    if axis is None:
+        axis = tuple(range(np.ndim(values)))
+    mean = np.expand_dims(weighted_mean(values, weights, axis), axis)
+    return np.sqrt(weighted_mean((values - mean) ** 2, weights, axis))
+
+
+def _spatial_reduction(func, data, areacella=None, mask=None):
+    """Applies a weighted reduction over the lat and lon dims of a DataArray"""
+    if areacella is None and "areacella" in data.coords:
+        areacella = data["areacella"].transpose("lat", "lon").values
+    weights = xr.DataArray(
+        get_grid_weights(data["lat"].values, data["lon"].values, areacella, mask),
+        dims=("lat", "lon"),
+    )
+    return xr.apply_ufunc(
+        func,
+        data,
+        weights,
+        input_core_dims=[["lat", "lon"], ["lat", "lon"]],
+        kwargs={"axis": (-2, -1)},
+        dask="allowed",
+        keep_attrs=True,
+    )
+
+
+def spatial_mean(data, areacella=None, mask=None):
+    """Area weighted mean over the lat and lon dimensions
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        Data with lat and lon dimensions, NumPy or dask backed. NaNs (e.g. ocean
+        cells of land variables) are left out.
+    areacella : array like, optional
+        Cell areas to weight by. Defaults to an areacella coordinate of data if there
+        is one (see wrangling_utils.get_cmip6_areacella()), cos(lat) otherwise.
+    mask : array like, optional
+        Boolean (lat, lon) array, False where cells should be left out
+
+    Returns
+    -------
+    xarray.DataArray
+        data with the lat and lon dimensions reduced
+    """
+    return _spatial_reduction(weighted_mean, data, areacella, mask)
+
+
+def spatial_std(data, areacella=None, mask=None):
+    """Area weighted standard deviation over the lat and lon dimensions, see
+    spatial_mean() for the parameters"""
+    return _spatial_reduction(weighted_std, data, areacella, mask)
+
+
+def zonal_mean(data):
+    """Mean over the lon dimension, NaNs left out. The cells along a latitude have
+    equal areas so no weights are needed."""
+    return data.mean("lon", keep_attrs=True)
+
+
+def meridional_mean(data):
+    """Cos(lat) weighted mean over the lat dimension of a NumPy or dask backed
+    DataArray, NaNs left out"""
+    weights = xr.DataArray(lat_weights(data["lat"].values), dims=("lat",))
+    return xr.apply_ufunc(
+        weighted_mean,
+        data,
+        weights,
+        input_core_dims=[["lat"], ["lat"]],
+        kwargs={"axis": -1},
+        dask="allowed",
+        keep_attrs=True,
+    )
+
+
+def least_squares_slope(values, x, groups, axis=-1):
+    """NaN aware least squares slope of a NumPy or dask array against x, fitting a
+    separate intercept for each group
+
+    Parameters
+    ----------
+    values : numpy.ndarray or dask.array.Array
+        The values to fit. NaNs are left out.
+    x : numpy.ndarray
+        1D coordinate along axis, e.g. time in years
+    groups : numpy.ndarray
+        1D labels along axis of the groups with their own intercept, e.g. months
+    axis : int
+        The axis fitted along, reduced in the result
+
+    Returns
+    -------
+    numpy.ndarray or dask.array.Array
+        The slope, NaN where no group has two valid values with different x
+    """
+    values = np.moveaxis(values, axis, -1)
+    # Sums over each group are products with its one hot indicator along the axis
+    one_hot = (groups[:, None] == np.unique(groups)[None, :]).astype("float64")
+    x_hot = x[:, None] * one_hot
+    valid = (~np.isnan(values)).astype("float64")
+    y = np.where(np.isnan(values), 0, values)
+    count = np.tensordot(valid, one_hot, axes=1)
+    sum_x = np.tensordot(valid, x_hot, axes=1)
+    sum_xx = np.tensordot(valid, x[:, None] * x_hot, axes=1)
+    sum_y = np.tensordot(y, one_hot, axes=1)
+    sum_xy = np.tensordot(y, x_hot, axes=1)
+    # Sums of the products of deviations from each group's means
+    with np.errstate(invalid="ignore", divide="ignore"):
+        has_values = count > 0
+        cov = np.where(has_values, sum_xy - sum_x * sum_y / count, 0).sum(axis=-1)
+        var = np.where(has_values, sum_xx - sum_x**2 / count, 0).sum(axis=-1)
+        return np.where(var > 1e-12, cov / var, np.nan)
+
+
+def linear_trend(data):
+    """Least squares slope per year along the time dimension of a NumPy or dask
+    backed DataArray, NaNs left out
+
+    Each calendar month is fitted its own mean, so the seasonal cycle does not bias
+    the slope of periods that are not whole years (and the slope of anomalies from
+    a monthly climatology is the same). The slope is found in closed form from sums
+    over time (see least_squares_slope()), so dask reads every chunk once and no
+    cell is fitted on its own.
+
+    Parameters
+    ----------
+    data : xarray.DataArray
+        Data with a time dimension of cftime or datetime64 dates
+
+    Returns
+    -------
+    xarray.DataArray
+        data with the time dimension reduced, NaN where no calendar month is valid
+        in two different years
+    """
+    times = data["time"]
+    years = (times.dt.year + (times.dt.month - 1) / 12).values.astype("float64")
+    # Years from the middle of the period, so the sums do not lose precision
+    years = years - years.mean()
+    return xr.apply_ufunc(
+        least_squares_slope,
+        data,
+        kwargs={"x": years, "groups": times.dt.month.values},
+        input_core_dims=[["time"]],
+        dask="allowed",
+        keep_attrs=True,
+    )
@@ -0,0 +1,374 @@
+import hashlib
+import os
+
+import numpy as np
+import scipy.sparse as sparse
+import xarray as xr
+
+from .metrics_utils import record_cache
+
+# Weight matrices already loaded or computed by this process keyed on the same hash
+# used for their file names on disk
+_weights_cache = {}
+
+REGRID_CACHE_DIR = "./.cache/regrid_weights"
+
+
+# This function returns a dictionary used to validate the method passed to the
+# regridding functions and to generate dropdown options for it
+def get_regrid_method_key():
+    method_key = {
+        "bilinear": {"fullname": "Bilinear"},
+        "conservative": {"fullname": "Conservative (Area Weighted)"},
+    }
+    return method_key
+
+
+def make_target_grid(lat_res, lon_res, lat_range=(-90, 90), lon_range=(0, 360)):
+    """Creates a regular lat/lon target grid with cell centres inside the ranges
+
+    Parameters
+    ----------
+    lat_res : float
+        Latitude spacing in degrees
+    lon_res : float
+        Longitude spacing in degrees
+    lat_range : tuple (float, float)
+        Southern and northern edges of the grid
+    lon_range : tuple (float, float)
+        Western and eastern edges of the grid on the 0-360 scale
+
+    Returns
+    -------
+    xarray.Dataset
+        Dataset with only lat and lon coordinates
+    """
+    lats = np.arange(lat_range[0] + lat_res / 2, lat_range[1], lat_res)
+    lons = np.arange(lon_range[0] + lon_res / 2, lon_range[1], lon_res)
+    return xr.Dataset(coords={"lat": lats, "lon": lons})
+
+
+def get_common_grid(data_list):
+    """Finds a regular grid all of the datasets or data arrays can be mapped onto
+
+    The grid uses the coarsest spacing of the inputs so no model is interpolated to
+    a finer resolution than it was run at, and covers the area where all inputs
+    overlap.
+
+    Parameters
+    ----------
+    data_list : list
+        xarray Datasets or DataArrays with lat and lon coordinates
+
+    Returns
+    -------
+    xarray.Dataset
+        Dataset with only lat and lon coordinates
+    """
+    lat_res = max(_grid_spacing(data["lat"].values) for data in data_list)
+    lon_res = max(_grid_spacing(data["lon"].values) for data in data_list)
+    lat_min = max(data["lat"].values.min() for data in data_list)
+    lat_max = min(data["lat"].values.max() for data in data_list)
+    lon_min = max(data["lon"].values.min() for data in data_list)
+    lon_max = min(data["lon"].values.max() for data in data_list)
+    lats = np.arange(lat_min, lat_max + lat_res / 2, lat_res)
+    lons = np.arange(lon_min, lon_max + lon_res / 2, lon_res)
+    return xr.Dataset(
+        coords={"lat": lats[lats <= lat_max], "lon": lons[lons <= lon_max]}
+    )
+
+
+def _grid_spacing(coord):
+    """Median spacing of a 1D coordinate"""
+    return float(np.median(np.abs(np.diff(np.sort(coord)))))
+
+
+def _is_periodic(lon):
+    """True if a longitude coordinate wraps all the way around the globe"""
+    if len(lon) < 2:
+        return False
+    return abs(_grid_spacing(lon) * len(lon) - 360) < _grid_spacing(lon) / 2
+
+
+def _cell_bounds(coord, clip=None):
+    """Cell edges halfway between the centres, extended by half a cell at either
+    end. Returns an array of shape (len(coord), 2) in the order of coord"""
+    order = np.argsort(coord)
+    centres = np.asarray(coord, dtype=float)[order]
+    mids = (centres[1:] + centres[:-1]) / 2
+    lower = np.concatenate([[centres[0] - (mids[0] - centres[0])], mids])
+    upper = np.concatenate([mids, [centres[-1] + (centres[-1] - mids[-1])]])
+    bounds = np.empty((len(centres), 2))
+    bounds[order] = np.stack([lower, upper], axis=1)
+    if clip is not None:
+        bounds = np.clip(bounds, clip[0], clip[1])
+    return bounds
+
+
+def _linear_weights_1d(src, tgt, periodic=False):
+    """Sparse matrix (len(tgt), len(src)) linearly interpolating src points to tgt
+    points. Targets outside the source range get an empty row."""
+    src = np.asarray(src, dtype=float)
+    tgt = np.asarray(tgt, dtype=float)
+    order = np.argsort(src)
+    src_sorted = src[order]
+    if periodic:
+        src_sorted = np.concatenate(
+            [src_sorted[-1:] - 360, src_sorted, src_sorted[:1] + 360]
+        )
+        order = np.concatenate([order[-1:], order, order[:1]])
+        tgt = src_sorted[1] + np.mod(tgt - src_sorted[1], 360)
+
+    pos = np.clip(np.searchsorted(src_sorted, tgt, side="right") - 1, 0, None)
+    pos = np.minimum(pos, len(src_sorted) - 2)
+    valid = (tgt >= src_sorted[0]) & (tgt <= src_sorted[-1])
+    frac = (tgt - src_sorted[pos]) / (src_sorted[pos + 1] - src_sorted[pos])
+
+    rows = np.arange(len(tgt))[valid]
+    return sparse.coo_matrix(
+        (
+            np.concatenate([1 - frac[valid], frac[valid]]),
+            (
+                np.concatenate([rows, rows]),
+                np.concatenate([order[pos][valid], order[pos + 1][valid]]),
+            ),
+        ),
+        shape=(len(tgt), len(src)),
+    ).tocsr()
+
+
+def _overlap_weights_1d(src_bnds, tgt_bnds, periodic=False):
+    """Sparse matrix (len(tgt), len(src)) of the fraction of each target cell
+    covered by each source cell"""
+    shifts = (-360, 0, 360) if periodic else (0,)
+    overlap = np.zeros((len(tgt_bnds), len(src_bnds)))
+    for shift in shifts:
+        upper = np.minimum(tgt_bnds[:, None, 1], src_bnds[None, :, 1] + shift)
+        lower = np.maximum(tgt_bnds[:, None, 0], src_bnds[None, :, 0] + shift)
+        overlap += np.clip(upper - lower, 0, None)
+    coverage = overlap.sum(axis=1, keepdims=True)
+    # Target cells only partly covered by the source keep weights summing to one
+    # so the value is the mean of the overlapping source cells
+    weights = np.divide(
+        overlap, coverage, out=np.zeros_like(overlap), where=coverage > 0
+    )
+    return sparse.csr_matrix(weights)
+
+
+def compute_regrid_weights(src_lat, src_lon, tgt_lat, tgt_lon, method="bilinear"):
+    """Computes the sparse weight matrix mapping a source grid onto a target grid
+
+    Both grids must be rectilinear, so the weights are the Kronecker product of a
+    latitude and a longitude weight matrix. Conservative weights use the area of
+    the overlap between cells (sin(lat) spacing along latitude).
+
+    Parameters
+    ----------
+    src_lat, src_lon : numpy.ndarray
+        Source grid cell centres
+    tgt_lat, tgt_lon : numpy.ndarray
+        Target grid cell centres
+    method : str
+        Must be a key in the dict returned by get_regrid_method_key()
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Matrix of shape (len(tgt_lat) * len(tgt_lon), len(src_lat) * len(src_lon))
+        acting on data flattened in (lat, lon) order
+    """
+    method_key = get_regrid_method_key()
+    if method not in method_key:
+        print(f"method should be one of {method_key.keys()}")
+        raise KeyError
+    periodic = _is_periodic(src_lon)
+
+    if method == "bilinear":
+        lat_weights = _linear_weights_1d(src_lat, tgt_lat)
+        lon_weights = _linear_weights_1d(src_lon, tgt_lon, periodic=periodic)
+    else:
+        lat_weights = _overlap_weights_1d(
+            np.sin(np.deg2rad(_cell_bounds(src_lat, clip=(-90, 90)))),
+            np.sin(np.deg2rad(_cell_bounds(tgt_lat, clip=(-90, 90)))),
+        )
+        lon_weights = _overlap_weights_1d(
+            _cell_bounds(src_lon), _cell_bounds(tgt_lon), periodic
+        )
+
+    return sparse.kron(lat_weights, lon_weights, format="csr")
+
+
+def _grid_hash(src_lat, src_lon, tgt_lat, tgt_lon, method):
+    """Hash identifying a (source grid, target grid, method) combination"""
+    sha = hashlib.sha1(method.encode())
+    for coord in (src_lat, src_lon, tgt_lat, tgt_lon):
+        coord = np.ascontiguousarray(coord, dtype="float64")
+        sha.update(str(coord.shape).encode())
+        sha.update(coord.tobytes())
+    return sha.hexdigest()
+
+
+def get_regrid_weights(
+    src_lat, src_lon, tgt_lat, tgt_lon, method="bilinear", cache_dir=REGRID_CACHE_DIR
+):
+    """Returns the weights for a (source grid, target grid) pair, computing them
+    only the first time they are needed
+
+    Weights are held in memory and saved to cache_dir as a scipy sparse .npz so
+    other processes (e.g. the other gunicorn workers) and later sessions reuse
+    them. Set cache_dir to None to keep them in memory only.
+    """
+    key = _grid_hash(src_lat, src_lon, tgt_lat, tgt_lon, method)
+    record_cache("regrid_weights", key in _weights_cache)
+    if key in _weights_cache:
+        return _weights_cache[key]
+
+    file_path = None if cache_dir is None else f"{cache_dir}/{method}_{key}.npz"
+    on_disk = file_path is not None and os.path.isfile(file_path)
+    record_cache("regrid_weights_disk", on_disk)
+    if on_disk:
+        weights = sparse.load_npz(file_path).tocsr()
+    else:
+        weights = compute_regrid_weights(src_lat, src_lon, tgt_lat, tgt_lon, method)
+        if file_path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Writing to a temporary file first so a worker never reads half a file
+            tmp_path = f"{file_path}.{os.getpid()}.tmp.npz"
+            sparse.save_npz(tmp_path, weights)
+            os.replace(tmp_path, file_path)
+    _weights_cache[key] = weights
+    return weights
+
+
+def _apply_weights(data, weights, tgt_shape, min_coverage):
+    """Applies the weight matrix to the trailing (lat, lon) axes of a numpy array.
+    Missing values are left out and the weights renormalised over the valid ones."""
+    lead_shape = data.shape[:-2]
+    flat = data.reshape(-1, data.shape[-2] * data.shape[-1]).T
+    valid = ~np.isnan(flat)
+    values = weights @ np.where(valid, flat, 0)
+    coverage = weights @ valid.astype(flat.dtype)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        regridded = np.where(coverage >= min_coverage, values / coverage, np.nan)
+    return regridded.T.reshape(lead_shape + tgt_shape)
+
+
+def regrid(
+    data,
+    target_grid,
+    method="bilinear",
+    cache_dir=REGRID_CACHE_DIR,
+    min_coverage=0.5,
+):
+    """Maps data on a rectilinear lat/lon grid onto the target grid
+
+    Parameters
+    ----------
+    data : xarray.DataArray or xarray.Dataset
+        Data with lat and lon dimensions, e.g. the output of get_month_and_year().
+        For datasets every data variable with lat and lon dimensions is regridded
+        and any other variable using lat or lon (e.g. lat_bnds) is dropped.
+    target_grid : xarray.Dataset
+        Grid from make_target_grid() or get_common_grid()
+    method : str
+        Must be a key in the dict returned by get_regrid_method_key()
+    cache_dir : str
+        Where to store the weights, see get_regrid_weights()
+    min_coverage : float
+        Target cells where the valid (non NaN) source weights sum to less than this
+        are set to NaN, so e.g. land-only variables do not bleed into the ocean
+
+    Returns
+    -------
+    xarray.DataArray or xarray.Dataset
+        The regridded data, lazy if the input was dask backed
+    """
+    if isinstance(data, xr.Dataset):
+        regridded = {}
+        for name, var_data in data.data_vars.items():
+            if "lat" in var_data.dims and "lon" in var_data.dims:
+                regridded[name] = regrid(
+                    var_data, target_grid, method, cache_dir, min_coverage
+                )
+        return xr.Dataset(regridded, attrs=data.attrs)
+
+    if data.chunks is not None:
+        # The weights act on whole lat/lon slices
+        data = data.chunk({"lat": -1, "lon": -1})
+    tgt_lat = target_grid["lat"].values
+    tgt_lon = target_grid["lon"].values
+    weights = get_regrid_weights(
+        data["lat"].values, data["lon"].values, tgt_lat, tgt_lon, method, cache_dir
+    )
+    regridded = xr.apply_ufunc(
+        _apply_weights,
+        data.astype("float64"),
+        kwargs={
+            "weights": weights,
+            "tgt_shape": (len(tgt_lat), len(tgt_lon)),
+            "min_coverage": min_coverage,
+        },
+        input_core_dims=[["lat", "lon"]],
+        output_core_dims=[["lat_regrid", "lon_regrid"]],
+        exclude_dims={"lat", "lon"},
+        dask="parallelized",
+        dask_gufunc_kwargs={
+            "output_sizes": {"lat_regrid": len(tgt_lat), "lon_regrid": len(tgt_lon)}
+        },
+        output_dtypes=["float64"],
+        keep_attrs=True,
+    )
+    regridded = regridded.rename({"lat_regrid": "lat", "lon_regrid": "lon"})
+    return regridded.assign_coords(lat=tgt_lat, lon=tgt_lon)
+
+
+def regrid_to_common_grid(data_list, method="conservative", cache_dir=REGRID_CACHE_DIR):
+    """Regrids each of the datasets or data arrays onto the grid returned by
+    get_common_grid() so they can be compared cell by cell
+
+    Returns
+    -------
+    list
+        The regridded data in the same order as data_list
+    """
+    target_grid = get_common_grid(data_list)
+    return [regrid(data, target_grid, method, cache_dir) for data in data_list]
+
+
+def align_datasets(
+    dsets, var_id, method="conservative", time_chunk=12, cache_dir=REGRID_CACHE_DIR
+):
+    """Lazily maps the var_id of each dataset onto their common grid
+
+    The data is chunked along time before regridding so selecting a single month of
+    the result only regrids the chunk holding it. Holding on to the returned
+    datasets lets later selections reuse the same graph and chunk layout.
+
+    Parameters
+    ----------
+    dsets : list
+        xarray Datasets with time, lat and lon dimensions
+    var_id : str
+        The variable to align
+    method : str
+        Must be a key in the dict returned by get_regrid_method_key()
+    time_chunk : int
+        Chunk size along time
+    cache_dir : str
+        Where to store the weights, see get_regrid_weights()
+
+    Returns
+    -------
+    list
+        Dask backed xarray Datasets holding only var_id on the common grid
+    """
+    var_list = []
+    for dset in dsets:
+        var_data = dset[var_id]
+        if "time" in var_data.dims:
+            var_data = var_data.chunk({"time": time_chunk, "lat": -1, "lon": -1})
+        var_list.append(var_data)
+    return [
+        var_data.to_dataset(name=var_id)
+        for var_data in regrid_to_common_grid(var_list, method, cache_dir)
+    ]
@@ -0,0 +1,574 @@
+import fcntl
+import hashlib
+import os
+import threading
+import time
+
+import fsspec
+from fsspec.spec import AbstractFileSystem
+
+from .metrics_utils import record_bytes
+from .metrics_utils import record_cache
+
+# Every way the pangeo bucket shows up in the catalog and in wrangling_utils. Paths
+# under these prefixes are served from the same relative path by every backend.
+PANGEO_PREFIXES = (
+    "gs://cmip6/",
+    "gcs://cmip6/",
+    "https://storage.googleapis.com/cmip6/",
+)
+
+# Environment variables read by get_storage_config()
+STORAGE_ENV = {
+    "backend": "CMIP6_STORAGE",
+    "root": "CMIP6_STORAGE_ROOT",
+    "latency": "CMIP6_STORAGE_LATENCY",
+    "bandwidth": "CMIP6_STORAGE_BANDWIDTH",
+    "chunk_cache": "CMIP6_CHUNK_CACHE",
+    "chunk_cache_size": "CMIP6_CHUNK_CACHE_SIZE",
+}
+
+# Eviction from the chunk cache goes down to this fraction of its size cap, so it
+# does not run again on the very next write
+CHUNK_CACHE_LOW_WATER = 0.9
+
+# Settings from configure_storage(), taking precedence over the environment
+_storage_overrides = {}
+
+# Filesystems built for a configuration, keyed on the configuration so the request
+# counters of a latency filesystem survive between calls
+_storage_fs_cache = {}
+
+
+# This function returns a dictionary used to validate the storage backend
+# configured with CMIP6_STORAGE or configure_storage()
+def get_storage_backend_key():
+    backend_key = {
+        "remote": {"fullname": "Pangeo CMIP6 bucket on Google Cloud Storage"},
+        "local": {"fullname": "Local directory mirror of the bucket"},
+        "memory": {"fullname": "In-memory fsspec filesystem"},
+    }
+    return backend_key
+
+
+class CountingFileSystem(AbstractFileSystem):
+    """Wraps an fsspec filesystem, counting the bytes read through it as storage
+    reads on /metrics
+
+    Bulk reads are passed to fs in one call, so gcsfs still fetches the chunks of a
+    slice concurrently.
+
+    Parameters
+    ----------
+    fs : fsspec.AbstractFileSystem
+        The filesystem actually serving the data
+    """
+
+    protocol = "counting"
+    # Instances wrap different filesystems so must never be shared by fsspec
+    cachable = False
+
+    def __init__(self, fs, **storage_options):
+        super().__init__(**storage_options)
+        self.fs = fs
+
+    def cat_file(self, path, start=None, end=None, **kwargs):
+        data = self.fs.cat_file(path, start=start, end=end, **kwargs)
+        record_bytes("storage", len(data))
+        return data
+
+    def cat(self, path, recursive=False, on_error="raise", **kwargs):
+        out = self.fs.cat(path, recursive=recursive, on_error=on_error, **kwargs)
+        if isinstance(out, bytes):
+            record_bytes("storage", len(out))
+        else:
+            nbytes = sum(len(data) for data in out.values() if isinstance(data, bytes))
+            record_bytes("storage", nbytes)
+        return out
+
+    def ls(self, path, detail=True, **kwargs):
+        return self.fs.ls(path, detail=detail, **kwargs)
+
+    def info(self, path, **kwargs):
+        return self.fs.info(path, **kwargs)
+
+    def _open(self, path, mode="rb", **kwargs):
+        return self.fs.open(path, mode, **kwargs)
+
+
+class LatencyFileSystem(AbstractFileSystem):
+    """Wraps an fsspec filesystem, delaying every request like a remote store would
+
+    Each request sleeps for latency seconds plus the time the bytes it moves take at
+    the given bandwidth, so timings against local or in-memory stores are
+    deterministic stand-ins for the bucket. Requests and bytes are counted in stats.
+
+    Parameters
+    ----------
+    fs : fsspec.AbstractFileSystem
+        The filesystem actually serving the data
+    latency : float
+        Seconds added to every request
+    bandwidth : float, optional
+        Bytes per second, unlimited if None
+    """
+
+    protocol = "latency"
+    # Instances wrap different filesystems so must never be shared by fsspec
+    cachable = False
+
+    def __init__(self, fs, latency=0.0, bandwidth=None, **storage_options):
+        super().__init__(**storage_options)
+        self.fs = fs
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.stats = {"requests": 0, "bytes": 0}
+        self._stats_lock = threading.Lock()
+
+    def _wait(self, nbytes=0):
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += nbytes
+        delay = self.latency
+        if self.bandwidth:
+            delay += nbytes / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+
+    def ls(self, path, detail=True, **kwargs):
+        self._wait()
+        return self.fs.ls(path, detail=detail, **kwargs)
+
+    def info(self, path, **kwargs):
+        self._wait()
+        return self.fs.info(path, **kwargs)
+
+    def cat_file(self, path, start=None, end=None, **kwargs):
+        data = self.fs.cat_file(path, start=start, end=end, **kwargs)
+        record_bytes("storage", len(data))
+        self._wait(len(data))
+        return data
+
+    def pipe_file(self, path, value, **kwargs):
+        self._wait(len(value))
+        return self.fs.pipe_file(path, value, **kwargs)
+
+    def _open(self, path, mode="rb", **kwargs):
+        self._wait()
+        return self.fs.open(path, mode, **kwargs)
+
+    def rm_file(self, path):
+        return self.fs.rm_file(path)
+
+    def mkdir(self, path, create_parents=True, **kwargs):
+        return self.fs.mkdir(path, create_parents=create_parents, **kwargs)
+
+    def makedirs(self, path, exist_ok=False):
+        return self.fs.makedirs(path, exist_ok=exist_ok)
+
+    def rmdir(self, path):
+        return self.fs.rmdir(path)
+
+
+class ChunkCacheFileSystem(AbstractFileSystem):
+    """Wraps an fsspec filesystem, keeping the zarr chunks it reads in a persistent
+    on-disk cache
+
+    Whole-file reads of chunk keys (anything but the .zarray, .zattrs, .zmetadata
+    and zarr.json metadata, which is always read from fs) are served from
+    cache_dir when present and written there otherwise. Once the cache grows past
+    max_bytes the least recently used chunks are deleted. Several processes (e.g.
+    gunicorn workers) can share cache_dir: chunks are written atomically, a chunk
+    evicted while being read counts as a miss and only one process evicts at a
+    time. Hits, misses and the bytes served from the cache and from fs are counted
+    in stats.
+
+    Parameters
+    ----------
+    fs : fsspec.AbstractFileSystem
+        The filesystem actually serving the data
+    cache_dir : str
+        Directory holding the cached chunks
+    max_bytes : int
+        Size cap of the cache
+    """
+
+    protocol = "chunkcache"
+    # Instances wrap different filesystems so must never be shared by fsspec
+    cachable = False
+
+    def __init__(self, fs, cache_dir, max_bytes, **storage_options):
+        super().__init__(**storage_options)
+        self.fs = fs
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "cache_bytes": 0, "store_bytes": 0}
+        self._stats_lock = threading.Lock()
+        # Bytes in cache_dir as last seen by this process, None until first scanned
+        self._cache_size = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def is_chunk(path):
+        file_name = path.rstrip("/").split("/")[-1]
+        return not file_name.startswith(".") and file_name != "zarr.json"
+
+    def _cache_path(self, path):
+        digest = hashlib.sha256(path.encode()).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def _count(self, hit, nbytes):
+        with self._stats_lock:
+            if hit:
+                self.stats["hits"] += 1
+                self.stats["cache_bytes"] += nbytes
+            else:
+                self.stats["misses"] += 1
+                self.stats["store_bytes"] += nbytes
+        record_cache("chunk_cache", hit)
+        record_bytes("chunk_cache" if hit else "chunk_store", nbytes)
+
+    def _read_cached(self, path):
+        cache_path = self._cache_path(path)
+        try:
+            with open(cache_path, "rb") as read_file:
+                data = read_file.read()
+            # Eviction goes by modification time, so reading marks it as recent
+            os.utime(cache_path)
+        except FileNotFoundError:
+            return None
+        self._count(True, len(data))
+        return data
+
+    def _write_cached(self, path, data):
+        self._count(False, len(data))
+        cache_path = self._cache_path(path)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as write_file:
+            write_file.write(data)
+        os.replace(tmp_path, cache_path)
+        with self._stats_lock:
+            if self._cache_size is not None:
+                self._cache_size += len(data)
+        if self._cache_size is None or self._cache_size > self.max_bytes:
+            self.evict()
+
+    def _cached_files(self):
+        cached_files = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir():
+                continue
+            for file_entry in os.scandir(entry.path):
+                if file_entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = file_entry.stat()
+                except FileNotFoundError:
+                    continue
+                cached_files.append((stat.st_mtime, stat.st_size, file_entry.path))
+        return cached_files
+
+    def evict(self):
+        """Deletes the least recently used chunks until the cache is below
+        CHUNK_CACHE_LOW_WATER of max_bytes if it is over max_bytes
+
+        Skipped if another process is already evicting from the same cache.
+        """
+        with open(os.path.join(self.cache_dir, ".lock"), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            cached_files = self._cached_files()
+            cache_size = sum(size for _, size, _ in cached_files)
+            if cache_size > self.max_bytes:
+                for _, size, file_path in sorted(cached_files):
+                    if cache_size <= self.max_bytes * CHUNK_CACHE_LOW_WATER:
+                        break
+                    try:
+                        os.remove(file_path)
+                    except FileNotFoundError:
+                        pass
+                    cache_size -= size
+        with self._stats_lock:
+            self._cache_size = cache_size
+
+    def cat_file(self, path, start=None, end=None, **kwargs):
+        if start is not None or end is not None or not self.is_chunk(path):
+            return self.fs.cat_file(path, start=start, end=end, **kwargs)
+        data = self._read_cached(path)
+        if data is None:
+            data = self.fs.cat_file(path, **kwargs)
+            self._write_cached(path, data)
+        return data
+
+    def cat(self, path, recursive=False, on_error="raise", **kwargs):
+        if isinstance(path, str) and not recursive:
+            return self.cat_file(path, **kwargs)
+        if recursive:
+            paths = self.expand_path(path, recursive=True)
+        else:
+            paths = list(path)
+        out = {}
+        for file_path in paths:
+            if self.is_chunk(file_path):
+                data = self._read_cached(file_path)
+                if data is not None:
+                    out[file_path] = data
+        # The misses are fetched in one call, concurrently if fs supports it
+        missing = [file_path for file_path in paths if file_path not in out]
+        if missing:
+            fetched = self.fs.cat(missing, on_error=on_error, **kwargs)
+            for file_path, data in fetched.items():
+                if isinstance(data, bytes) and self.is_chunk(file_path):
+                    self._write_cached(file_path, data)
+            out.update(fetched)
+        return out
+
+    def ls(self, path, detail=True, **kwargs):
+        return self.fs.ls(path, detail=detail, **kwargs)
+
+    def info(self, path, **kwargs):
+        return self.fs.info(path, **kwargs)
+
+    def _open(self, path, mode="rb", **kwargs):
+        return self.fs.open(path, mode, **kwargs)
+
+
+def configure_storage(
+    backend=None,
+    root=None,
+    latency=None,
+    bandwidth=None,
+    chunk_cache=None,
+    chunk_cache_size=None,
+):
+    """Selects the storage backend used for every store opened by wrangling_utils
+
+    Arguments left as None fall back to the environment (see STORAGE_ENV) and then
+    the defaults of get_storage_config(). Calling with no arguments clears earlier
+    configuration.
+
+    Parameters
+    ----------
+    backend : str
+        Must be a key in the dict returned by get_storage_backend_key()
+    root : str
+        Directory holding the mirror for the local backend
+    latency : float
+        Seconds added to every request to the store
+    bandwidth : float
+        Bytes per second the store is limited to
+    chunk_cache : str
+        Directory of a persistent cache of the chunks read from the stores, see
+        ChunkCacheFileSystem
+    chunk_cache_size : int
+        Size cap of the chunk cache in bytes
+    """
+    if backend is not None and backend not in get_storage_backend_key():
+        print(f"backend should be one of {get_storage_backend_key().keys()}")
+        raise KeyError
+    _storage_overrides.clear()
+    settings = dict(
+        backend=backend,
+        root=root,
+        latency=latency,
+        bandwidth=bandwidth,
+        chunk_cache=chunk_cache,
+        chunk_cache_size=chunk_cache_size,
+    )
+    for setting, value in settings.items():
+        if value is not None:
+            _storage_overrides[setting] = value
+
+
+def get_storage_config():
+    """Returns the storage configuration currently in effect
+
+    Returns
+    -------
+    dict
+        backend (default "remote"), root (default "./.cache/cmip6_mirror"), latency
+        in seconds (default 0), bandwidth in bytes per second (default None, i.e.
+        unlimited), chunk_cache directory (default None, i.e. no chunk cache) and
+        chunk_cache_size in bytes (default 2 GB)
+    """
+    config = {
+        "backend": os.environ.get(STORAGE_ENV["backend"], "remote"),
+        "root": os.environ.get(STORAGE_ENV["root"], "./.cache/cmip6_mirror"),
+        "latency": float(os.environ.get(STORAGE_ENV["latency"], 0)),
+        "bandwidth": float(os.environ.get(STORAGE_ENV["bandwidth"], 0)) or None,
+        "chunk_cache": os.environ.get(STORAGE_ENV["chunk_cache"]) or None,
+        "chunk_cache_size": int(
+            float(os.environ.get(STORAGE_ENV["chunk_cache_size"], 2e9))
+        ),
+    }
+    config.update(_storage_overrides)
+    if config["backend"] not in get_storage_backend_key():
+        print(f"backend should be one of {get_storage_backend_key().keys()}")
+        raise KeyError
+    return config
+
+
+def get_storage_path(url, config=None):
+    """Maps a bucket URL onto the path serving it in the configured backend
+
+    Paths under PANGEO_PREFIXES keep their path relative to the bucket, below the
+    mirror root for the local backend and below / for the memory backend. Any other
+    path (e.g. the local stores of synthetic_data) is served unchanged.
+
+    Parameters
+    ----------
+    url : str
+        A zstore or catalog URL
+    config : dict
+        Configuration from get_storage_config(), the current one if None
+
+    Returns
+    -------
+    str
+        The path of url in the backend's filesystem
+    """
+    config = get_storage_config() if config is None else config
+    if config["backend"] == "remote":
+        return url
+    for prefix in PANGEO_PREFIXES:
+        if url.startswith(prefix):
+            relative_path = url.replace(prefix, "", 1)
+            break
+    else:
+        return url
+    if config["backend"] == "local":
+        return os.path.join(config["root"], relative_path)
+    return "/" + relative_path
+
+
+def get_storage_fs(url, config=None):
+    """Returns the filesystem and path serving url in the configured backend
+
+    Parameters
+    ----------
+    url : str
+        A zstore or catalog URL
+    config : dict
+        Configuration from get_storage_config(), the current one if None
+
+    Returns
+    -------
+    fs : fsspec.AbstractFileSystem
+        Wrapped in a LatencyFileSystem, or a CountingFileSystem if this is the
+        remote backend without latency or bandwidth configured, and then in a
+        ChunkCacheFileSystem if a chunk cache is configured
+    path : str
+        The path of url in fs
+    """
+    config = get_storage_config() if config is None else config
+    path = get_storage_path(url, config)
+    if config["backend"] == "remote":
+        fs, path = fsspec.core.url_to_fs(path)
+    elif config["backend"] == "local":
+        fs = fsspec.filesystem("file")
+    else:
+        fs = fsspec.filesystem("memory")
+
+    # Local and in-memory stores are always wrapped (undelayed by default) so their
+    # requests and bytes are counted. gcsfs is only delayed on request since the
+    # wrapper fetches chunks one at a time where gcsfs fetches them concurrently, and
+    # otherwise just has its bytes counted.
+    cache_key = (
+        config["backend"],
+        fs.protocol,
+        config["latency"],
+        config["bandwidth"],
+    )
+    if cache_key not in _storage_fs_cache:
+        if config["backend"] != "remote" or config["latency"] or config["bandwidth"]:
+            _storage_fs_cache[cache_key] = LatencyFileSystem(
+                fs, config["latency"], config["bandwidth"]
+            )
+        else:
+            _storage_fs_cache[cache_key] = CountingFileSystem(fs)
+    fs = _storage_fs_cache[cache_key]
+
+    if config["chunk_cache"]:
+        cache_key = (
+            config["backend"],
+            fs.protocol,
+            config["latency"],
+            config["bandwidth"],
+            os.path.abspath(config["chunk_cache"]),
+            config["chunk_cache_size"],
+        )
+        if cache_key not in _storage_fs_cache:
+            _storage_fs_cache[cache_key] = ChunkCacheFileSystem(
+                fs, config["chunk_cache"], config["chunk_cache_size"]
+            )
+        fs = _storage_fs_cache[cache_key]
+    return fs, path
+
+
+def get_mapper(zstore):
+    """Drop in replacement for fsspec.get_mapper() serving zstore from the configured
+    backend
+
+    Parameters
+    ----------
+    zstore : str
+        Zarr store URL, as in the zstore column of the catalog
+
+    Returns
+    -------
+    fsspec.FSMap
+        Mapping to pass to xarray.open_zarr()
+    """
+    fs, path = get_storage_fs(zstore)
+    return fs.get_mapper(path)
+
+
+def get_storage_url(url):
+    """Returns a URL opening url from the configured backend with fsspec.open(), for
+    files read in one go like the catalog, so never delayed"""
+    config = get_storage_config()
+    path = get_storage_path(url, config)
+    if config["backend"] == "memory":
+        return "memory://" + path
+    return path
+
+
+def mirror_store(source, zstore):
+    """Copies a directory (e.g. a zarr store) into the configured backend so it is
+    served at zstore
+
+    Parameters
+    ----------
+    source : str
+        Local directory to copy
+    zstore : str
+        The URL the copy should be served at, e.g. the bucket URL of the original
+
+    Returns
+    -------
+    str
+        The path of the copy in the backend's filesystem
+    """
+    config = get_storage_config()
+    if config["backend"] == "remote":
+        print("Mirroring into the remote bucket is not supported")
+        raise AssertionError
+    # Copying with the undelayed, uncached filesystem
+    fs, path = get_storage_fs(
+        zstore, dict(config, latency=0, bandwidth=None, chunk_cache=None)
+    )
+    if config["backend"] == "local" and os.path.abspath(source) == os.path.abspath(
+        path
+    ):
+        return path
+    for dir_path, _, file_names in os.walk(source):
+        relative_dir = os.path.relpath(dir_path, source)
+        for file_name in file_names:
+            dest = os.path.normpath(os.path.join(path, relative_dir, file_name))
+            fs.makedirs(os.path.dirname(dest), exist_ok=True)
+            with open(os.path.join(dir_path, file_name), "rb") as read_file:
+                fs.pipe_file(dest, read_file.read())
+    return path
@@ -0,0 +1,369 @@
+import json
+import os
+
+import cftime
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .wrangling_utils import get_monthly_table_for_var
+
+# The standard CMIP6 plev19 pressure levels in Pa
+PLEV19 = np.array(
+    [
+        100000,
+        92500,
+        85000,
+        70000,
+        60000,
+        50000,
+        40000,
+        30000,
+        25000,
+        20000,
+        15000,
+        10000,
+        7000,
+        5000,
+        3000,
+        2000,
+        1000,
+        500,
+        100,
+    ],
+    dtype="float64",
+)
+
+
+# This function returns a dictionary of the grids and calendars of the models in
+# get_model_key() used to generate their synthetic stores
+def get_synthetic_model_key():
+    synthetic_key = {
+        "CanESM5": {
+            "institution_id": "CCCma",
+            "nlat": 64,
+            "nlon": 128,
+            "calendar": "365_day",
+            "grid_label": "gn",
+        },
+        "HadGEM3-GC31-MM": {
+            "institution_id": "MOHC",
+            "nlat": 324,
+            "nlon": 432,
+            "calendar": "360_day",
+            "grid_label": "gn",
+        },
+        "CESM2": {
+            "institution_id": "NCAR",
+            "nlat": 192,
+            "nlon": 288,
+            "calendar": "noleap",
+            "grid_label": "gn",
+        },
+    }
+    return synthetic_key
+
+
+# This function returns a dictionary of the years written for each experiment.
+# piControl deliberately uses different years to the other experiments as the
+# real piControl runs do.
+def get_synthetic_experiment_key():
+    exp_key = {
+        "historical": {"activity_id": "CMIP", "start_year": 1950, "end_year": 1955},
+        "piControl": {"activity_id": "CMIP", "start_year": 6000, "end_year": 6001},
+        "ssp585": {"activity_id": "ScenarioMIP", "start_year": 2025, "end_year": 2030},
+        "ssp245": {"activity_id": "ScenarioMIP", "start_year": 2025, "end_year": 2030},
+    }
+    return exp_key
+
+
+def make_synthetic_grid(nlat, nlon):
+    """Returns cell centre and bound coordinates for a regular global grid"""
+    lat_edges = np.linspace(-90, 90, nlat + 1)
+    lon_edges = np.linspace(0, 360, nlon + 1)
+    lat = (lat_edges[1:] + lat_edges[:-1]) / 2
+    lon = (lon_edges[1:] + lon_edges[:-1]) / 2
+    lat_bnds = np.stack([lat_edges[:-1], lat_edges[1:]], axis=1)
+    lon_bnds = np.stack([lon_edges[:-1], lon_edges[1:]], axis=1)
+    return lat, lon, lat_bnds, lon_bnds
+
+
+def make_synthetic_times(start_year, end_year, calendar):
+    """Returns monthly cftime centres (the 16th at noon like most CMIP6 models) and
+    bounds for the years given"""
+    times, bnds = [], []
+    for year in range(start_year, end_year + 1):
+        for month in range(1, 13):
+            start = cftime.datetime(year, month, 1, calendar=calendar)
+            if month == 12:
+                end = cftime.datetime(year + 1, 1, 1, calendar=calendar)
+            else:
+                end = cftime.datetime(year, month + 1, 1, calendar=calendar)
+            times.append(cftime.datetime(year, month, 16, 12, calendar=calendar))
+            bnds.append([start, end])
+    return np.array(times), np.array(bnds)
+
+
+def make_synthetic_dataset(
+    mod_id, var_id, exp_id, member_num=0, start_year=None, end_year=None, seed=0
+):
+    """Creates one synthetic member of a model run
+
+    Values follow a rough latitudinal profile with a seasonal cycle, a small trend
+    and noise that differs between members. Land-only (Lmon) variables are NaN over
+    a fake ocean.
+
+    Parameters
+    ----------
+    mod_id : str
+        Must be a key in the dict returned by get_synthetic_model_key()
+    var_id : str
+        Must be a key in the dict returned by get_var_key()
+    exp_id : str
+        Must be a key in the dict returned by get_synthetic_experiment_key()
+    member_num : int
+        Index of the member, changes the noise
+    start_year, end_year : int
+        Defaults to the years in get_synthetic_experiment_key()
+
+    Returns
+    -------
+    xarray.Dataset
+    """
+    model = get_synthetic_model_key()[mod_id]
+    exp = get_synthetic_experiment_key()[exp_id]
+    start_year = exp["start_year"] if start_year is None else start_year
+    end_year = exp["end_year"] if end_year is None else end_year
+
+    lat, lon, lat_bnds, lon_bnds = make_synthetic_grid(model["nlat"], model["nlon"])
+    times, time_bnds = make_synthetic_times(start_year, end_year, model["calendar"])
+    months = np.array([time.month for time in times])
+    years = np.array([time.year for time in times]) - start_year
+
+    rng = np.random.default_rng([seed, member_num, len(mod_id), len(var_id)])
+    coslat = np.cos(np.deg2rad(lat))[None, :, None]
+    season = np.sin(2 * np.pi * (months - 1) / 12)[:, None, None] * np.sign(
+        lat[None, :, None]
+    )
+    shape = (len(times), len(lat), len(lon))
+    base = {
+        "tas": 250 + 50 * coslat + 10 * season,
+        "ta": 250 + 50 * coslat + 10 * season,
+        "pr": 3e-5 * coslat + 5e-6 * season,
+        "hus": 1e-2 * coslat**2 + 1e-3 * season,
+        "mrro": 2e-5 * coslat + 5e-6 * season,
+        "lai": 3 * coslat + season,
+        "mrso": 800 * coslat + 50 * season,
+    }[var_id]
+    trend = 0.02 * np.abs(base) * years[:, None, None] / 10
+    values = base + trend + 0.01 * np.abs(base) * rng.standard_normal(shape)
+
+    dims = ("time", "lat", "lon")
+    if var_id in ["ta", "hus"]:
+        # Decreasing with height like the real profiles
+        scale = (PLEV19 / PLEV19[0])[None, :, None, None]
+        values = values[:, None, :, :] * scale
+        dims = ("time", "plev", "lat", "lon")
+    if get_monthly_table_for_var(var_id) == "Lmon":
+        ocean = np.sin(np.deg2rad(3 * lon))[None, :] > 0.3
+        values = np.where(ocean, np.nan, values)
+
+    coords = {
+        "time": ("time", times, {"standard_name": "time"}),
+        "lat": ("lat", lat, {"units": "degrees_north", "standard_name": "latitude"}),
+        "lon": ("lon", lon, {"units": "degrees_east", "standard_name": "longitude"}),
+    }
+    if "plev" in dims:
+        coords["plev"] = ("plev", PLEV19, {"units": "Pa", "positive": "down"})
+    dset = xr.Dataset(
+        {
+            var_id: (dims, values.astype("float32")),
+            "time_bnds": (("time", "bnds"), time_bnds),
+            "lat_bnds": (("lat", "bnds"), lat_bnds),
+            "lon_bnds": (("lon", "bnds"), lon_bnds),
+        },
+        coords=coords,
+        attrs={
+            "source_id": mod_id,
+            "experiment_id": exp_id,
+            "variable_id": var_id,
+            "variant_label": f"r{member_num + 1}i1p1f1",
+        },
+    )
+    return dset
+
+
+def make_synthetic_areacella(mod_id):
+    """Creates the cell areas (the fx variable areacella) of a model's synthetic
+    grid, exact for a sphere of the Earth's radius"""
+    model = get_synthetic_model_key()[mod_id]
+    lat, lon, lat_bnds, lon_bnds = make_synthetic_grid(model["nlat"], model["nlon"])
+    radius = 6371000.0
+    lat_span = np.diff(np.sin(np.deg2rad(lat_bnds)), axis=1)[:, 0]
+    lon_span = np.deg2rad(np.diff(lon_bnds, axis=1)[:, 0])
+    return xr.Dataset(
+        {
+            "areacella": (
+                ("lat", "lon"),
+                radius**2 * lat_span[:, None] * lon_span[None, :],
+                {"units": "m2", "standard_name": "cell_area"},
+            )
+        },
+        coords={"lat": lat, "lon": lon},
+        attrs={"source_id": mod_id, "variable_id": "areacella"},
+    )
+
+
+def write_synthetic_catalog(
+    root_dir,
+    mod_id_list=None,
+    var_id_list=("tas", "lai"),
+    exp_id_list=("historical",),
+    members=3,
+    time_chunk=36,
+    areacella=True,
+):
+    """Writes synthetic zarr stores and a catalog describing them
+
+    The stores mimic the pangeo CMIP6 bucket closely enough for the wrangling, case
+    and plotting code to run against them offline: native model grids, the model's
+    cftime calendar, several members, layered ta/hus on plev19, the usual bounds
+    variables and fx cell areas. Stores that already exist are not rewritten.
+
+    Parameters
+    ----------
+    root_dir : str
+        Directory to write into. Stores are written under root_dir/stores following
+        the pangeo path layout.
+    mod_id_list : list of str
+        Defaults to every model in get_synthetic_model_key()
+    var_id_list : list of str
+        Variables to write
+    exp_id_list : list of str
+        Experiments to write
+    members : int
+        Number of members per model, variable and experiment
+    time_chunk : int
+        Chunk size of the zarr stores along time
+    areacella : bool
+        Also write the cell areas of each model and experiment as an fx store
+
+    Returns
+    -------
+    json_path : str
+        Path to the catalog JSON, usable with get_esm_datastore(json_path)
+    """
+    if mod_id_list is None:
+        mod_id_list = list(get_synthetic_model_key().keys())
+    model_key = get_synthetic_model_key()
+    exp_key = get_synthetic_experiment_key()
+    rows = []
+
+    def add_store(mod, exp, member_id, table, var, make_dset):
+        zstore = os.path.abspath(
+            os.path.join(
+                root_dir,
+                "stores",
+                exp_key[exp]["activity_id"],
+                model_key[mod]["institution_id"],
+                mod,
+                exp,
+                member_id,
+                table,
+                var,
+                model_key[mod]["grid_label"],
+                "v20190429",
+            )
+        )
+        if not os.path.isdir(zstore):
+            dset = make_dset()
+            if "time" in dset.dims:
+                dset = dset.chunk({"time": time_chunk})
+            # Writing next to the store and renaming so an interrupted run never
+            # leaves a partial store behind
+            tmp_store = f"{zstore}.{os.getpid()}.tmp"
+            dset.to_zarr(tmp_store, mode="w", consolidated=True)
+            os.replace(tmp_store, zstore)
+        rows.append(
+            {
+                "activity_id": exp_key[exp]["activity_id"],
+                "institution_id": model_key[mod]["institution_id"],
+                "source_id": mod,
+                "experiment_id": exp,
+                "member_id": member_id,
+                "table_id": table,
+                "variable_id": var,
+                "grid_label": model_key[mod]["grid_label"],
+                "zstore": zstore,
+                "dcpp_init_year": np.nan,
+                "version": 20190429,
+            }
+        )
+
+    for mod in mod_id_list:
+        for exp in exp_id_list:
+            if areacella:
+                add_store(
+                    mod,
+                    exp,
+                    "r1i1p1f1",
+                    "fx",
+                    "areacella",
+                    lambda: make_synthetic_areacella(mod),
+                )
+            for var in var_id_list:
+                table = get_monthly_table_for_var(var)
+                for member_num in range(members):
+                    add_store(
+                        mod,
+                        exp,
+                        f"r{member_num + 1}i1p1f1",
+                        table,
+                        var,
+                        lambda: make_synthetic_dataset(mod, var, exp, member_num),
+                    )
+
+    # Adding to the catalog of any earlier call writing into the same directory
+    csv_path = os.path.abspath(os.path.join(root_dir, "synthetic-cmip6.csv"))
+    catalog_df = pd.DataFrame(rows)
+    if os.path.isfile(csv_path):
+        catalog_df = pd.concat([pd.read_csv(csv_path), catalog_df], ignore_index=True)
+    catalog_df.drop_duplicates("zstore", keep="last").to_csv(csv_path, index=False)
+
+    json_path = os.path.join(root_dir, "synthetic-cmip6.json")
+    with open(json_path, "w") as write_file:
+        json.dump(_catalog_json(csv_path), write_file, indent=4)
+    return json_path
+
+
+def _catalog_json(csv_path):
+    """ESM collection spec with the same columns and aggregations as pangeo's"""
+    groupby_attrs = [
+        "activity_id",
+        "institution_id",
+        "source_id",
+        "experiment_id",
+        "table_id",
+        "grid_label",
+    ]
+    columns = groupby_attrs + ["member_id", "variable_id", "dcpp_init_year", "version"]
+    return {
+        "esmcat_version": "0.1.0",
+        "id": "synthetic-cmip6",
+        "description": "Synthetic CMIP6-like stores for offline tests and benchmarks",
+        "catalog_file": csv_path,
+        "attributes": [{"column_name": col, "vocabulary": ""} for col in columns],
+        "assets": {"column_name": "zstore", "format": "zarr"},
+        "aggregation_control": {
+            "variable_column_name": "variable_id",
+            "groupby_attrs": groupby_attrs,
+            "aggregations": [
+                {"type": "union", "attribute_name": "variable_id"},
+                {
+                    "type": "join_new",
+                    "attribute_name": "member_id",
+                    "options": {"coords": "minimal", "compat": "override"},
+                },
+            ],
+        },
+    }
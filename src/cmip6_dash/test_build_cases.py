@@ -0,0 +1,444 @@
+import gc
+import os
+import shutil
+import weakref
+
+import netCDF4
+import numpy as np
+import pytest
+import xarray as xr
+
+from . import build_cases
+from .build_cases import main
+from .build_cases import plan_fetches
+from .build_cases import update_case
+from .case_utils import compute_aggregate
+from .case_utils import get_aggregate_period
+from .case_utils import get_case_data
+from .case_utils import get_case_file_path
+from .case_utils import get_point_series
+from .case_utils import HOVMOLLER_PRODUCTS
+from .case_utils import load_case_hovmoller
+from .case_utils import load_case_quantiles
+from .case_utils import open_case_aggregate
+from .case_utils import open_case_file
+from .case_utils import write_case_definition
+from .extremes_utils import compute_quantiles
+from .reduction_utils import spatial_mean
+from .synthetic_data import write_synthetic_catalog
+from .wrangling_utils import get_esm_datastore
+
+# A case of both calendars, 365_day CanESM5 and 360_day HadGEM3-GC31-MM
+BC_CASE_ARGS = ["bc_case", ["tas"], ["CanESM5", "HadGEM3-GC31-MM"], "historical", 2]
+BC_CASE_ARGS += ["1950-01", "1951-12", (60, -139.05), (49, -114.068333)]
+
+
+@pytest.fixture(scope="module")
+def synthetic_catalog(tmp_path_factory):
+    root_dir = str(tmp_path_factory.mktemp("synthetic_cmip6"))
+    return write_synthetic_catalog(
+        root_dir,
+        mod_id_list=["CanESM5", "HadGEM3-GC31-MM"],
+        var_id_list=["tas"],
+        members=2,
+    )
+
+
+@pytest.fixture(scope="module")
+def built_case(synthetic_catalog, tmp_path_factory):
+    # bc_case built once with its point series for the tests reading its products.
+    # Tests changing the folder work on a copy.
+    case_dir = tmp_path_factory.mktemp("built_cases")
+    case_definition = write_case_definition(*BC_CASE_ARGS, point_series=True)
+    get_case_data(get_esm_datastore(synthetic_catalog), case_definition, str(case_dir))
+    return str(case_dir / "bc_case")
+
+
+@pytest.fixture
+def case_dir(tmp_path):
+    # Two cases reading the same run over different regions, periods and members
+    for case_name, members, end_date, bottom_right in [
+        ("bc_case", 1, "1951-12", (49, -114.068333)),
+        ("bc_large_case", 2, "1952-06", (45, -110)),
+    ]:
+        write_case_definition(
+            case_name,
+            ["tas"],
+            ["CanESM5"],
+            "historical",
+            members,
+            "1950-01",
+            end_date,
+            (60, -139.05),
+            bottom_right,
+            write_path=str(tmp_path / f"{case_name}.json"),
+            baseline=("1950-01", "1950-12"),
+        )
+    return tmp_path
+
+
+def test_plan_shares_runs():
+    bc_region = (60, -139.05), (49, -114.068333)
+    case_definitions = [
+        write_case_definition(
+            "bc_case",
+            ["tas"],
+            ["CanESM5"],
+            "historical",
+            1,
+            "1950-01",
+            "1951-12",
+            *bc_region,
+        ),
+        write_case_definition(
+            "aus_case",
+            ["tas"],
+            ["CanESM5"],
+            "historical",
+            3,
+            "1951-01",
+            "1953-12",
+            (-10, 100),
+            (-40, 170),
+        ),
+        write_case_definition(
+            "bc_large_case",
+            ["tas"],
+            ["CanESM5"],
+            "historical",
+            2,
+            "1951-06",
+            "1952-06",
+            (60, -139.05),
+            (45, -110),
+        ),
+        # Its baseline is read with the case even though the periods are far apart
+        write_case_definition(
+            "bc_early_case",
+            ["tas"],
+            ["CanESM5"],
+            "historical",
+            1,
+            "1850-01",
+            "1850-12",
+            *bc_region,
+            baseline=("1900-01", "1900-12"),
+        ),
+    ]
+    plan = plan_fetches(case_definitions)
+    run = ("CanESM5", "tas", "historical")
+    assert list(plan) == [run + (0,), run + (1,), run + (2,)]
+    # The overlapping BC cases share a fetch over the bounding box of their regions
+    # in 0-360 longitudes and the period covering both
+    fetch = plan[run + (0,)]
+    assert fetch["cases"] == ["bc_case", "bc_large_case"]
+    assert fetch["members"] == 2
+    assert fetch["top_left"] == [60, pytest.approx(220.95)]
+    assert fetch["bottom_right"] == [45, 250]
+    assert (fetch["start_date"], fetch["end_date"]) == ("1950-01", "1952-06")
+    # Australia overlaps them in time only, the early case in space only
+    fetch = plan[run + (1,)]
+    assert fetch["cases"] == ["aus_case"]
+    assert (fetch["top_left"], fetch["bottom_right"]) == ([-10, 100], [-40, 170])
+    fetch = plan[run + (2,)]
+    assert fetch["cases"] == ["bc_early_case"]
+    assert (fetch["start_date"], fetch["end_date"]) == ("1850-01", "1900-12")
+
+
+def test_build_cases(synthetic_catalog, case_dir, tmp_path):
+    report = main([str(case_dir), "--catalog", synthetic_catalog, "--workers", "2"])
+    assert len(report["fetches"]) == 1
+    assert set(report["cases"]) == {"bc_case", "bc_large_case"}
+    # Built cases are skipped on the next run
+    assert main([str(case_dir), "--catalog", synthetic_catalog]) is None
+
+    # The same files as building the case on its own
+    data_store = get_esm_datastore(synthetic_catalog)
+    write_path = tmp_path / "alone"
+    os.makedirs(write_path)
+    case_definition = write_case_definition(
+        "bc_case",
+        ["tas"],
+        ["CanESM5"],
+        "historical",
+        1,
+        "1950-01",
+        "1951-12",
+        (60, -139.05),
+        (49, -114.068333),
+        baseline=("1950-01", "1950-12"),
+    )
+    get_case_data(data_store, case_definition, str(write_path))
+    for file_name in ["CanESM5_tas.nc", "CanESM5_tas_clim.nc"]:
+        with xr.open_dataset(case_dir / "bc_case" / file_name) as built:
+            with xr.open_dataset(write_path / "bc_case" / file_name) as alone:
+                assert built.identical(alone)
+
+
+def test_build_cases_across_meridian(synthetic_catalog, tmp_path):
+    # Regions either side of the Greenwich meridian, fetched one at a time
+    regions = {
+        "bc_case": ((60, -139.05), (49, -114.068333)),
+        "aus_case": ((-10, 100), (-40, 170)),
+    }
+    os.makedirs(tmp_path / "cases")
+    os.makedirs(tmp_path / "alone")
+    for case_name, region in regions.items():
+        write_case_definition(
+            case_name,
+            ["tas"],
+            ["CanESM5"],
+            "historical",
+            1,
+            "1950-01",
+            "1950-12",
+            *region,
+            write_path=str(tmp_path / "cases" / f"{case_name}.json"),
+        )
+    report = main([str(tmp_path / "cases"), "--catalog", synthetic_catalog])
+    assert len(report["fetches"]) == 2
+
+    data_store = get_esm_datastore(synthetic_catalog)
+    for case_name, region in regions.items():
+        case_definition = write_case_definition(
+            case_name,
+            ["tas"],
+            ["CanESM5"],
+            "historical",
+            1,
+            "1950-01",
+            "1950-12",
+            *region,
+        )
+        get_case_data(data_store, case_definition, str(tmp_path / "alone"))
+        file_name = os.path.join(case_name, "CanESM5_tas.nc")
+        with xr.open_dataset(tmp_path / "cases" / file_name) as built:
+            assert built.sizes["lon"] > 0
+            with xr.open_dataset(tmp_path / "alone" / file_name) as alone:
+                assert built.identical(alone)
+
+
+def test_build_cases_drops_fetches(synthetic_catalog, tmp_path, monkeypatch):
+    # Two cases far apart in time, each with a fetch of its own, built in turn
+    for case_name, start_date, end_date in [
+        ("early_case", "1950-01", "1950-12"),
+        ("late_case", "1954-01", "1954-12"),
+    ]:
+        write_case_definition(
+            case_name,
+            ["tas"],
+            ["CanESM5"],
+            "historical",
+            1,
+            start_date,
+            end_date,
+            (60, -139.05),
+            (49, -114.068333),
+            write_path=str(tmp_path / f"{case_name}.json"),
+        )
+    fetched_runs = {}
+    get_case_data = build_cases.get_case_data
+
+    def recording_get_case_data(data_store, case_definition, write_path, fetched):
+        if case_definition["case_name"] == "late_case":
+            gc.collect()
+            # The early fetch went once the early case was written
+            assert fetched_runs["early_case"]() is None
+        (dsets,) = fetched.values()
+        fetched_runs[case_definition["case_name"]] = weakref.ref(dsets[0])
+        return get_case_data(data_store, case_definition, write_path, fetched=fetched)
+
+    monkeypatch.setattr(build_cases, "get_case_data", recording_get_case_data)
+    report = main([str(tmp_path), "--catalog", synthetic_catalog, "--workers", "1"])
+    assert len(report["fetches"]) == 2
+    assert set(fetched_runs) == {"early_case", "late_case"}
+
+
+def test_build_cases_in_parallel(synthetic_catalog, tmp_path):
+    # Cases written by several build threads at once, each with its derived files
+    for num in range(6):
+        write_case_definition(
+            f"case_{num}",
+            ["tas"],
+            ["CanESM5"],
+            "historical",
+            2,
+            "1950-01",
+            "1951-12",
+            (60, -139.05),
+            (49 - num, -114.068333),
+            write_path=str(tmp_path / f"case_{num}.json"),
+            baseline=("1950-01", "1950-12"),
+            point_series=True,
+        )
+    report = main([str(tmp_path), "--catalog", synthetic_catalog, "--workers", "6"])
+    assert len(report["cases"]) == 6
+    for num in range(6):
+        file_path = tmp_path / f"case_{num}" / "CanESM5_tas.nc"
+        with open_case_file(file_path, "tas") as dset:
+            assert dset.sizes["member_num"] == 2
+
+
+def test_case_area_weights(synthetic_catalog, tmp_path):
+    # Case files keep the cell areas of the model, and reductions weight by them
+    data_store = get_esm_datastore(synthetic_catalog)
+    case_definition = write_case_definition(
+        "bc_case",
+        ["tas"],
+        ["CanESM5"],
+        "historical",
+        1,
+        "1950-01",
+        "1950-12",
+        (60, -139.05),
+        (49, -114.068333),
+    )
+    get_case_data(data_store, case_definition, str(tmp_path))
+    file_path = get_case_file_path(str(tmp_path / "bc_case"), "CanESM5", "tas")
+    with open_case_file(file_path, "tas") as dset:
+        areacella = dset["areacella"].transpose("lat", "lon").values
+        values = dset["tas"].isel(member_num=0).transpose("time", "lat", "lon")
+        expected = (values * areacella).sum(("lat", "lon")) / areacella.sum()
+        np.testing.assert_allclose(spatial_mean(values).values, expected.values)
+        # Changed areas change the mean, so they are what is weighted by
+        areacella[0] *= 2
+        reweighted = spatial_mean(
+            values.assign_coords(areacella=(("lat", "lon"), areacella))
+        )
+        expected = (values * areacella).sum(("lat", "lon")) / areacella.sum()
+        np.testing.assert_allclose(reweighted.values, expected.values)
+
+
+def test_update_case(synthetic_catalog, tmp_path):
+    data_store = get_esm_datastore(synthetic_catalog)
+    case_args = ["bc_case", ["tas"], ["CanESM5"], "historical"]
+    region = [(60, -139.05), (49, -114.068333)]
+    baseline = ("1950-01", "1950-12")
+    case_definition = write_case_definition(
+        *case_args, 1, "1950-01", "1951-12", *region, baseline=baseline
+    )
+    get_case_data(data_store, case_definition, str(tmp_path / "updated"))
+
+    # Later start, later end and another member
+    edited = write_case_definition(
+        *case_args, 2, "1950-07", "1952-06", *region, baseline=baseline
+    )
+    changes = update_case(data_store, edited, str(tmp_path / "updated"))
+    # Including the means, aggregates and quantiles rewritten from the case file
+    assert len(changes) == 7
+    assert update_case(data_store, edited, str(tmp_path / "updated")) == []
+
+    get_case_data(data_store, edited, str(tmp_path / "fresh"))
+    file_names = ["CanESM5_tas.nc", "CanESM5_tas_clim.nc", "CanESM5_tas_zonal_mean.nc"]
+    file_names.append("CanESM5_tas_season.nc")
+    for file_name in file_names:
+        with open_case_file(tmp_path / "updated" / "bc_case" / file_name, "tas") as a:
+            with open_case_file(tmp_path / "fresh" / "bc_case" / file_name, "tas") as b:
+                xr.testing.assert_allclose(a, b)
+
+
+def test_point_series(synthetic_catalog, built_case, tmp_path):
+    series_path = get_case_file_path(built_case, "CanESM5", "tas", "series")
+    # One chunk per grid cell holding every member and month
+    with netCDF4.Dataset(series_path) as series_file:
+        assert series_file["tas"].chunking() == [2, 24, 1, 1]
+
+    series = get_point_series(built_case, "CanESM5", "tas", 55, -125)
+    assert series["tas"].dims == ("member_num", "time")
+    with open_case_file(
+        get_case_file_path(built_case, "CanESM5", "tas"), "tas"
+    ) as dset:
+        expected = dset["tas"].sel(lat=55, lon=235, method="nearest")
+        xr.testing.assert_allclose(series["tas"], expected)
+
+    # Dropped from the folder with point_series
+    shutil.copytree(built_case, tmp_path / "bc_case")
+    edited = write_case_definition(*BC_CASE_ARGS)
+    changes = update_case(get_esm_datastore(synthetic_catalog), edited, str(tmp_path))
+    assert changes == [
+        "CanESM5 tas: point series removed",
+        "HadGEM3-GC31-MM tas: point series removed",
+    ]
+    assert not os.path.isfile(
+        get_case_file_path(str(tmp_path / "bc_case"), "CanESM5", "tas", "series")
+    )
+
+
+def test_hovmoller_means(built_case, tmp_path):
+    zonal = load_case_hovmoller(built_case, "CanESM5", "tas", "lat")
+    assert zonal["tas"].dims == ("member_num", "time", "lat")
+    meridional = load_case_hovmoller(built_case, "CanESM5", "tas", "lon")
+    assert meridional["tas"].dims == ("member_num", "time", "lon")
+
+    # Computed from the case file for cases built without them
+    case_folder = str(shutil.copytree(built_case, tmp_path / "bc_case"))
+    for product in HOVMOLLER_PRODUCTS.values():
+        os.remove(get_case_file_path(case_folder, "CanESM5", "tas", product))
+    computed = load_case_hovmoller(case_folder, "CanESM5", "tas", "lat")
+    xr.testing.assert_allclose(computed["tas"], zonal["tas"])
+
+
+@pytest.mark.parametrize("mod_id", ["CanESM5", "HadGEM3-GC31-MM"])
+def test_aggregates(built_case, mod_id):
+    assert get_aggregate_period("1952/01", "season") == ("1951-12", "1952-02")
+    assert get_aggregate_period("1952-12", "season") == ("1952-12", "1953-02")
+    assert get_aggregate_period("1952-07", "annual") == ("1952-01", "1952-12")
+    assert get_aggregate_period("1952/7", "monthly") == ("1952-07", "1952-07")
+    for date in ["1952-0", "1952-13", "1952"]:
+        with pytest.raises(ValueError):
+            get_aggregate_period(date, "monthly")
+
+    file_path = get_case_file_path(built_case, mod_id, "tas")
+    with open_case_file(file_path, "tas") as dset:
+        # The first and last DJF are only partly covered
+        season = compute_aggregate(dset, "tas", "season").load()
+        assert season["time"].dt.strftime("%Y-%m").values.tolist() == [
+            "1950-03",
+            "1950-06",
+            "1950-09",
+            "1950-12",
+            "1951-03",
+            "1951-06",
+            "1951-09",
+        ]
+        months = dset["tas"].sel(time=slice("1950-12", "1951-02"))
+        days = months["time"].dt.days_in_month
+        if mod_id == "HadGEM3-GC31-MM":
+            # Every month of a 360_day calendar weighs the same
+            assert days.values.tolist() == [30, 30, 30]
+        else:
+            assert days.values.tolist() == [31, 31, 28]
+        expected = (months * days).sum("time") / days.sum()
+        xr.testing.assert_allclose(
+            season["tas"].isel(time=3, drop=True), expected, check_dim_order=False
+        )
+        annual = compute_aggregate(dset, "tas", "annual")
+        assert annual.sizes["time"] == 2
+
+    written = open_case_aggregate(built_case, mod_id, "tas", "season")
+    xr.testing.assert_allclose(written["tas"], season["tas"])
+
+
+def test_case_quantiles(synthetic_catalog, tmp_path):
+    data_store = get_esm_datastore(synthetic_catalog)
+    case_args = ["bc_case", ["tas"], ["CanESM5"], "historical", 2]
+    case_args += ["1950-01", "1951-12", (60, -139.05), (49, -114.068333)]
+    case_definition = write_case_definition(*case_args, quantiles=[0.99, 0.5])
+    get_case_data(data_store, case_definition, str(tmp_path))
+    case_folder = str(tmp_path / "bc_case")
+    written = load_case_quantiles(case_folder, "CanESM5", "tas", [0.99])
+    assert written["tas"].dims == ("quantile", "lat", "lon")
+
+    # Quantiles not written with the case are computed from the case file
+    with open_case_file(
+        get_case_file_path(case_folder, "CanESM5", "tas"), "tas"
+    ) as dset:
+        expected = compute_quantiles(dset, "tas", [0.25, 0.99]).load()
+    computed = load_case_quantiles(case_folder, "CanESM5", "tas", [0.25, 0.99])
+    xr.testing.assert_allclose(computed, expected)
+    xr.testing.assert_allclose(computed.sel(quantile=[0.99]), written, rtol=1e-6)
+
+    # Rewritten when the definition lists others
+    edited = write_case_definition(*case_args, quantiles=[0.25, 0.99])
+    changes = update_case(data_store, edited, str(tmp_path))
+    assert changes == ["CanESM5 tas: quantiles written"]
@@ -0,0 +1,132 @@
+import os
+
+from . import case_registry
+from .build_cases import main
+from .case_registry import get_case_index
+from .case_registry import get_case_opts
+from .case_registry import get_case_signature
+from .case_registry import is_date_in_case
+from .case_utils import write_case_definition
+from .synthetic_data import write_synthetic_catalog
+
+
+def test_case_index_reloads(tmp_path):
+    catalog = write_synthetic_catalog(
+        str(tmp_path / "synthetic_cmip6"),
+        mod_id_list=["CanESM5"],
+        var_id_list=["tas"],
+        members=2,
+    )
+    case_dir = tmp_path / "cases"
+    os.makedirs(case_dir)
+    case_args = ["tas"], ["CanESM5"], "historical", 2, "1950-01", "1951-12"
+    region = (60, -139.05), (49, -114.068333)
+    write_case_definition(
+        "bc_case", *case_args, *region, write_path=str(case_dir / "bc_case.json")
+    )
+
+    # Defined but not built yet
+    index = get_case_index(str(case_dir), max_age=0)
+    assert not index["bc_case.json"]["built"]
+    assert not is_date_in_case(str(case_dir), "bc_case.json", "1950/06")
+
+    main([str(case_dir), "--catalog", catalog])
+    entry = get_case_index(str(case_dir), max_age=0)["bc_case.json"]
+    assert entry["built"]
+    assert entry["members"] == 2
+    assert entry["time_range"] == ("1950-01", "1951-12")
+    file_info = entry["files"][("CanESM5", "tas")]
+    assert file_info["time_steps"] == 24
+    assert file_info["bytes"] == os.path.getsize(file_info["path"])
+    assert is_date_in_case(str(case_dir), "bc_case.json", "1950/06", "CanESM5", "tas")
+    assert not is_date_in_case(str(case_dir), "bc_case.json", "1952/01")
+    # The first DJF is only partly on disk
+    assert not is_date_in_case(
+        str(case_dir), "bc_case.json", "1950/01", resolution="season"
+    )
+    assert is_date_in_case(
+        str(case_dir), "bc_case.json", "1951/01", resolution="season"
+    )
+
+    # Unchanged cases are not indexed again
+    assert get_case_index(str(case_dir), max_age=0)["bc_case.json"] is entry
+    signature = get_case_signature(str(case_dir), "bc_case.json")
+    assert get_case_signature(str(case_dir), "bc_case.json") == signature
+
+    # Rewritten files change the signature
+    os.utime(file_info["path"], (0, 0))
+    get_case_index(str(case_dir), max_age=0)
+    assert get_case_signature(str(case_dir), "bc_case.json") != signature
+
+    # Added and removed cases show up once the folder is checked again
+    write_case_definition(
+        "other_case", *case_args, *region, write_path=str(case_dir / "other.json")
+    )
+    assert len(get_case_opts(str(case_dir))) == 2
+    assert len(get_case_index(str(case_dir), max_age=0)) == 2
+    os.remove(case_dir / "bc_case.json")
+    assert list(get_case_index(str(case_dir), max_age=0)) == ["other.json"]
+
+
+def test_case_indexed_without_lock(tmp_path, monkeypatch):
+    case_dir = tmp_path / "cases"
+    os.makedirs(case_dir)
+    write_case_definition(
+        "bc_case",
+        ["tas"],
+        ["CanESM5"],
+        "historical",
+        1,
+        "1950-01",
+        "1951-12",
+        (60, -139.05),
+        (49, -114.068333),
+        write_path=str(case_dir / "bc_case.json"),
+    )
+    index_case = case_registry.index_case
+    locked = []
+
+    def checked_index_case(case_dir, json_name):
+        # Other threads can read the index while a case's files are opened
+        locked.append(case_registry._case_index_lock.locked())
+        return index_case(case_dir, json_name)
+
+    monkeypatch.setattr(case_registry, "index_case", checked_index_case)
+    assert not get_case_index(str(case_dir), max_age=0)["bc_case.json"]["built"]
+    assert locked == [False]
+
+
+def test_pi_control_dates(tmp_path):
+    catalog = write_synthetic_catalog(
+        str(tmp_path / "synthetic_cmip6"),
+        mod_id_list=["CanESM5"],
+        var_id_list=["tas"],
+        exp_id_list=["piControl"],
+        members=1,
+    )
+    case_dir = tmp_path / "cases"
+    os.makedirs(case_dir)
+    write_case_definition(
+        "bc_pi",
+        ["tas"],
+        ["CanESM5"],
+        "piControl",
+        1,
+        "1950-01",
+        "1951-12",
+        (60, -139.05),
+        (49, -114.068333),
+        write_path=str(case_dir / "bc_pi.json"),
+    )
+    main([str(case_dir), "--catalog", catalog])
+    entry = get_case_index(str(case_dir), max_age=0)["bc_pi.json"]
+    assert entry["time_range"] == ("6000-01", "6001-12")
+
+    # The date from the definition is not on disk, but its month is
+    assert not is_date_in_case(str(case_dir), "bc_pi.json", "1950/06")
+    assert is_date_in_case(str(case_dir), "bc_pi.json", "1950/06", ignore_year=True)
+    assert not is_date_in_case(str(case_dir), "bc_pi.json", "1950/13", ignore_year=True)
+    # The DJF starting in the last December is not
+    assert not is_date_in_case(
+        str(case_dir), "bc_pi.json", "1950/12", resolution="season", ignore_year=True
+    )
@@ -1,10 +1,19 @@
 import json
+import os
 
+import numpy as np
+import pandas as pd
 import pytest
 import xarray as xr
 
+from .case_utils import CaseFileCache
+from .case_utils import compute_climatology
+from .case_utils import get_anomaly
 from .case_utils import get_case_data
+from .case_utils import join_members
+from .case_utils import open_case_file
 from .case_utils import write_case_definition
+from .case_utils import write_case_file
 from .wrangling_utils import get_esm_datastore
 
 
@@ -30,6 +39,27 @@ def bc_tas_double_json():
     return data
 
 
+@pytest.fixture
+def seasonal_tas():
+    """Two members over three years where tas is the month number plus the year
+    offset plus the member number"""
+    times = pd.date_range("1850-01-01", periods=36, freq="MS") + pd.Timedelta("15D")
+    values = times.month.values + (times.year.values - 1850)
+    dsets = [
+        xr.Dataset(
+            {
+                "tas": (
+                    ("time", "lat", "lon"),
+                    np.broadcast_to(values[:, None, None] + num, (36, 2, 2)).copy(),
+                )
+            },
+            coords={"time": times, "lat": [50.0, 55.0], "lon": [230.0, 235.0]},
+        )
+        for num in range(2)
+    ]
+    return join_members(dsets)
+
+
 @pytest.fixture
 def bc_tas_def_fresh():
     bc_tas_case_def = write_case_definition(
@@ -81,3 +111,73 @@ def test_doble_case_def(bc_tas_double_json, bc_tas_lai_2mod_def):
     # Checking that they have the same keys
     # Would be lovely to do more validation here time permitting
     assert bc_tas_double_json.keys() == bc_tas_lai_2mod_def.keys()
+
+
+def test_climatology_and_anomaly(seasonal_tas):
+    clim = compute_climatology(seasonal_tas, "tas", "1850-01", "1851-12")
+    assert clim["tas"].sizes["month"] == 12
+    # Baseline mean of the year offsets 0 and 1 is 0.5
+    assert np.allclose(clim["tas"].sel(member_num=1, month=3), 4.5)
+
+    anom = get_anomaly(seasonal_tas, "tas", clim)
+    assert np.allclose(anom["tas"].sel(time="1852").values, 1.5)
+    # Single member data is compared with the ensemble mean climatology
+    anom_single = get_anomaly(seasonal_tas.sel(member_num=0), "tas", clim)
+    assert np.allclose(anom_single["tas"].sel(time="1852").values, 1.0)
+
+
+def test_case_def_baseline():
+    case_def = write_case_definition(
+        "aus_tas_case",
+        ["tas"],
+        ["CanESM5"],
+        "ssp585",
+        3,
+        "2025-01",
+        "2050-02",
+        (-10, 100),
+        (-40, 170),
+        baseline=("1850-01", "1900-12"),
+    )
+    assert case_def["baseline_exp_id"] == "historical"
+
+
+@pytest.mark.parametrize("encoding", ["none", "float32_zlib", "int16_zlib"])
+def test_case_file_encodings(seasonal_tas, tmp_path, encoding):
+    dset = seasonal_tas.astype("float64")
+    file_path = str(tmp_path / "seasonal_tas.nc")
+    write_case_file(dset, "tas", file_path, encoding)
+    with open_case_file(file_path, "tas") as read_dset:
+        # The values range from 1 to 15, so int16 packing is good to well below 1e-3
+        assert np.allclose(read_dset["tas"], dset["tas"], atol=1e-3)
+    with pytest.raises(KeyError):
+        write_case_file(dset, "tas", file_path, "float16")
+
+
+def test_case_file_cache(tmp_path):
+    cache = CaseFileCache("test", 2)
+    paths = [tmp_path / f"{name}.nc" for name in "abc"]
+    for file_path in paths:
+        file_path.write_text("")
+    loads = []
+
+    def load(value):
+        loads.append(value)
+        return value
+
+    assert cache.get(paths[0], (1,), lambda: load("a1")) == "a1"
+    assert cache.get(paths[0], (1,), lambda: load("again")) == "a1"
+    assert cache.get(paths[1], (), lambda: load("b")) == "b"
+    # The least recently used entry, b, is dropped
+    cache.get(paths[0], (1,), lambda: load("again"))
+    cache.get(paths[2], (), lambda: load("c"))
+    assert len(cache) == 2
+    assert cache.get(paths[1], (), lambda: load("b2")) == "b2"
+
+    # Rewriting a file drops the entries of its older version
+    cache.get(paths[0], (1,), lambda: load("a1"))
+    os.utime(paths[0], (0, 0))
+    assert cache.get(paths[0], (2,), lambda: load("a2")) == "a2"
+    assert len(cache) == 2
+    assert cache.get(paths[1], (), lambda: load("again")) == "b2"
+    assert loads == ["a1", "b", "c", "b2", "a1", "a2"]
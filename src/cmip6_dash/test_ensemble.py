@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from .case_utils import join_members
+from .ensemble_utils import ensemble_stat
+from .ensemble_utils import get_member_opts
+from .ensemble_utils import select_member
+
+
+@pytest.fixture
+def member_dset():
+    """Three member dataset where member n is filled with the value n"""
+    times = pd.date_range("1950-01-16", periods=4, freq="MS") + pd.Timedelta("15D")
+    coords = {"time": times, "lat": [50.0, 55.0], "lon": [230.0, 235.0, 240.0]}
+    dsets = [
+        xr.Dataset(
+            {"tas": (("time", "lat", "lon"), np.full((4, 2, 3), float(num)))},
+            coords=coords,
+        )
+        for num in range(3)
+    ]
+    return join_members(dsets)
+
+
+def test_ensemble_mean_and_spread(member_dset):
+    mean = ensemble_stat(member_dset, "tas", "mean")
+    spread = ensemble_stat(member_dset, "tas", "spread")
+    # Should still be lazy until asked for values
+    assert mean["tas"].chunks is not None
+    assert "member_num" not in mean.dims
+    assert np.allclose(mean["tas"].values, 1.0)
+    assert np.allclose(spread["tas"].values, 2.0)
+
+
+def test_ensemble_percentile(member_dset):
+    p90 = ensemble_stat(member_dset, "tas", "p90")
+    assert np.allclose(p90["tas"].values, 1.8)
+
+
+def test_select_member(member_dset):
+    assert np.allclose(select_member(member_dset, "tas", "2")["tas"].values, 2.0)
+    single = member_dset.sel(member_num=0)
+    assert select_member(single, "tas", "mean") is single
+
+
+def test_member_opts():
+    values = [opt["value"] for opt in get_member_opts(2)]
+    assert values[:2] == ["0", "1"]
+    assert "mean" in values and "p10" in values
@@ -0,0 +1,133 @@
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from .export_utils import acquire_export_slot
+from .export_utils import ExportStream
+from .export_utils import get_export_config
+from .export_utils import parse_export_args
+from .export_utils import release_export_slot
+from .export_utils import select_subset
+from .export_utils import stream_export
+
+
+@pytest.fixture
+def case_dset():
+    """Two members of random values over two years on a 0-360 grid"""
+    times = pd.date_range("1950-01-01", periods=24, freq="MS") + pd.Timedelta("15D")
+    values = np.random.default_rng(0).normal(size=(2, 24, 4, 3)).astype("float32")
+    return xr.Dataset(
+        {"tas": (("member_num", "time", "lat", "lon"), values)},
+        coords={
+            "member_num": [0, 1],
+            "time": times,
+            "lat": [45.0, 50.0, 55.0, 60.0],
+            "lon": [230.0, 235.0, 240.0],
+        },
+    )
+
+
+@pytest.fixture
+def subset(case_dset):
+    args = parse_export_args(
+        {
+            "case": "case.json",
+            "model": "CESM2",
+            "var": "tas",
+            "start": "1950-3",
+            "end": "1951-02",
+            "lat_min": "48",
+            "lat_max": "56",
+            "lon_min": "-126",
+            "members": "1",
+        }
+    )
+    return select_subset(case_dset, "tas", **args)
+
+
+def test_select_subset(subset, case_dset):
+    assert dict(subset.sizes) == {"member_num": 1, "time": 12, "lat": 2, "lon": 2}
+    assert subset["lon"].values.tolist() == [235.0, 240.0]
+    expected = case_dset["tas"].isel(member_num=[1], time=slice(2, 14))
+    np.testing.assert_array_equal(
+        subset["tas"].values, expected.isel(lat=[1, 2], lon=[1, 2]).values
+    )
+    with pytest.raises(ValueError):
+        select_subset(case_dset, "tas", members=[1, 2])
+
+
+def test_parse_export_args():
+    args = parse_export_args({"case": "c", "model": "m", "var": "v"})
+    assert args["format"] == "netcdf"
+    assert args["members"] is None
+    for bad_args in [
+        {"case": "c", "model": "m"},
+        {"case": "c", "model": "m", "var": "v", "format": "xlsx"},
+        {"case": "c", "model": "m", "var": "v", "start": "1950"},
+        {"case": "c", "model": "m", "var": "v", "end": "1951-13"},
+        {"case": "c", "model": "m", "var": "v", "lat_min": "north"},
+    ]:
+        with pytest.raises(ValueError):
+            parse_export_args(bad_args)
+
+
+@pytest.mark.parametrize("export_format", ["csv", "netcdf", "zarr"])
+def test_stream_export(subset, export_format, tmp_path):
+    config = dict(get_export_config(), time_chunk=5, tmp_dir=str(tmp_path))
+    pieces = list(stream_export(subset, "tas", export_format, config))
+    data = b"".join(pieces)
+    if export_format == "csv":
+        # The header and one piece per 5 time steps
+        assert len(pieces) == 4
+        frame = pd.read_csv(io.BytesIO(data))
+        assert frame.columns.tolist() == ["member_num", "time", "lat", "lon", "tas"]
+        np.testing.assert_allclose(
+            frame["tas"].values, subset["tas"].values.ravel(), rtol=1e-6
+        )
+        return
+    file_path = tmp_path / f"export.{export_format}"
+    file_path.write_bytes(data)
+    if export_format == "netcdf":
+        result = xr.open_dataset(file_path)
+    else:
+        assert zipfile.ZipFile(file_path).testzip() is None
+        zarr = pytest.importorskip("zarr")
+        result = xr.open_zarr(zarr.storage.ZipStore(file_path, mode="r"))
+    xr.testing.assert_equal(result["tas"].load(), subset["tas"])
+    # Only the staged export was written to tmp_dir, and it is gone
+    assert sorted(path.name for path in tmp_path.iterdir()) == [file_path.name]
+
+
+def test_export_slots():
+    slots = get_export_config()["max_exports"]
+    for _ in range(slots):
+        assert acquire_export_slot(wait=0)
+    assert not acquire_export_slot(wait=0)
+    for _ in range(slots):
+        release_export_slot()
+    assert acquire_export_slot(wait=0)
+    release_export_slot()
+
+
+def test_export_stream_releases_slot(subset):
+    def export_response():
+        # As the app's export route does
+        assert acquire_export_slot(wait=0)
+        return Response(ExportStream(subset, "tas", "csv"), mimetype="text/csv")
+
+    # A HEAD request never reads the body, nor does a client leaving at once
+    response = Client(export_response()).head("/")
+    response.close()
+    Client(export_response()).get("/").close()
+
+    response = Client(export_response()).get("/")
+    assert response.get_data().startswith(b"member_num,time,lat,lon,tas")
+    response.close()
+    assert acquire_export_slot(wait=0)
+    release_export_slot()
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+
+from .extremes_utils import compute_quantiles
+from .extremes_utils import get_quantile_label
+from .extremes_utils import validate_quantiles
+
+
+@pytest.fixture
+def member_dset():
+    """Two members of random values over a year, with one cell missing throughout"""
+    times = pd.date_range("1950-01-01", periods=12, freq="MS") + pd.Timedelta("15D")
+    values = np.random.default_rng(0).normal(size=(2, 12, 4, 3))
+    values[:, :, 0, 0] = np.nan
+    values[0, 3, 1, 1] = np.nan
+    return xr.Dataset(
+        {"tas": (("member_num", "time", "lat", "lon"), values)},
+        coords={
+            "member_num": [0, 1],
+            "time": times,
+            "lat": [45.0, 50.0, 55.0, 60.0],
+            "lon": [230.0, 235.0, 240.0],
+        },
+    )
+
+
+def test_quantiles_match_numpy(member_dset):
+    # Small enough blocks to hold one latitude row each
+    result = compute_quantiles(member_dset, "tas", [0.95, 0.05], block_bytes=1)
+    assert result["tas"].chunks[1] == (1, 1, 1, 1)
+    assert result["tas"].dims == ("quantile", "lat", "lon")
+    assert result["quantile"].values.tolist() == [0.05, 0.95]
+    samples = member_dset["tas"].values.reshape(24, 4, 3)
+    with np.errstate(invalid="ignore"):
+        expected = np.nanquantile(samples, [0.05, 0.95], axis=0)
+    np.testing.assert_allclose(result["tas"].values, expected)
+    assert result["tas"].attrs["quantile_period"] == "1950-01/1950-12"
+
+
+def test_quantile_labels():
+    assert validate_quantiles([0.99, 0.5]) == [0.5, 0.99]
+    with pytest.raises(AssertionError):
+        validate_quantiles([95])
+    labels = [get_quantile_label(q) for q in [0.01, 0.02, 0.03, 0.11, 0.125, 0.95]]
+    assert labels == [
+        "1st Percentile",
+        "2nd Percentile",
+        "3rd Percentile",
+        "11th Percentile",
+        "12.5th Percentile",
+        "95th Percentile",
+    ]
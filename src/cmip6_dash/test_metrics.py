@@ -0,0 +1,66 @@
+import json
+import logging
+from functools import lru_cache
+
+import pytest
+
+from . import metrics_utils
+from .metrics_utils import get_metrics_text
+from .metrics_utils import record_bytes
+from .metrics_utils import record_cache
+from .metrics_utils import register_lru_cache
+from .metrics_utils import span
+from .metrics_utils import timed
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics_utils.reset_metrics()
+    yield
+    metrics_utils.reset_metrics()
+    metrics_utils._lru_caches.clear()
+
+
+def test_spans_in_prometheus_format():
+    @timed("add")
+    def add(a, b):
+        return a + b
+
+    assert add(1, 2) == 3
+    with span("add"):
+        pass
+    text = get_metrics_text()
+    assert "# TYPE cmip6_dash_span_seconds histogram" in text
+    assert 'cmip6_dash_span_seconds_bucket{span="add",le="+Inf"} 2' in text
+    assert 'cmip6_dash_span_seconds_count{span="add"} 2' in text
+
+
+def test_cache_and_bytes_counters():
+    record_cache("climatology", False)
+    record_cache("climatology", True)
+    record_cache("climatology", True)
+    record_bytes("storage", 100)
+    record_bytes("storage", 28)
+
+    @lru_cache(maxsize=2)
+    def square(x):
+        return x**2
+
+    register_lru_cache("square", square)
+    square(2), square(2), square(3)
+
+    text = get_metrics_text()
+    assert 'cmip6_dash_cache_requests_total{cache="climatology",result="hit"} 2' in text
+    assert 'cmip6_dash_cache_requests_total{cache="square",result="miss"} 2' in text
+    assert 'cmip6_dash_bytes_read_total{source="storage"} 128' in text
+
+
+def test_structured_log(monkeypatch, caplog):
+    monkeypatch.setenv(metrics_utils.METRICS_LOG_ENV, "1")
+    with caplog.at_level(logging.INFO, logger=metrics_utils.__name__):
+        with span("zarr_open", zstore="gs://cmip6/store"):
+            pass
+    event = json.loads(caplog.records[-1].message)
+    assert event["event"] == "span"
+    assert event["span"] == "zarr_open"
+    assert event["zstore"] == "gs://cmip6/store"
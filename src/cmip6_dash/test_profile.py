@@ -0,0 +1,42 @@
+import os
+
+from .profile_utils import finish_profile
+from .profile_utils import list_profiles
+from .profile_utils import load_profile
+from .profile_utils import should_profile
+from .profile_utils import start_profile
+
+
+def test_should_profile(monkeypatch):
+    monkeypatch.delenv("CMIP6_PROFILE", raising=False)
+    assert not should_profile(flagged=True)
+    monkeypatch.setenv("CMIP6_PROFILE", "1")
+    monkeypatch.setenv("CMIP6_PROFILE_SAMPLE", "0")
+    assert should_profile(flagged=True)
+    assert not should_profile(flagged=False)
+    monkeypatch.setenv("CMIP6_PROFILE_SAMPLE", "1")
+    assert should_profile(flagged=False)
+
+
+def test_profile_written_with_inputs(tmp_path):
+    handle = start_profile()
+    # Only one profile at a time per process
+    assert start_profile() is None
+    sorted([str(num) for num in range(10000)])
+    inputs = [{"id": "var_drop", "property": "value", "value": "tas"}]
+    profile_id = finish_profile(handle, "histogram.figure", inputs, str(tmp_path))
+
+    profile = load_profile(profile_id, str(tmp_path))
+    assert profile["inputs"] == inputs
+    assert "cumulative" in profile["cumulative_stats"]
+    assert os.path.isfile(tmp_path / f"{profile_id}.prof")
+    assert list_profiles(str(tmp_path))[0]["id"] == profile_id
+
+
+def test_old_profiles_pruned(tmp_path):
+    for _ in range(3):
+        finish_profile(
+            start_profile(), "histogram.figure", profile_dir=str(tmp_path), keep=2
+        )
+    assert len(list_profiles(str(tmp_path))) == 2
+    assert len(os.listdir(tmp_path)) == 4
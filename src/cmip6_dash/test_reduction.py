@@ -0,0 +1,76 @@
+import cftime
+import numpy as np
+import pytest
+import xarray as xr
+
+from .reduction_utils import get_grid_weights
+from .reduction_utils import linear_trend
+from .reduction_utils import meridional_mean
+from .reduction_utils import spatial_mean
+from .reduction_utils import spatial_std
+from .reduction_utils import weighted_mean
+from .reduction_utils import zonal_mean
+
+
+@pytest.fixture
+def lat_field():
+    """Field equal to its latitude with a missing value in one corner"""
+    lats = np.array([0.0, 60.0])
+    values = np.repeat(lats[:, None], 3, axis=1)
+    values[0, 0] = np.nan
+    return xr.DataArray(
+        np.stack([values, values + 1]),
+        coords={"time": [0, 1], "lat": lats, "lon": [0.0, 1.0, 2.0]},
+        dims=("time", "lat", "lon"),
+    )
+
+
+def test_cos_lat_weighting(lat_field):
+    # Two equator cells with weight 1 and three 60N cells with weight 0.5
+    expected = (3 * 0.5 * 60) / (2 + 3 * 0.5)
+    mean = spatial_mean(lat_field)
+    assert np.allclose(mean.values, [expected, expected + 1])
+    assert np.allclose(spatial_mean(lat_field.chunk({"time": 1})).values, mean.values)
+
+
+def test_areacella_and_mask(lat_field):
+    area = xr.DataArray(np.ones((2, 3)), dims=("lat", "lon"))
+    assert np.allclose(spatial_mean(lat_field.assign_coords(areacella=area))[0], 36)
+    mask = np.array([[True] * 3, [False] * 3])
+    assert np.allclose(spatial_mean(lat_field, mask=mask)[0], 0)
+    assert np.allclose(spatial_std(lat_field, mask=mask)[0], 0)
+
+
+def test_grid_weights_cached(lat_field):
+    first = get_grid_weights(lat_field["lat"].values, lat_field["lon"].values)
+    second = get_grid_weights(lat_field["lat"].values, lat_field["lon"].values)
+    assert first is second
+    assert np.isnan(weighted_mean(np.array([np.nan]), np.array([1.0])))
+
+
+def test_zonal_and_meridional_means(lat_field):
+    assert np.allclose(zonal_mean(lat_field)[0], [0, 60])
+    # The equator cell with weight 1 and the 60N cell with weight 0.5, except for
+    # the first longitude where the equator is missing
+    meridional = meridional_mean(lat_field.chunk({"time": 1}))
+    assert meridional.dims == ("time", "lon")
+    assert np.allclose(meridional[0], [60, 20, 20])
+
+
+def test_linear_trend():
+    # 0.5 per year with a seasonal cycle, over 2.5 years so the cycle is not whole
+    months = np.arange(30)
+    times = [
+        cftime.DatetimeNoLeap(2000 + num // 12, num % 12 + 1, 15) for num in months
+    ]
+    values = 0.5 * months / 12 + 10 * np.sin(2 * np.pi * months / 12)
+    data = xr.DataArray(
+        np.stack([values, values * 0 + 1, values * np.nan], axis=-1),
+        coords={"time": times, "lon": [0.0, 1.0, 2.0]},
+        dims=("time", "lon"),
+    )
+    data[4, 0] = np.nan
+    trend = linear_trend(data.chunk({"time": 12}))
+    assert trend.dims == ("lon",)
+    assert np.allclose(trend.values[:2], [0.5, 0])
+    assert np.isnan(trend.values[2])
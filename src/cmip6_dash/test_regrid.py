@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from . import regrid_utils
+from .regrid_utils import align_datasets
+from .regrid_utils import get_common_grid
+from .regrid_utils import get_regrid_weights
+from .regrid_utils import make_target_grid
+from .regrid_utils import regrid
+
+
+@pytest.fixture
+def linear_field():
+    """Field on a 2 degree grid that is linear in lat and lon"""
+    lats = np.arange(41.0, 61.0, 2.0)
+    lons = np.arange(221.0, 251.0, 2.0)
+    values = lats[:, None] + 2 * lons[None, :]
+    return xr.DataArray(
+        values, coords={"lat": lats, "lon": lons}, dims=("lat", "lon"), name="tas"
+    )
+
+
+def test_bilinear_exact_for_linear_field(linear_field, tmp_path):
+    target = xr.Dataset(coords={"lat": [44.5, 50.0], "lon": [230.25, 240.0]})
+    out = regrid(linear_field, target, "bilinear", cache_dir=str(tmp_path))
+    expected = target["lat"].values[:, None] + 2 * target["lon"].values[None, :]
+    assert np.allclose(out.values, expected)
+
+
+def test_conservative_keeps_constant_and_masks_nans(linear_field, tmp_path):
+    field = xr.full_like(linear_field, 3.0)
+    field[:2, :] = np.nan
+    target = make_target_grid(4, 4, lat_range=(40, 60), lon_range=(220, 250))
+    out = regrid(field, target, "conservative", cache_dir=str(tmp_path))
+    assert np.allclose(out.values[1:], 3.0)
+    assert np.isnan(out.values[0]).all()
+
+
+def test_weights_cached_on_disk(linear_field, tmp_path):
+    grid = get_common_grid([linear_field, linear_field.isel(lat=slice(0, 5))])
+    args = (linear_field["lat"], linear_field["lon"], grid["lat"], grid["lon"])
+    weights = get_regrid_weights(*args, "bilinear", cache_dir=str(tmp_path))
+    assert len(os.listdir(tmp_path)) == 1
+
+    regrid_utils._weights_cache.clear()
+    reloaded = get_regrid_weights(*args, "bilinear", cache_dir=str(tmp_path))
+    assert (weights != reloaded).nnz == 0
+
+
+def test_align_datasets_chunked_on_time(linear_field, tmp_path):
+    series = xr.concat([linear_field] * 24, dim="time").assign_coords(
+        time=np.arange(24)
+    )
+    coarse = series.isel(lat=slice(None, None, 2), lon=slice(None, None, 2))
+    aligned = align_datasets(
+        [series.to_dataset(), coarse.to_dataset()],
+        "tas",
+        method="bilinear",
+        cache_dir=str(tmp_path),
+    )
+    assert aligned[0]["tas"].chunks[0] == (12, 12)
+    assert aligned[0]["tas"].shape == aligned[1]["tas"].shape
+    diff = (aligned[0]["tas"] - aligned[1]["tas"]).isel(time=3).values
+    assert np.allclose(diff, 0)
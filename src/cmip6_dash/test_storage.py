@@ -0,0 +1,125 @@
+import os
+
+import pytest
+
+from . import metrics_utils
+from . import storage_utils
+from .storage_utils import configure_storage
+from .storage_utils import CountingFileSystem
+from .storage_utils import get_storage_fs
+from .storage_utils import get_storage_path
+from .storage_utils import mirror_store
+from .synthetic_data import write_synthetic_catalog
+from .wrangling_utils import get_cmpi6_model_run
+from .wrangling_utils import get_esm_datastore
+
+
+@pytest.fixture(scope="module")
+def synthetic_store(tmp_path_factory):
+    root_dir = str(tmp_path_factory.mktemp("synthetic_cmip6"))
+    # Only the tas store, which the tests mirror and cache
+    json_path = write_synthetic_catalog(
+        root_dir,
+        mod_id_list=["CanESM5"],
+        var_id_list=["tas"],
+        members=1,
+        areacella=False,
+    )
+    return get_esm_datastore(json_path)
+
+
+@pytest.fixture(autouse=True)
+def reset_storage():
+    yield
+    configure_storage()
+    storage_utils._storage_fs_cache.clear()
+
+
+def test_storage_paths(tmp_path):
+    zstore = "gs://cmip6/CMIP6/CMIP/CCCma/CanESM5/historical/r1i1p1f1/Amon/tas/gn/"
+    configure_storage("local", root=str(tmp_path))
+    assert get_storage_path(zstore) == os.path.join(
+        str(tmp_path), "CMIP6/CMIP/CCCma/CanESM5/historical/r1i1p1f1/Amon/tas/gn/"
+    )
+    configure_storage("memory")
+    assert get_storage_path(zstore).startswith("/CMIP6/CMIP/CCCma")
+    assert get_storage_path("/some/local/store") == "/some/local/store"
+    with pytest.raises(KeyError):
+        configure_storage("s3")
+
+
+def test_memory_backend_with_latency(synthetic_store):
+    zstore = synthetic_store.df["zstore"].iloc[0]
+    configure_storage("memory")
+    mirror_store(zstore, zstore)
+
+    configure_storage("memory", latency=0.01, bandwidth=1e9)
+    fs, _ = get_storage_fs(zstore)
+    dset = get_cmpi6_model_run(synthetic_store, "tas", "CanESM5")[0]
+    assert dset["tas"].isel(time=0).load().shape == (64, 128)
+    assert fs.stats["requests"] > 0
+    assert fs.stats["bytes"] > 0
+
+    # The local store still exists, so this only fails if reads go to memory
+    fs.fs.rm(fs.fs._strip_protocol(zstore), recursive=True)
+    with pytest.raises(Exception):
+        get_cmpi6_model_run(synthetic_store, "tas", "CanESM5")
+
+
+def test_remote_backend_counts_bytes(synthetic_store):
+    # Stores outside the bucket are read as they are, here through the file system
+    configure_storage("remote")
+    metrics_utils.reset_metrics()
+    fs, _ = get_storage_fs(synthetic_store.df["zstore"].iloc[0])
+    assert isinstance(fs, CountingFileSystem)
+    dset = get_cmpi6_model_run(synthetic_store, "tas", "CanESM5")[0]
+    dset["tas"].isel(time=0).load()
+    text = metrics_utils.get_metrics_text()
+    metrics_utils.reset_metrics()
+    storage_lines = [
+        line
+        for line in text.splitlines()
+        if line.startswith('cmip6_dash_bytes_read_total{source="storage"}')
+    ]
+    assert len(storage_lines) == 1
+    assert float(storage_lines[0].split()[-1]) > 0
+
+
+def test_chunk_cache(synthetic_store, tmp_path):
+    zstore = synthetic_store.df["zstore"].iloc[0]
+    configure_storage("local", chunk_cache=str(tmp_path / "chunks"))
+    fs, _ = get_storage_fs(zstore)
+    misses = []
+    for _ in range(2):
+        dset = get_cmpi6_model_run(synthetic_store, "tas", "CanESM5")[0]
+        dset["tas"].isel(time=0).load()
+        misses.append(fs.stats["misses"])
+    assert misses[0] > 0
+    assert misses[1] == misses[0]
+    assert fs.stats["cache_bytes"] >= fs.stats["store_bytes"]
+
+    # A fresh process sharing the cache only reads metadata from the store
+    storage_utils._storage_fs_cache.clear()
+    fs, _ = get_storage_fs(zstore)
+    dset = get_cmpi6_model_run(synthetic_store, "tas", "CanESM5")[0]
+    dset["tas"].isel(time=0).load()
+    assert fs.stats["misses"] == 0
+    assert fs.fs.stats["bytes"] < fs.stats["cache_bytes"]
+
+
+def test_chunk_cache_eviction(tmp_path):
+    configure_storage("memory", chunk_cache=str(tmp_path / "chunks"))
+    fs, _ = get_storage_fs("memory://")
+    memory_fs = fs.fs.fs
+    for num in range(4):
+        memory_fs.pipe_file(f"/evict/{num}", bytes(100))
+    fs = storage_utils.ChunkCacheFileSystem(fs.fs, str(tmp_path / "chunks"), 250)
+    fs.cat_file("/evict/0")
+    fs.cat_file("/evict/1")
+    os.utime(fs._cache_path("/evict/0"), (0, 0))
+    # Reading marks 0 as recently used, so 1 is evicted first
+    fs.cat_file("/evict/0")
+    fs.cat_file("/evict/2")
+    assert os.path.exists(fs._cache_path("/evict/0"))
+    assert not os.path.exists(fs._cache_path("/evict/1"))
+    assert sum(size for _, size, _ in fs._cached_files()) <= 250
@@ -0,0 +1,76 @@
+import pytest
+
+from . import metrics_utils
+from . import wrangling_utils
+from .case_utils import join_members
+from .ensemble_utils import ensemble_stat
+from .ensemble_utils import select_member
+from .metrics_utils import get_metrics_text
+from .synthetic_data import write_synthetic_catalog
+from .wrangling_utils import get_cmpi6_model_run
+from .wrangling_utils import get_esm_datastore
+from .wrangling_utils import get_month_and_year
+from .wrangling_utils import get_month_and_year_for_models
+
+
+@pytest.fixture(scope="module")
+def synthetic_store(tmp_path_factory):
+    root_dir = str(tmp_path_factory.mktemp("synthetic_cmip6"))
+    json_path = write_synthetic_catalog(
+        root_dir, mod_id_list=["CanESM5"], var_id_list=["tas"], members=2
+    )
+    return get_esm_datastore(json_path)
+
+
+def test_synthetic_model_run(synthetic_store):
+    # The same query the dashboard makes, answered from local stores
+    dsets = get_cmpi6_model_run(synthetic_store, "tas", "CanESM5", members=2)
+    assert len(dsets) == 2
+    assert dsets[0]["time"].dt.calendar in ["noleap", "365_day"]
+    assert not dsets[0]["tas"].equals(dsets[1]["tas"])
+    assert get_month_and_year(dsets[0], "tas", "02", "1950").shape == (64, 128)
+    # Bounds are never opened
+    assert list(dsets[0].data_vars) == ["tas"]
+    # With the model's cell areas from its fx store
+    assert dsets[0]["areacella"].dims == ("lat", "lon")
+    assert dsets[0]["areacella"].sum() == pytest.approx(5.1e14, rel=1e-2)
+
+
+def test_members_stacked(synthetic_store):
+    dsets = get_cmpi6_model_run(synthetic_store, "tas", "CanESM5", members=2)
+    stacked = get_cmpi6_model_run(
+        synthetic_store, "tas", "CanESM5", members=2, max_workers=2, stack=True
+    )
+    assert stacked["tas"].dims[0] == "member_num"
+    assert stacked["member_id"].values.tolist() == ["r1i1p1f1", "r2i1p1f1"]
+    assert stacked["tas"].chunks is not None
+    for num, dset in enumerate(dsets):
+        member = select_member(stacked, "tas", str(num))
+        assert member["tas"].drop_vars(["member_num", "member_id"]).equals(dset["tas"])
+    # The same as joining the members for a case
+    joined = join_members(dsets)
+    assert stacked["tas"].drop_vars("member_id").equals(joined["tas"])
+    assert ensemble_stat(stacked, "tas", "mean")["tas"].dims[0] == "time"
+
+
+def test_models_fetched_concurrently(synthetic_store):
+    expected = get_month_and_year(
+        get_cmpi6_model_run(synthetic_store, "tas", "CanESM5")[0], "tas", "02", "1950"
+    )
+    slices = get_month_and_year_for_models(
+        synthetic_store, "tas", ["CanESM5", "CanESM5"], "02", "1950"
+    )
+    assert len(slices) == 2
+    assert all(var_data.equals(expected) for var_data in slices)
+
+
+def test_areacella_looked_up_once(synthetic_store):
+    wrangling_utils._areacella_cache.clear()
+    metrics_utils.reset_metrics()
+    first = get_cmpi6_model_run(synthetic_store, "tas", "CanESM5")[0]
+    second = get_cmpi6_model_run(synthetic_store, "tas", "CanESM5")[0]
+    assert first["areacella"].equals(second["areacella"])
+    # One search per run for its members, and one for the areas of the first
+    text = get_metrics_text()
+    metrics_utils.reset_metrics()
+    assert 'cmip6_dash_span_seconds_count{span="catalog_search"} 3' in text
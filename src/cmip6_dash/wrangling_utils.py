@@ -1,17 +1,43 @@
-import fsspec
-import intake
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
-import pooch
 import xarray as xr
 
+from .metrics_utils import span
+from .metrics_utils import timed
+from .storage_utils import get_mapper
+from .storage_utils import get_storage_config
+from .storage_utils import get_storage_url
+
+# Default bound on the members of one model run opened at once
+MEMBER_OPEN_WORKERS = 8
+
+# Cell areas keyed on (data store, model, grid label), one (lat, lon) array (or None
+# if the model publishes none) per model grid of a catalog
+_areacella_cache = {}
 
-def get_esm_datastore():
-    json_path = "https://storage.googleapis.com/cmip6/pangeo-cmip6.json"
+
+def get_esm_datastore(json_path=None):
+    """Opens the pangeo CMIP6 catalog, or the catalog at json_path if given (e.g. one
+    written by synthetic_data.write_synthetic_catalog()). The pangeo catalog is read
+    from the backend configured in storage_utils."""
+    # Imported here as intake is only needed once the catalog is opened
+    import intake
+
+    if json_path is None:
+        json_path = get_storage_url(
+            "https://storage.googleapis.com/cmip6/pangeo-cmip6.json"
+        )
     col = intake.open_esm_datastore(json_path)
     return col
 
 
 def get_esm_df():
+    if get_storage_config()["backend"] != "remote":
+        csv_url = "https://storage.googleapis.com/cmip6/pangeo-cmip6.csv"
+        return pd.read_csv(get_storage_url(csv_url))
+    import pooch
+
     odie = pooch.create(
         path="./.cache",
         base_url="https://storage.googleapis.com/cmip6/",
@@ -209,13 +235,29 @@ def get_monthly_table_for_var(var_id):
     return var_key[var_id]["monthly_table"]
 
 
-def get_cmpi6_model_run(data_store, var_id, mod_id, exp_id="historical", members=1):
+def get_cmpi6_model_run(
+    data_store,
+    var_id,
+    mod_id,
+    exp_id="historical",
+    members=1,
+    max_workers=MEMBER_OPEN_WORKERS,
+    stack=False,
+):
     """Queries a given data store for historical model runs for the given variable id
 
     Wraps a query for the data_store using variable and model id
     from the associated monthly table. Takes the first model run from the historical
     experiments. Variable id must be supported by get_monthly_table_for_var().
 
+    The model's cell areas are attached to every member as the areacella
+    coordinate when the data store has them (see get_cmip6_areacella()).
+
+    Members are opened concurrently, each paying its own consolidated metadata
+    round trip in a thread of a pool of at most max_workers threads. The stores are
+    mapped before the pool starts so every member reads through the filesystem
+    (and connection pool) of the calling thread.
+
     Parameters
     ----------
     data_store : esm_datastore
@@ -227,11 +269,21 @@ def get_cmpi6_model_run(data_store, var_id, mod_id, exp_id="historical", members
         The climate model string to use in query. If the model does not provide
         var function will fail mysteriously and inelegantly- get_models_with_var()
         may help.
+    exp_id : string
+        The experiment to open
+    members : int
+        Number of members to open
+    max_workers : int
+        Maximum number of members opened at once
+    stack : bool
+        Return a single dataset with var_id stacked lazily along a new member_num
+        dimension instead of a list, see stack_members()
 
     Returns
     -------
     dsets : list
-       A list of the xarray datasets matching the query
+       A list of the xarray datasets matching the query, in member order. A single
+       xarray.Dataset if stack is True.
     """
 
     # Querying datastore to get xarr file
@@ -242,20 +294,262 @@ def get_cmpi6_model_run(data_store, var_id, mod_id, exp_id="historical", members
         variable_id=[var_id],
     )
 
-    datasets = data_store.search(**query_variable_id)
+    with span("catalog_search", mod_id=mod_id, var_id=var_id, exp_id=exp_id):
+        datasets = data_store.search(**query_variable_id)
 
-    dsets = []
     # Getting the member number for the each experiment
+    member_ids = []
+    mappers = []
     for member_num in range(members):
-        member_ids = datasets.df["member_id"][member_num]
-        dstore_filename = datasets.df.query("member_id==@member_ids")["zstore"].iloc[0]
-        dsets.append(
-            xr.open_zarr(fsspec.get_mapper(dstore_filename), consolidated=True)
-        )
+        member_id = datasets.df["member_id"].iloc[member_num]
+        dstore_filename = datasets.df.query("member_id==@member_id")["zstore"].iloc[0]
+        member_ids.append(member_id)
+        mappers.append((dstore_filename, get_mapper(dstore_filename)))
+
+    def open_member(mapper):
+        with span("zarr_open", zstore=mapper[0]):
+            return open_zarr_var(mapper[1], var_id)
+
+    if members == 1:
+        dsets = [open_member(mappers[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, members)) as pool:
+            dsets = list(pool.map(open_member, mappers))
+
+    # Cell areas, so reductions weight by them rather than by cos(lat)
+    areacella = get_cmip6_areacella(
+        data_store, mod_id, exp_id, datasets.df["grid_label"].iloc[0]
+    )
+    if areacella is not None:
+        dsets = [attach_areacella(dset, areacella) for dset in dsets]
 
+    if stack:
+        return stack_members(dsets, var_id, member_ids)
     return dsets
 
 
+def select_var(dset, var_id):
+    """Keeps only var_id and the coordinates it needs from a dataset opened with
+    decode_cf=False and decodes those
+
+    CMIP6 stores and case files carry bounds (time_bnds, lat_bnds, lon_bnds, ...)
+    that the dashboard never uses. Left undecoded and dropped, their times are never
+    converted to cftime objects and no memory is held for them.
+
+    Parameters
+    ----------
+    dset : xarray.Dataset
+        Opened with decode_cf=False
+    var_id : string
+        The data variable to keep
+
+    Returns
+    -------
+    xarray.Dataset
+        var_id with its dimension coordinates and the coordinates named in its
+        coordinates attribute (e.g. height), CF decoded
+    """
+    coord_names = dset[var_id].attrs.get("coordinates", "").split()
+    keep = [var_id] + [name for name in coord_names if name in dset.variables]
+    decoded = xr.decode_cf(dset[keep])
+    # Closing the selection closes the file or store it came from
+    decoded.set_close(dset.close)
+    return decoded
+
+
+def open_zarr_var(store, var_id):
+    """Opens only var_id (and its coordinates) from a zarr store, see select_var()
+
+    Parameters
+    ----------
+    store : MutableMapping or str
+        The store, e.g. from get_mapper()
+    var_id : string
+        The data variable to open
+
+    Returns
+    -------
+    xarray.Dataset
+    """
+    return select_var(xr.open_zarr(store, consolidated=True, decode_cf=False), var_id)
+
+
+def stack_members(dsets, var_id, member_ids):
+    """Stacks the members of a model run along a new member_num dimension
+
+    Members are numbered in order as by case_utils.join_members(), so the result
+    works with the ensemble and plotting functions, and their labels are kept as
+    the member_id coordinate. Only var_id gains the dimension, coordinates and
+    other variables (bounds, ...) are taken from the first member. Nothing is
+    loaded.
+
+    Parameters
+    ----------
+    dsets : list of xarray.Dataset
+        The members, as returned by get_cmpi6_model_run()
+    var_id : string
+        The variable to stack
+    member_ids : list of str
+        Labels of the members, e.g. "r1i1p1f1"
+
+    Returns
+    -------
+    xarray.Dataset
+    """
+    stacked = xr.concat(
+        dsets,
+        dim=pd.Index(range(len(dsets)), name="member_num"),
+        data_vars=[var_id],
+        coords="minimal",
+        compat="override",
+    )
+    return stacked.assign_coords(member_id=("member_num", list(member_ids)))
+
+
+def get_cmpi6_model_runs(
+    data_store, var_id, mod_id_list, exp_id="historical", members=1, max_workers=None
+):
+    """Opens the runs of several models concurrently
+
+    Each model's catalog search and zarr metadata reads happen in their own thread,
+    so opening N models takes about as long as opening the slowest one.
+
+    Parameters
+    ----------
+    data_store : esm_datastore
+        The data store to query
+    var_id : string
+        The variable to open, see get_cmpi6_model_run()
+    mod_id_list : list of str
+        The models to open
+    exp_id : string
+        The experiment to open
+    members : int
+        Number of members to open for each model
+    max_workers : int, optional
+        Maximum number of models opened at once, all of them by default
+
+    Returns
+    -------
+    list
+        The list of datasets returned by get_cmpi6_model_run() for each model, in
+        the order of mod_id_list
+    """
+
+    def open_model(mod_id):
+        return get_cmpi6_model_run(data_store, var_id, mod_id, exp_id, members)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(mod_id_list)) as pool:
+        return list(pool.map(open_model, mod_id_list))
+
+
+def get_month_and_year_for_models(
+    data_store,
+    var_id,
+    mod_id_list,
+    month,
+    year,
+    exp_id="historical",
+    layer=1,
+    max_workers=None,
+):
+    """Fetches the same month of the first member of several models concurrently
+
+    Opening, slicing and loading the slice all happen in one thread per model, so
+    the chunk reads of the different models overlap too.
+
+    Parameters
+    ----------
+    data_store : esm_datastore
+        The data store to query
+    var_id : string
+        The variable to fetch
+    mod_id_list : list of str
+        The models to fetch
+    month, year, exp_id, layer :
+        As for get_month_and_year()
+    max_workers : int, optional
+        Maximum number of models fetched at once, all of them by default
+
+    Returns
+    -------
+    list of xarray.DataArray
+        The loaded (lat, lon) slice of each model, in the order of mod_id_list
+    """
+
+    def fetch_slice(mod_id):
+        dset = get_cmpi6_model_run(data_store, var_id, mod_id, exp_id)[0]
+        return get_month_and_year(dset, var_id, month, year, exp_id, layer).load()
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(mod_id_list)) as pool:
+        return list(pool.map(fetch_slice, mod_id_list))
+
+
+def get_cmip6_areacella(data_store, mod_id, exp_id="historical", grid_label=None):
+    """Fetches the grid cell areas (the fx variable areacella) for a model
+
+    The areas are looked up and loaded once per model and grid of a data store and
+    kept in memory, so repeat calls neither search the catalog nor open the store.
+
+    Parameters
+    ----------
+    data_store : esm_datastore
+        The data store to query
+    mod_id : string
+        The climate model string to use in query
+    exp_id : string
+        The experiment to take the areas from if it publishes them, otherwise any
+        experiment's are used as they are the same on the same grid
+    grid_label : string, optional
+        Only areas of this grid (e.g. "gn"), any grid if None
+
+    Returns
+    -------
+    xarray.DataArray or None
+        Cell areas in m2, None if the model does not publish them. Assign it as a
+        coordinate with attach_areacella() to have reduction_utils weight by it.
+    """
+    cache_key = (data_store, mod_id, grid_label)
+    if cache_key not in _areacella_cache:
+        _areacella_cache[cache_key] = _load_cmip6_areacella(
+            data_store, mod_id, exp_id, grid_label
+        )
+    return _areacella_cache[cache_key]
+
+
+def _load_cmip6_areacella(data_store, mod_id, exp_id, grid_label):
+    query_variable_id = dict(
+        source_id=mod_id,
+        table_id=["fx"],
+        variable_id=["areacella"],
+    )
+    if grid_label is not None:
+        query_variable_id["grid_label"] = [grid_label]
+    with span("catalog_search", mod_id=mod_id, var_id="areacella", exp_id=exp_id):
+        datasets_df = data_store.search(**query_variable_id).df
+    if len(datasets_df) == 0:
+        return None
+    same_exp = datasets_df[datasets_df["experiment_id"] == exp_id]
+    if len(same_exp) > 0:
+        datasets_df = same_exp
+    dstore_filename = datasets_df["zstore"].iloc[0]
+    with span("zarr_open", zstore=dstore_filename):
+        dset = open_zarr_var(get_mapper(dstore_filename), "areacella")
+        return dset["areacella"].load()
+
+
+def attach_areacella(dset, areacella):
+    """Adds cell areas from get_cmip6_areacella() to dset as the areacella
+    coordinate, leaving dset as it is if they are of another grid"""
+    areacella = areacella.transpose("lat", "lon")
+    if areacella.shape != (dset.sizes["lat"], dset.sizes["lon"]):
+        return dset
+    return dset.assign_coords(
+        areacella=(("lat", "lon"), areacella.values, areacella.attrs)
+    )
+
+
+@timed("get_month_and_year")
 def get_month_and_year(dset, var_id, month, year, exp_id="historical", layer=1):
     """
     This function filters an xarray dset for a given month, year and layer from